@@ -0,0 +1,152 @@
+"""
+drive_cache.py – Cache en disco (SQLite) del contenido descargado de Google Drive.
+
+Cada archivo se guarda por su id junto con la revisión con la que se descargó
+(`md5Checksum`, o `modifiedTime` para los Google Docs, que no tienen checksum). Si
+la revisión que devuelve files.list no coincide, la entrada está desactualizada y
+el archivo se vuelve a descargar, así que una corrida repetida sólo baja lo que
+cambió. Evicción LRU por tamaño total.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import config
+
+
+def file_revision(file_info: Dict[str, Any]) -> Optional[str]:
+    """Identifica el contenido de un archivo según su metadata de files.list (None si no alcanza)."""
+    if file_info.get("md5Checksum"):
+        return f"md5:{file_info['md5Checksum']}"
+    if file_info.get("modifiedTime"):
+        return f"modified:{file_info['modifiedTime']}"
+    return None
+
+
+class DriveFileCache:
+    """Contenido de archivos de Drive por (id, revisión), con evicción LRU por tamaño y contadores."""
+
+    def __init__(
+        self,
+        path: str = config.DRIVE_CACHE_PATH,
+        max_bytes: int = config.DRIVE_CACHE_MAX_BYTES,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        # Lo usan los hilos de descarga y el hilo que arma la estructura
+        self._db_lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        # Apertura diferida: no se crea el archivo hasta el primer uso
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS drive_files (
+                    file_id TEXT PRIMARY KEY,
+                    revision TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_drive_files_last_access ON drive_files(last_access)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, file_info: Dict[str, Any]) -> Optional[str]:
+        """Contenido guardado de `file_info` si sigue en la misma revisión."""
+        revision = file_revision(file_info)
+        if revision is None:
+            self.bypassed += 1
+            return None
+        with self._db_lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT revision, content FROM drive_files WHERE file_id = ?", (file_info["id"],)
+            ).fetchone()
+            if row is None or row[0] != revision:
+                if row is not None:
+                    self.stale += 1
+                self.misses += 1
+                return None
+            db.execute(
+                "UPDATE drive_files SET last_access = ? WHERE file_id = ?", (time.time(), file_info["id"])
+            )
+            db.commit()
+        self.hits += 1
+        return row[1]
+
+    def set(self, file_info: Dict[str, Any], content: str) -> None:
+        revision = file_revision(file_info)
+        if revision is None:
+            return
+        size = len(content.encode("utf-8"))
+        with self._db_lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO drive_files (file_id, revision, content, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (file_info["id"], revision, content, size, time.time()),
+            )
+            self._evict(db)
+            db.commit()
+
+    def _evict(self, db: sqlite3.Connection) -> None:
+        """Elimina los archivos menos usados hasta respetar max_bytes."""
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM drive_files").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        victims = []
+        for file_id, size in db.execute("SELECT file_id, size FROM drive_files ORDER BY last_access ASC"):
+            if total <= self.max_bytes:
+                break
+            victims.append((file_id,))
+            total -= size
+        db.executemany("DELETE FROM drive_files WHERE file_id = ?", victims)
+        self.evictions += len(victims)
+
+    def clear(self) -> None:
+        with self._db_lock:
+            db = self._db()
+            db.execute("DELETE FROM drive_files")
+            db.commit()
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> Dict[str, Any]:
+        entries, total = 0, 0
+        if self._conn is not None or os.path.exists(self.path):
+            with self._db_lock:
+                entries, total = self._db().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM drive_files"
+                ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "bytes": total,
+        }
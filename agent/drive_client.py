@@ -4,28 +4,106 @@ drive_client.py – Cliente de Google Drive para leer inputs de candidatos.
 
 import io
 import os
-from typing import Optional, List, Dict, Any
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, List, Dict, Any, Callable
 from rich.console import Console
 
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseDownload
 
 import config
+from agent.drive_cache import DriveFileCache
 
 console = Console()
 
 SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
 
+FOLDER_MIME = "application/vnd.google-apps.folder"
+# Máximo que acepta files.list por página
+PAGE_SIZE = 1000
+# Metadata pedida en files.list: la revisión (md5Checksum/modifiedTime) es la clave del cache
+FILE_FIELDS = "id, name, mimeType, modifiedTime, md5Checksum"
+# Errores HTTP transitorios que vale la pena reintentar
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
 
-class DriveClient:
-    """Cliente para leer archivos desde Google Drive."""
+# on_progress(completados, total, file_info, error) — error es None si la descarga salió bien
+ProgressCallback = Callable[[int, int, Dict[str, Any], Optional[Exception]], None]
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUS
+    # Errores de red/transporte (httplib2, socket, timeouts)
+    return isinstance(error, (OSError, ConnectionError)) or type(error).__module__.startswith("httplib2")
+
+
+def print_progress(done: int, total: int, file_info: Dict[str, Any], error: Optional[Exception]):
+    if error is None:
+        console.print(f"  [dim]📥 [{done}/{total}] {file_info['name']}[/dim]")
+    else:
+        console.print(f"[bold red]  ❌ [{done}/{total}] Error descargando {file_info['name']}: {error}[/bold red]")
 
-    def __init__(self, credentials_path: str = config.DRIVE_CREDENTIALS_PATH):
+
+class DriveClient:
+    """
+    Cliente para leer archivos desde Google Drive.
+
+    Los listados siguen `nextPageToken` hasta el final. Las descargas corren en un
+    pool de `workers` hilos (cada hilo con su propio service: el cliente HTTP de
+    googleapiclient no es thread-safe), con hasta `retries` reintentos por archivo
+    ante errores transitorios y progreso vía `on_progress`. Con `use_cache`, los
+    archivos cuya revisión no cambió se leen del cache en disco (ver drive_cache.py).
+    `service` permite inyectar un service ya construido (p. ej. un fake en tests).
+    """
+
+    def __init__(
+        self,
+        credentials_path: str = config.DRIVE_CREDENTIALS_PATH,
+        service=None,
+        workers: Optional[int] = None,
+        retries: Optional[int] = None,
+        retry_backoff: Optional[float] = None,
+        on_progress: Optional[ProgressCallback] = print_progress,
+        use_cache: bool = config.DRIVE_CACHE_ENABLED,
+        cache: Optional[DriveFileCache] = None,
+    ):
         self.credentials_path = credentials_path
-        self.service = self._authenticate()
+        self.workers = workers or config.DRIVE_DOWNLOAD_WORKERS
+        self.retries = config.DRIVE_DOWNLOAD_RETRIES if retries is None else retries
+        self.retry_backoff = config.DRIVE_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+        self.on_progress = on_progress
+        self._local = threading.local()
+        # Cache de contenido por revisión (None = deshabilitado)
+        self.cache: Optional[DriveFileCache] = None
+        if use_cache:
+            self.cache = cache or DriveFileCache()
+        if service is not None:
+            self.creds = None
+            self.service = service
+        else:
+            self.creds = self._authenticate()
+            self.service = build("drive", "v3", credentials=self.creds)
+
+    def close(self) -> None:
+        """Cierra el cache de descargas (su conexión SQLite se reabre si se vuelve a usar)."""
+        if self.cache is not None:
+            self.cache.close()
+
+    def _service(self):
+        """Service del hilo actual (el inyectado se comparte tal cual)."""
+        if self.creds is None:
+            return self.service
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = build("drive", "v3", credentials=self.creds)
+            self._local.service = service
+        return service
 
     def _authenticate(self):
         """Autenticación OAuth2 con token cacheado."""
@@ -62,47 +140,55 @@ class DriveClient:
             with open(token_path, "w") as token:
                 token.write(creds.to_json())
 
-        return build("drive", "v3", credentials=creds)
+        return creds
+
+    def _list(self, query: str, fields: str) -> List[Dict[str, str]]:
+        """Todas las páginas de un files.list."""
+        files: List[Dict[str, str]] = []
+        page_token = None
+        while True:
+            results = (
+                self._service().files()
+                .list(q=query, fields=f"nextPageToken, files({fields})",
+                      pageSize=PAGE_SIZE, pageToken=page_token)
+                .execute()
+            )
+            files.extend(results.get("files", []))
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                return files
 
     def list_files(self, folder_id: str) -> List[Dict[str, str]]:
         """
         Lista archivos en una carpeta de Drive.
 
         Returns:
-            Lista de dicts con id, name, mimeType
+            Lista de dicts con id, name, mimeType, modifiedTime y md5Checksum (sólo
+            archivos binarios/de texto; los Google Docs no lo tienen)
         """
         query = f"'{folder_id}' in parents and trashed = false"
-        results = (
-            self.service.files()
-            .list(q=query, fields="files(id, name, mimeType)", pageSize=100)
-            .execute()
-        )
-        return results.get("files", [])
+        return self._list(query, FILE_FIELDS)
 
     def list_folders(self, folder_id: str) -> List[Dict[str, str]]:
         """Lista subcarpetas en una carpeta de Drive."""
         query = (
             f"'{folder_id}' in parents "
-            "and mimeType = 'application/vnd.google-apps.folder' "
+            f"and mimeType = '{FOLDER_MIME}' "
             "and trashed = false"
         )
-        results = (
-            self.service.files()
-            .list(q=query, fields="files(id, name)", pageSize=100)
-            .execute()
-        )
-        return results.get("files", [])
+        return self._list(query, "id, name")
 
     def download_file(self, file_id: str, mime_type: Optional[str] = None) -> str:
         """Descarga el contenido de un archivo como texto decodificado."""
+        service = self._service()
         if mime_type == "application/vnd.google-apps.document":
             # Exportar Google Doc como texto plano
-            request = self.service.files().export_media(
+            request = service.files().export_media(
                 fileId=file_id, mimeType="text/plain"
             )
         else:
             # Descargar archivo directamente
-            request = self.service.files().get_media(fileId=file_id)
+            request = service.files().get_media(fileId=file_id)
 
         buffer = io.BytesIO()
         downloader = MediaIoBaseDownload(buffer, request)
@@ -118,27 +204,70 @@ class DriveClient:
         except UnicodeDecodeError:
             return content.decode("latin-1")
 
+    def _download_with_retry(self, file_info: Dict[str, Any]) -> str:
+        attempt = 0
+        while True:
+            try:
+                return self.download_file(file_info["id"], file_info.get("mimeType"))
+            except Exception as e:
+                if attempt >= self.retries or not is_retryable(e):
+                    raise
+                # Backoff exponencial: 0.5s, 1s, 2s...
+                time.sleep(self.retry_backoff * (2 ** attempt))
+                attempt += 1
+
+    def download_many(self, files: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Descarga `files` en paralelo. Devuelve {file_id: contenido}, o la excepción
+        final para los archivos que fallaron después de los reintentos. Los que están
+        en el cache con la misma revisión no se descargan.
+        """
+        results: Dict[str, Any] = {}
+        pending = []
+        done = 0
+        for file_info in files:
+            cached = self.cache.get(file_info) if self.cache else None
+            if cached is None:
+                pending.append(file_info)
+                continue
+            results[file_info["id"]] = cached
+            done += 1
+            if self.on_progress:
+                self.on_progress(done, len(files), file_info, None)
+        if not pending:
+            return results
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="drive") as pool:
+            futures = {pool.submit(self._download_with_retry, f): f for f in pending}
+            for future in as_completed(futures):
+                file_info = futures[future]
+                try:
+                    results[file_info["id"]] = future.result()
+                    error = None
+                    if self.cache:
+                        self.cache.set(file_info, results[file_info["id"]])
+                except Exception as e:
+                    results[file_info["id"]] = error = e
+                done += 1
+                if self.on_progress:
+                    self.on_progress(done, len(files), file_info, error)
+        return results
+
     def download_folder_as_inputs(
         self, folder_id: str, target_dir: str
     ) -> Dict[str, str]:
         """Descarga todos los archivos de una carpeta de Drive a un directorio local."""
         os.makedirs(target_dir, exist_ok=True)
-        files = self.list_files(folder_id)
+        # Saltar carpetas
+        files = [f for f in self.list_files(folder_id) if f["mimeType"] != FOLDER_MIME]
+        contents = self.download_many(files)
         inputs = {}
 
         for file_info in files:
             name = file_info["name"]
             mime = file_info["mimeType"]
-
-            # Saltar carpetas
-            if mime == "application/vnd.google-apps.folder":
-                continue
-
-            console.print(f"  [dim]📥 Descargando: {name}[/dim]")
-            try:
-                content = self.download_file(file_info["id"], mime)
-            except Exception as e:
-                console.print(f"[bold red]  ❌ Error descargando {name}: {e}[/bold red]")
+            content = contents[file_info["id"]]
+            if isinstance(content, Exception):
                 continue
 
             # Guardar localmente
@@ -178,60 +307,65 @@ class DriveClient:
             case_notes.txt
             references.txt
 
+        Los listados de las carpetas de candidatos y todas las descargas corren en
+        paralelo (ver download_many).
+
         Returns:
             Dict con search_inputs y candidates
         """
         search_inputs: Dict[str, str] = {}
         candidates: Dict[str, Dict[str, str]] = {}
 
-        files = self.list_files(folder_id)
+        root_files = [f for f in self.list_files(folder_id) if f["mimeType"] != FOLDER_MIME]
         folders = self.list_folders(folder_id)
 
+        # Subcarpetas = candidatos
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="drive") as pool:
+            folder_files = list(pool.map(lambda folder: self.list_files(folder["id"]), folders))
+        for folder, files in zip(folders, folder_files):
+            console.print(f"  [cyan]👤 Candidato encontrado: {folder['name']} ({len(files)} archivos)[/cyan]")
+
+        candidate_files = [
+            [f for f in files if f["mimeType"] != FOLDER_MIME] for files in folder_files
+        ]
+        contents = self.download_many(root_files + [f for files in candidate_files for f in files])
+
         # Archivos de nivel raíz = inputs de la búsqueda
-        for f in files:
+        for f in root_files:
+            content = contents[f["id"]]
+            if isinstance(content, Exception):
+                continue
             name = f["name"].lower()
-            try:
-                content = self.download_file(f["id"], f["mimeType"])
-
-                if "brief" in name or "jd" in name or "job" in name:
-                    search_inputs["jd_text"] = content
-                elif "kickoff" in name or "kick-off" in name or "kick_off" in name:
-                    search_inputs["kickoff_notes"] = content
-                elif "company" in name or "context" in name or "compañía" in name:
-                    search_inputs["company_context"] = content
-                elif "culture" in name or "cultura" in name:
-                    search_inputs["client_culture"] = content
-            except Exception as e:
-                console.print(f"[bold red]  ❌ Error descargando input de búsqueda {f['name']}: {e}[/bold red]")
-
-        # Subcarpetas = candidatos
-        for folder in folders:
-            candidate_id = folder["name"]
-            console.print(f"  [cyan]👤 Candidato encontrado: {candidate_id}[/cyan]")
-            candidate_files = self.list_files(folder["id"])
+            if "brief" in name or "jd" in name or "job" in name:
+                search_inputs["jd_text"] = content
+            elif "kickoff" in name or "kick-off" in name or "kick_off" in name:
+                search_inputs["kickoff_notes"] = content
+            elif "company" in name or "context" in name or "compañía" in name:
+                search_inputs["company_context"] = content
+            elif "culture" in name or "cultura" in name:
+                search_inputs["client_culture"] = content
+
+        for folder, files in zip(folders, candidate_files):
             candidate_inputs = {}
-
-            for f in candidate_files:
+            for f in files:
+                content = contents[f["id"]]
+                if isinstance(content, Exception):
+                    continue
                 name = f["name"].lower()
-                try:
-                    content = self.download_file(f["id"], f["mimeType"])
-
-                    if "cv" in name or "resume" in name or "curriculum" in name:
-                        candidate_inputs["cv_text"] = content
-                    elif "interview" in name or "entrevista" in name:
-                        candidate_inputs["interview_notes"] = content
-                    elif "test" in name or "assessment" in name:
-                        candidate_inputs["tests_text"] = content
-                    elif "case" in name or "caso" in name or "conductual" in name:
-                        candidate_inputs["case_notes"] = content
-                    elif "reference" in name or "referencia" in name:
-                        candidate_inputs["references_text"] = content
-                    elif "culture" in name or "cultura" in name:
-                        candidate_inputs["client_culture"] = content
-                except Exception as e:
-                    console.print(f"[bold red]  ❌ Error descargando archivo de candidato {f['name']}: {e}[/bold red]")
+                if "cv" in name or "resume" in name or "curriculum" in name:
+                    candidate_inputs["cv_text"] = content
+                elif "interview" in name or "entrevista" in name:
+                    candidate_inputs["interview_notes"] = content
+                elif "test" in name or "assessment" in name:
+                    candidate_inputs["tests_text"] = content
+                elif "case" in name or "caso" in name or "conductual" in name:
+                    candidate_inputs["case_notes"] = content
+                elif "reference" in name or "referencia" in name:
+                    candidate_inputs["references_text"] = content
+                elif "culture" in name or "cultura" in name:
+                    candidate_inputs["client_culture"] = content
 
-            candidates[candidate_id] = candidate_inputs
+            candidates[folder["name"]] = candidate_inputs
 
         return {
             "search_inputs": search_inputs,
@@ -0,0 +1,91 @@
+import json
+from typing import Any, Dict, List, Optional
+
+import config
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars per token), good enough for budgeting."""
+    return len(text) // 4 + 1
+
+
+def digest_observation(observation: Any, max_chars: int = 200) -> str:
+    """
+    Compact one-line summary of an agent output: scalars are kept, long strings
+    are cut, and lists/dicts are reduced to their size.
+    """
+    if not isinstance(observation, dict):
+        text = str(observation)
+        return text if len(text) <= max_chars else text[:max_chars - 3] + "..."
+
+    parts: Dict[str, Any] = {}
+    for key, value in observation.items():
+        if value is None or isinstance(value, (bool, int, float)):
+            parts[key] = value
+        elif isinstance(value, str):
+            parts[key] = value if len(value) <= 60 else value[:57] + "..."
+        elif isinstance(value, list):
+            parts[key] = f"[{len(value)} items]"
+        elif isinstance(value, dict):
+            parts[key] = f"{{{len(value)} keys}}"
+    text = json.dumps(parts, ensure_ascii=False)
+    return text if len(text) <= max_chars else text[:max_chars - 3] + "..."
+
+
+class WorkingMemory:
+    """
+    Bounded memory for the GEM 6 reasoning loop.
+
+    The last `window` steps are rendered in full; older steps are replaced by
+    compact digests. If the rendered section still exceeds `token_budget`, the
+    oldest full steps are digested and then the oldest digests dropped.
+    """
+
+    def __init__(self, window: Optional[int] = None, token_budget: Optional[int] = None):
+        self.window = config.GEM6_MEMORY_WINDOW if window is None else window
+        self.token_budget = config.GEM6_MEMORY_TOKEN_BUDGET if token_budget is None else token_budget
+        self.entries: List[Dict[str, Any]] = []
+        self.digests: List[Dict[str, Any]] = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, step: int, agent: str, thought: str, observation: Any, valid_contract: bool):
+        self.entries.append({
+            "step": step,
+            "agent": agent,
+            "thought": thought,
+            "observation": observation,
+            "valid_contract": valid_contract
+        })
+        # Digest once at insert time instead of on every render
+        self.digests.append({
+            "step": step,
+            "agent": agent,
+            "thought": thought if len(thought) <= 120 else thought[:117] + "...",
+            "digest": digest_observation(observation),
+            "valid_contract": valid_contract
+        })
+
+    def _build(self, full_from: int, dropped: int) -> List[Dict[str, Any]]:
+        items: List[Dict[str, Any]] = []
+        if dropped:
+            items.append({"omitted_steps": dropped})
+        for i in range(dropped, len(self.entries)):
+            items.append(self.entries[i] if i >= full_from else self.digests[i])
+        return items
+
+    def render(self) -> List[Dict[str, Any]]:
+        """Memory section to inject into the GEM 6 prompt, within the token budget"""
+        full_from = max(0, len(self.entries) - self.window)
+        dropped = 0
+        items = self._build(full_from, dropped)
+        while estimate_tokens(json.dumps(items, ensure_ascii=False)) > self.token_budget:
+            if full_from < len(self.entries):
+                full_from += 1
+            elif dropped < len(self.entries):
+                dropped += 1
+            else:
+                break
+            items = self._build(full_from, dropped)
+        return items
@@ -1,16 +1,23 @@
 import os
 import json
+import time
 import uuid
 import asyncio
 from typing import Dict, Any, List, Optional
-from utils.gem_core import GEMClient, validate_contract, logger
-from agent.prompt_builder import build_prompt, build_agent_prompt
+from utils.gem_core import GEMClient, logger
+from utils.contracts import registry as contract_registry
+from agent.prompt_builder import build_gem6_prompt_parts, build_agent_prompt_parts, get_prompt_versions
+from agent.gem6.memory import WorkingMemory, estimate_tokens
+from agent.gem6.metrics import MetricsCollector
+from utils.input_loader import fingerprint_candidate
 import config
-from utils.ws_logger import broadcast_log
+from utils.ws_logger import broadcast_log, broadcast_progress, pipeline_state
 
 class GEM6Orchestrator:
     def __init__(self, *args, **kwargs):
-        self.client = GEMClient(os.getenv("DB_API_URL", "http://localhost:8000"))
+        # A shared DB client (e.g. from the API lifespan) is borrowed, not closed here
+        self._owns_client = kwargs.get("db_client") is None
+        self.client = kwargs.get("db_client") or GEMClient(config.DB_API_URL)
         self.thresholds = {
             "scoring_cutoff": config.SCORING_CUTOFF,
             "qa_cutoff": config.QA_GATE_CUTOFF
@@ -19,19 +26,87 @@ class GEM6Orchestrator:
         self.output_dir = kwargs.get("output_dir") or (args[1] if len(args) > 1 else None)
         self.config = kwargs.get("config") or (args[2] if len(args) > 2 else {})
         self.search_id = kwargs.get("search_id", self.config.get("search_id"))
+        concurrency = kwargs.get("concurrency") or self.config.get("concurrency") or config.MAX_CONCURRENT_CANDIDATES
+        self.concurrency = max(1, int(concurrency))
+        # force=True reprocesses candidates even if their input fingerprint is unchanged
+        self.force = kwargs.get("force", self.config.get("force", False))
+        self.metrics = MetricsCollector()
+        self.contracts = kwargs.get("contracts") or contract_registry
+        # DriveClient the inputs came from, if any (its download cache stats go in the summary)
+        self.drive = kwargs.get("drive")
+
+    async def aclose(self):
+        """Releases the DB client connection pool if this orchestrator created it"""
+        if self._owns_client:
+            await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    def _versions(self) -> Dict[str, Any]:
+        """Everything besides the inputs that changes a candidate's result"""
+        return {
+            "prompts": get_prompt_versions(),
+            "provider": getattr(self.gemini, "provider", None),
+            "model": getattr(self.gemini, "model", None),
+        }
+
+    async def _load_prior_result(self, entity_id: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Returns the stored result of a finished run with the same input fingerprint"""
+        entity = await self.client.get_entity(entity_id)
+        if not entity or entity.get("current_stage") != "COMPLETED":
+            return None
+        metadata = entity.get("metadata") or {}
+        if isinstance(metadata, str):
+            metadata = json.loads(metadata)
+        if metadata.get("input_fingerprint") != fingerprint or "result" not in metadata:
+            return None
+        return metadata["result"]
 
     async def run_pipeline(self, search_inputs: Dict[str, Any], candidates: Dict[str, Any]):
-        """Entry point to process all candidates"""
-        results = {}
-        for candidate_id, candidate_data in candidates.items():
+        """Entry point to process all candidates (up to `self.concurrency` in flight)"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        versions = self._versions()
+
+        async def run_candidate(candidate_id: str, candidate_data: Dict[str, Any]):
+            fingerprint = fingerprint_candidate(search_inputs, candidate_data, versions)
             context = {
                 "search_inputs": search_inputs,
                 "candidate_id": candidate_id,
                 "candidate_data": candidate_data,
-                "entity_id": candidate_id
+                "entity_id": candidate_id,
+                "fingerprint": fingerprint
             }
-            results[candidate_id] = await self.process_context(context)
-        
+            async with semaphore:
+                try:
+                    if not self.force:
+                        prior = await self._load_prior_result(candidate_id, fingerprint)
+                        if prior is not None:
+                            logger.info(f"Skipping {candidate_id}: inputs unchanged since last run")
+                            return {**prior, "skipped": True}
+                    return await self.process_context(context)
+                except Exception as e:
+                    # Isolate failures: one candidate crashing must not abort the batch
+                    logger.error(f"Candidate {candidate_id} crashed: {e}")
+                    return {"status": "FAILED", "reason": "EXCEPTION", "error": str(e)}
+
+        candidate_ids = list(candidates.keys())
+        outcomes = await asyncio.gather(
+            *(run_candidate(cid, candidates[cid]) for cid in candidate_ids)
+        )
+        # Keep results in input order regardless of completion order
+        results = dict(zip(candidate_ids, outcomes))
+        skipped = sum(1 for outcome in outcomes if outcome.get("skipped"))
+
+        # With a write-behind DB client, make the run's rows durable before reporting it done
+        flush = getattr(self.client, "flush", None)
+        if flush is not None:
+            await flush()
+        await pipeline_state.flush()
+
         # Save summary
         if self.output_dir:
             os.makedirs(self.output_dir, exist_ok=True)
@@ -39,8 +114,19 @@ class GEM6Orchestrator:
             summary = {
                 "search_id": self.search_id,
                 "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-                "candidates": results
+                "concurrency": self.concurrency,
+                "skipped_candidates": skipped,
+                "candidates": results,
+                "metrics": self.metrics.export()
             }
+            cache = getattr(self.gemini, "cache", None)
+            if cache is not None:
+                summary["llm_cache"] = cache.stats()
+            drive_cache = getattr(self.drive, "cache", None)
+            if drive_cache is not None:
+                summary["drive_cache"] = drive_cache.stats()
+            if hasattr(self.client, "stats"):
+                summary["db_writes"] = self.client.stats()
             with open(summary_path, "w") as f:
                 json.dump(summary, f, indent=2)
         
@@ -52,7 +138,7 @@ class GEM6Orchestrator:
         
         logger.info(f"Starting AUTONOMOUS orchestration for {entity_id} | Trace: {trace_id}")
         
-        working_memory = []
+        memory = WorkingMemory()
         max_steps = 10
         step = 0
         
@@ -67,18 +153,30 @@ class GEM6Orchestrator:
             step += 1
             logger.info(f"Step {step} for {entity_id}")
 
-            # 1. Build GEM 6 prompt with current memory
-            prompt = build_prompt("gem6", {
-                "search_id": self.search_id,
-                "candidate_id": entity_id,
-                "context": {
-                    **initial_context,
-                    "working_memory": working_memory
-                }
+            # 1. Build GEM 6 prompt with the bounded working memory
+            memory_section = memory.render()
+            prompt = build_gem6_prompt_parts(self.search_id, entity_id, {
+                **initial_context,
+                "working_memory": memory_section
             })
+            prompt_tokens = estimate_tokens(prompt.text)
+            memory_tokens = estimate_tokens(json.dumps(memory_section, ensure_ascii=False))
+            self.metrics.record_histogram("gem6_prompt_tokens_est", prompt_tokens)
+            self.metrics.record_histogram(f"gem6_prompt_tokens_est.step_{step}", prompt_tokens)
+            self.metrics.record_histogram("gem6_memory_tokens_est", memory_tokens)
+            logger.info(f"GEM 6 prompt for {entity_id} step {step}: ~{prompt_tokens} tokens (memory ~{memory_tokens})")
 
             # 2. Call GEM 6 for reasoning
-            result = self.gemini.run_gem(prompt, gem_name="gem6")
+            # The static prefix (system prompt + search inputs) is shared by every step and candidate
+            # In streaming mode generation stops as soon as the decision JSON closes
+            result = await self.gemini.arun_gem(
+                prompt.dynamic,
+                gem_name="gem6",
+                static_prefix=prompt.static,
+                stop_after_json=True,
+                on_progress=self._progress_reporter("gem6", entity_id, step)
+            )
+            self._record_repairs(result)
             gem6_decision = result.get("json", {})
 
             if not gem6_decision:
@@ -89,7 +187,8 @@ class GEM6Orchestrator:
                     "agent_id": "GEM6",
                     "status": "ERROR",
                     "error": "INVALID_JSON",
-                    "trace_id": trace_id
+                    "trace_id": trace_id,
+                    "search_id": self.search_id
                 })
                 return {"status": "FAILED", "reason": "GEM6_INVALID_JSON"}
 
@@ -103,6 +202,7 @@ class GEM6Orchestrator:
 
                 # Broadcast final log
                 await broadcast_log({
+                    "search_id": self.search_id,
                     "gem": "GEM6_FINAL",
                     "action": "Orquestación finalizada",
                     "status": status,
@@ -110,17 +210,24 @@ class GEM6Orchestrator:
                     "thought": thought
                 })
 
-                # Final State Update
+                final_result = {"status": status, "output": final_output, "thought": thought}
+
+                # Final State Update (fingerprint + result let unchanged reruns skip this candidate)
                 await self.client.upsert_entity({
                     "entity_id": entity_id,
                     "current_stage": "COMPLETED",
                     "state": status,
                     "agent_responsible": "GEM6",
                     "trace_id": trace_id,
-                    "metadata": {"final_thought": thought}
+                    "metadata": {
+                        "search_id": self.search_id,
+                        "final_thought": thought,
+                        "input_fingerprint": context_data.get("fingerprint"),
+                        "result": final_result
+                    }
                 })
 
-                return {"status": status, "output": final_output, "thought": thought}
+                return final_result
 
             if action == "call_agent":
                 agent_id = gem6_decision.get("agent_id")
@@ -129,20 +236,13 @@ class GEM6Orchestrator:
                 logger.info(f"Executing Agent: {agent_id}")
 
                 # Call specialized agent
-                agent_output = await self.call_agent(agent_id, payload)
+                agent_output = await self.call_agent(agent_id, payload, entity_id, step)
 
                 # Validation (Contract + Verification)
-                contract_path = f"contracts/{agent_id}_output.schema.json"
-                is_valid = await self.validate_step(entity_id, agent_id, agent_output, contract_path, trace_id)
+                is_valid = await self.validate_step(entity_id, agent_id, agent_output, trace_id)
 
                 # Update memory
-                working_memory.append({
-                    "step": step,
-                    "agent": agent_id,
-                    "thought": thought,
-                    "observation": agent_output,
-                    "valid_contract": is_valid
-                })
+                memory.add(step, agent_id, thought, agent_output, is_valid)
 
                 # Broadcast log for real-time dashboard
                 try:
@@ -150,6 +250,7 @@ class GEM6Orchestrator:
                     passed = is_valid and (score >= self.thresholds.get("scoring_cutoff", 0.4))
 
                     await broadcast_log({
+                        "search_id": self.search_id,
                         "gem": agent_id.upper(),
                         "action": "Procesamiento completado",
                         "score": score,
@@ -168,7 +269,7 @@ class GEM6Orchestrator:
                     "state": "PROCESSING",
                     "agent_responsible": "GEM6",
                     "trace_id": trace_id,
-                    "metadata": {"last_thought": thought}
+                    "metadata": {"search_id": self.search_id, "last_thought": thought}
                 })
             else:
                 logger.warning(f"Unknown action: {action}")
@@ -176,16 +277,46 @@ class GEM6Orchestrator:
 
         return {"status": "FAILED", "reason": "MAX_STEPS_REACHED"}
 
-    async def call_agent(self, agent_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    def _progress_reporter(self, gem: str, entity_id: Optional[str], step: Optional[int]):
+        """
+        Builds the on_progress callback that surfaces streaming progress to live clients.
+        Progress pings are transient: they are not recorded in the run's event log.
+        """
+        async def on_progress(progress: Dict[str, Any]):
+            broadcast_progress({
+                "search_id": self.search_id,
+                "gem": gem.upper(),
+                "action": "Generando respuesta",
+                "status": "STREAMING",
+                "entity_id": entity_id,
+                "step": step,
+                **progress
+            })
+        return on_progress
+
+    def _record_repairs(self, result: Dict[str, Any]):
+        """Counts JSON outputs that only parsed after a local repair"""
+        for repair in result.get("repairs") or []:
+            self.metrics.increment(f"json_repairs.{repair}")
+
+    async def call_agent(self, agent_id: str, payload: Dict[str, Any],
+                         entity_id: Optional[str] = None, step: Optional[int] = None) -> Dict[str, Any]:
         """Calls the agent using GeminiClient or fallback to mock if client missing"""
         logger.info(f"Calling agent {agent_id}")
         
         if self.gemini:
             try:
                 # Use prompt_builder for consistent templating
-                full_prompt = build_agent_prompt(agent_id, payload)
+                prompt = build_agent_prompt_parts(agent_id, payload)
 
-                result = self.gemini.run_gem(full_prompt, gem_name=agent_id)
+                result = await self.gemini.arun_gem(
+                    prompt.dynamic,
+                    gem_name=agent_id,
+                    static_prefix=prompt.static,
+                    stop_after_json=True,
+                    on_progress=self._progress_reporter(agent_id, entity_id, step)
+                )
+                self._record_repairs(result)
                 return result.get("json", {}) or {}
             except Exception as e:
                 logger.error(f"Error calling Gemini for {agent_id}: {e}")
@@ -203,12 +334,16 @@ class GEM6Orchestrator:
             return {"qa_score": 0.98, "issues": [], "human_required": False}
         return {}
 
-    async def validate_step(self, entity_id, agent_id, output, contract_path, trace_id):
-        if not os.path.exists(contract_path):
-            logger.warning(f"No contract found for {agent_id} at {contract_path}. Skipping strict validation.")
+    async def validate_step(self, entity_id, agent_id, output, trace_id):
+        # Contracts are compiled once per process by the registry
+        violations = self.contracts.validate(agent_id, output)
+        if violations is None:
+            logger.warning(f"No contract found for {agent_id}. Skipping strict validation.")
             return True
 
-        is_ok = validate_contract(output, contract_path)
+        is_ok = not violations
+        if violations:
+            logger.warning(f"Contract Violation ({agent_id}): {'; '.join(violations)}")
         await self.client.log_execution({
             "entity_id": entity_id,
             "agent_id": agent_id,
@@ -216,12 +351,13 @@ class GEM6Orchestrator:
             "output_ok": is_ok,
             "time_ms": 100,
             "status": "OK" if is_ok else "CONTRACT_ERROR",
-            "trace_id": trace_id
+            "error": "; ".join(violations) if violations else None,
+            "trace_id": trace_id,
+            "search_id": self.search_id
         })
         return is_ok
 
 if __name__ == "__main__":
-    import time
     orch = GEM6Orchestrator()
     # Mock trigger
     asyncio.run(orch.process_context({"entity_id": "TEST-001", "context": "Discovery request"}))
@@ -1,14 +1,17 @@
+import hashlib
+import inspect
 import json
-import re
 import time
 import os
-from typing import TypedDict, Any, Optional
+from typing import TypedDict, Any, AsyncIterator, Awaitable, Callable, NamedTuple, Optional
 from google import genai
 from rich.console import Console
 import httpx
 import asyncio
 
 import config
+from agent.llm_cache import ResponseCache, make_cache_key
+from agent.json_extract import JsonStreamDetector, extract_json, strip_span
 
 console = Console()
 
@@ -23,30 +26,265 @@ class GeminiResult(TypedDict):
     markdown: str
     raw: str
     usage: GeminiUsage
+    repairs: list[str]  # Reparaciones aplicadas al JSON (vacío si parseó directo)
+
+class StreamOptions(NamedTuple):
+    """Opciones de generación en streaming."""
+    stop_after_json: bool = False  # Cortar la generación apenas cierra el objeto JSON de nivel superior
+    on_progress: Optional[Callable[[dict[str, Any]], Awaitable[None]]] = None
 
 class GeminiClient:
     """Cliente para interactuar con Gemini API u Ollama."""
 
-    def __init__(self, api_key: str, model: str = config.DEFAULT_MODEL):
+    def __init__(
+        self,
+        api_key: str,
+        model: str = config.DEFAULT_MODEL,
+        http_limits: Optional[httpx.Limits] = None,
+        http_timeout: Optional[httpx.Timeout] = None,
+        use_cache: bool = config.LLM_CACHE_ENABLED,
+        response_cache: Optional[ResponseCache] = None,
+        stream: bool = config.LLM_STREAMING,
+    ):
         self.provider = config.LLM_PROVIDER
         if self.provider == "gemini":
             self.client = genai.Client(api_key=api_key)
         self.model = model if self.provider == "gemini" else config.OLLAMA_MODEL
+        # Streaming: sólo en la ruta asíncrona (arun_gem)
+        self.stream = stream
+
+        # Transporte HTTP de Ollama: un pool keep-alive por cliente, creado bajo demanda
+        self.http_limits = http_limits or httpx.Limits(
+            max_connections=config.OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=config.OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=config.OLLAMA_KEEPALIVE_EXPIRY,
+        )
+        self.http_timeout = http_timeout or httpx.Timeout(
+            connect=config.OLLAMA_CONNECT_TIMEOUT,
+            read=config.OLLAMA_READ_TIMEOUT,
+            write=config.OLLAMA_CONNECT_TIMEOUT,
+            pool=config.OLLAMA_READ_TIMEOUT,
+        )
+        self._http: Optional[httpx.Client] = None
+        self._ahttp: Optional[httpx.AsyncClient] = None
+        self._ahttp_loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # Prefijos estáticos ya subidos al proveedor: hash -> cached content (Gemini) / context (Ollama)
+        self._prefix_handles: dict[str, Any] = {}
+        # Hash -> time.monotonic() a partir del cual el handle ya no se usa (handles con TTL)
+        self._prefix_expiry: dict[str, float] = {}
+        self._prefix_locks: dict[str, asyncio.Lock] = {}
+        self.prefix_uploads = 0
+
+        # Cache persistente de respuestas (None = deshabilitado)
+        self.cache: Optional[ResponseCache] = None
+        if use_cache:
+            self.cache = response_cache or ResponseCache()
+
+    def _http_client(self) -> httpx.Client:
+        """Devuelve el cliente HTTP síncrono compartido (pool keep-alive)."""
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.Client(limits=self.http_limits, timeout=self.http_timeout)
+        return self._http
+
+    def _async_http_client(self) -> httpx.AsyncClient:
+        """Devuelve el cliente HTTP asíncrono compartido del event loop actual."""
+        loop = asyncio.get_running_loop()
+        # Un AsyncClient queda ligado al loop donde abrió sus conexiones
+        if self._ahttp is None or self._ahttp.is_closed or self._ahttp_loop is not loop:
+            self._release_async_http_client()
+            self._ahttp = httpx.AsyncClient(limits=self.http_limits, timeout=self.http_timeout)
+            self._ahttp_loop = loop
+        return self._ahttp
+
+    def _release_async_http_client(self) -> None:
+        """Suelta el cliente asíncrono de otro event loop, cerrándolo en su loop si todavía corre."""
+        old, old_loop = self._ahttp, self._ahttp_loop
+        self._ahttp = None
+        self._ahttp_loop = None
+        if old is None or old.is_closed:
+            return
+        if old_loop is not None and old_loop.is_running():
+            # El loop sigue vivo (en otro hilo): las conexiones se cierran allí
+            asyncio.run_coroutine_threadsafe(old.aclose(), old_loop)
+        else:
+            # Su loop ya terminó y sus conexiones no se pueden cerrar desde éste: hay que llamar
+            # a aclose() antes de cerrar cada loop para no dejar sockets abiertos
+            console.print("[dim]  ⚠️  Pool HTTP asíncrono de un event loop ya cerrado descartado sin aclose()[/dim]")
+
+    def close(self) -> None:
+        """Cierra el pool HTTP síncrono."""
+        if self._http is not None:
+            self._http.close()
+            self._http = None
+
+    async def aclose(self) -> None:
+        """Cierra ambos pools HTTP (síncrono y asíncrono), libera los cached contents de Gemini y cierra el cache de respuestas."""
+        self.close()
+        if self.provider == "gemini":
+            for handle in self._prefix_handles.values():
+                if handle.get("cached_content"):
+                    try:
+                        await self.client.aio.caches.delete(name=handle["cached_content"])
+                    except Exception:
+                        pass  # Expiran solos por TTL
+        self._prefix_handles.clear()
+        self._prefix_expiry.clear()
+        self._prefix_locks.clear()
+        if self.cache is not None:
+            # Escribe las marcas LRU pendientes; la conexión se reabre si se vuelve a usar
+            await asyncio.to_thread(self.cache.close)
+        if self._ahttp is not None and self._ahttp_loop is asyncio.get_running_loop():
+            await self._ahttp.aclose()
+        self._release_async_http_client()
+
+    def __enter__(self) -> "GeminiClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    async def __aenter__(self) -> "GeminiClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
 
-    def run_gem(self, prompt: str, gem_name: Optional[str] = None, max_retries: int = config.MAX_RETRIES_ON_BLOCK) -> GeminiResult:
+    def run_gem(
+        self,
+        prompt: str,
+        gem_name: Optional[str] = None,
+        max_retries: int = config.MAX_RETRIES_ON_BLOCK,
+        use_cache: bool = True,
+        static_prefix: Optional[str] = None,
+    ) -> GeminiResult:
+        # La ruta síncrona no reutiliza el prefijo en el proveedor: se envía el texto completo
+        if static_prefix:
+            prompt = static_prefix + prompt
+
+        def compute() -> GeminiResult:
+            if self.provider == "ollama":
+                return self._run_ollama(prompt, gem_name, max_retries)
+            return self._run_gemini(prompt, gem_name, max_retries)
+
+        key = self._cache_key(prompt, gem_name, use_cache)
+        if key is None:
+            return compute()
+        return self.cache.get_or_compute(key, compute, self._is_cacheable)
+
+    async def arun_gem(
+        self,
+        prompt: str,
+        gem_name: Optional[str] = None,
+        max_retries: int = config.MAX_RETRIES_ON_BLOCK,
+        use_cache: bool = True,
+        static_prefix: Optional[str] = None,
+        stream: Optional[bool] = None,
+        stop_after_json: bool = False,
+        on_progress: Optional[Callable[[dict[str, Any]], Awaitable[None]]] = None,
+    ) -> GeminiResult:
+        """
+        Versión asíncrona de run_gem: no bloquea el event loop (ni en la llamada ni en los reintentos).
+
+        Si se pasa `static_prefix` (parte estable del prompt, ej. system prompt + inputs de la
+        búsqueda), se sube una sola vez al proveedor y las llamadas siguientes envían sólo `prompt`:
+        Gemini vía cached content / system_instruction, Ollama vía `context` + `keep_alive`.
+
+        En modo streaming (`stream`, por defecto self.stream) los tokens se consumen a medida que
+        llegan, `on_progress` recibe avances periódicos y, con `stop_after_json`, la generación se
+        corta en cuanto cierra el objeto JSON (el markdown posterior se descarta).
+        """
+        use_stream = self.stream if stream is None else stream
+        options = StreamOptions(stop_after_json, on_progress) if use_stream else None
+
+        async def compute() -> GeminiResult:
+            if self.provider == "ollama":
+                return await self._arun_ollama(prompt, gem_name, max_retries, static_prefix, options)
+            return await self._arun_gemini(prompt, gem_name, max_retries, static_prefix, options)
+
+        early_stop = bool(options and options.stop_after_json)
+        key = self._cache_key((static_prefix or "") + prompt, gem_name, use_cache, early_stop)
+        if key is None:
+            return await compute()
+        return await self.cache.aget_or_compute(key, compute, self._is_cacheable)
+
+    def _cache_key(self, prompt: str, gem_name: Optional[str], use_cache: bool, early_stop: bool = False) -> Optional[str]:
+        """Clave de cache para la llamada, o None si la llamada no debe cachearse."""
+        if self.cache is None:
+            return None
+        cfg = self._gem_config(gem_name)
+        if not use_cache or cfg.get("temperature", 0) > config.LLM_CACHE_MAX_TEMPERATURE:
+            # Temperaturas altas = salida no determinista: siempre ir al modelo
+            self.cache.bypassed += 1
+            return None
+        params = dict(cfg)
         if self.provider == "ollama":
-            return self._run_ollama(prompt, gem_name, max_retries)
-        return self._run_gemini(prompt, gem_name, max_retries)
+            params["seed"] = int(os.getenv("SEED", "42"))
+        if early_stop:
+            # Una respuesta cortada tras el JSON no sirve a quien necesita el markdown
+            params["early_stop"] = True
+        return make_cache_key(self.provider, self.model, params, prompt)
 
-    def _run_ollama(self, prompt: str, gem_name: Optional[str], max_retries: int) -> GeminiResult:
-        """Envía un prompt a Ollama."""
-        url = f"{config.OLLAMA_BASE_URL}/api/generate"
-        cfg = config.GEM_CONFIGS.get(gem_name, {"temperature": 0.3, "top_p": 0.8, "max_tokens": 4096})
+    @staticmethod
+    def _is_cacheable(result: GeminiResult) -> bool:
+        """Sólo se guardan respuestas con JSON válido; un fallo de parseo no debe persistir."""
+        data = result.get("json")
+        return data is not None and "_parse_error" not in data
+
+    def _prefix_lock(self, key: str) -> asyncio.Lock:
+        lock = self._prefix_locks.get(key)
+        if lock is None:
+            lock = self._prefix_locks[key] = asyncio.Lock()
+        return lock
+
+    def _live_prefix_handle(self, key: str) -> Optional[dict[str, Any]]:
+        handle = self._prefix_handles.get(key)
+        expires_at = self._prefix_expiry.get(key)
+        if handle is not None and expires_at is not None and time.monotonic() >= expires_at:
+            return None
+        return handle
 
-        payload = {
+    async def _prefix_handle(self, static_prefix: str, upload) -> dict[str, Any]:
+        """
+        Sube el prefijo una sola vez por cliente (llamadas concurrentes esperan a la primera).
+        Si `upload` devuelve `ttl_seconds`, el prefijo se vuelve a subir un poco antes de que venza.
+        """
+        key = hashlib.sha256(static_prefix.encode("utf-8")).hexdigest()
+        handle = self._live_prefix_handle(key)
+        if handle is not None:
+            return handle
+        async with self._prefix_lock(key):
+            handle = self._live_prefix_handle(key)
+            if handle is None:
+                handle = await upload(static_prefix)
+                ttl = handle.pop("ttl_seconds", None)
+                if ttl is not None:
+                    margin = min(config.GEMINI_CONTEXT_CACHE_REFRESH_SECONDS, ttl / 2)
+                    self._prefix_expiry[key] = time.monotonic() + ttl - margin
+                else:
+                    self._prefix_expiry.pop(key, None)
+                self._prefix_handles[key] = handle
+                self.prefix_uploads += 1
+        return handle
+
+    def _drop_prefix_handle(self, static_prefix: str, handle: dict[str, Any]) -> None:
+        """Descarta `handle` tras un error para que el próximo intento vuelva a subir el prefijo."""
+        key = hashlib.sha256(static_prefix.encode("utf-8")).hexdigest()
+        # Otra llamada concurrente puede haberlo reemplazado ya por uno nuevo
+        if self._prefix_handles.get(key) is handle:
+            del self._prefix_handles[key]
+            self._prefix_expiry.pop(key, None)
+
+    def _gem_config(self, gem_name: Optional[str]) -> dict[str, Any]:
+        return config.GEM_CONFIGS.get(gem_name, {"temperature": 0.3, "top_p": 0.8, "max_tokens": 4096})
+
+    def _ollama_payload(self, prompt: str, gem_name: Optional[str]) -> dict[str, Any]:
+        cfg = self._gem_config(gem_name)
+        return {
             "model": self.model,
             "prompt": prompt,
             "stream": False,
+            "keep_alive": config.OLLAMA_KEEP_ALIVE,
             "options": {
                 "temperature": cfg.get("temperature", 0.3),
                 "top_p": cfg.get("top_p", 0.8),
@@ -55,30 +293,37 @@ class GeminiClient:
             }
         }
 
+    def _ollama_result(self, data: dict[str, Any], finish_reason: str = "STOP") -> GeminiResult:
+        """Convierte la respuesta JSON de Ollama en un GeminiResult."""
+        raw_text = data.get("response", "")
+
+        usage: GeminiUsage = {
+            "prompt_tokens": data.get("prompt_eval_count", 0),
+            "candidates_tokens": data.get("eval_count", 0),
+            "total_tokens": data.get("prompt_eval_count", 0) + data.get("eval_count", 0),
+            "finish_reason": finish_reason
+        }
+
+        result_content = self._parse_response(raw_text)
+
+        return {
+            "json": result_content["json"],
+            "markdown": result_content["markdown"],
+            "raw": raw_text,
+            "usage": usage,
+            "repairs": result_content["repairs"]
+        }
+
+    def _run_ollama(self, prompt: str, gem_name: Optional[str], max_retries: int) -> GeminiResult:
+        """Envía un prompt a Ollama."""
+        url = f"{config.OLLAMA_BASE_URL}/api/generate"
+        payload = self._ollama_payload(prompt, gem_name)
+
         for attempt in range(max_retries + 1):
             try:
-                with httpx.Client(timeout=120.0) as client:
-                    response = client.post(url, json=payload)
-                    response.raise_for_status()
-                    data = response.json()
-
-                    raw_text = data.get("response", "")
-
-                    usage: GeminiUsage = {
-                        "prompt_tokens": data.get("prompt_eval_count", 0),
-                        "candidates_tokens": data.get("eval_count", 0),
-                        "total_tokens": data.get("prompt_eval_count", 0) + data.get("eval_count", 0),
-                        "finish_reason": "STOP"
-                    }
-
-                    result_content = self._parse_response(raw_text)
-
-                    return {
-                        "json": result_content["json"],
-                        "markdown": result_content["markdown"],
-                        "raw": raw_text,
-                        "usage": usage
-                    }
+                response = self._http_client().post(url, json=payload)
+                response.raise_for_status()
+                return self._ollama_result(response.json())
             except Exception as e:
                 if attempt < max_retries:
                     time.sleep(2 ** (attempt + 1))
@@ -86,6 +331,170 @@ class GeminiClient:
                     raise RuntimeError(f"Ollama falló: {e}")
         raise RuntimeError("Unreachable")
 
+    async def _ollama_upload_prefix(self, static_prefix: str) -> dict[str, Any]:
+        """
+        Evalúa el prefijo en Ollama sin generar tokens y guarda el `context` devuelto.
+        Con keep_alive el modelo sigue cargado y reutiliza el KV cache de ese prefijo.
+        """
+        payload = self._ollama_payload(static_prefix, None)
+        payload["options"]["num_predict"] = 0
+        response = await self._async_http_client().post(f"{config.OLLAMA_BASE_URL}/api/generate", json=payload)
+        response.raise_for_status()
+        return {"context": response.json().get("context")}
+
+    async def _consume_stream(self, chunks: AsyncIterator[str], options: StreamOptions) -> tuple[str, bool, int]:
+        """
+        Consume fragmentos de texto; devuelve (texto, cortado_antes, n_fragmentos).
+        Cerrar el generador cierra la conexión, lo que detiene la generación en el proveedor.
+        """
+        detector = JsonStreamDetector()
+        count = 0
+        last_progress = time.monotonic()
+        try:
+            async for piece in chunks:
+                count += 1
+                detector.feed(piece)
+                if options.stop_after_json and detector.complete:
+                    return detector.text()[:detector.end], True, count
+                if options.on_progress and time.monotonic() - last_progress >= config.LLM_STREAM_PROGRESS_INTERVAL:
+                    last_progress = time.monotonic()
+                    await options.on_progress({
+                        "chunks": count,
+                        "chars": detector.length,
+                        "json_complete": detector.complete,
+                    })
+        finally:
+            await chunks.aclose()
+        return detector.text(), False, count
+
+    async def _ollama_stream(self, url: str, payload: dict[str, Any], options: StreamOptions) -> GeminiResult:
+        """Generación en streaming (NDJSON) contra /api/generate."""
+        payload = {**payload, "stream": True}
+        final: dict[str, Any] = {}
+
+        async def chunks() -> AsyncIterator[str]:
+            async with self._async_http_client().stream("POST", url, json=payload) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    data = json.loads(line)
+                    if data.get("done"):
+                        final.update(data)
+                    yield data.get("response", "")
+
+        raw_text, stopped, count = await self._consume_stream(chunks(), options)
+        # Si se cortó antes de "done" no hay conteos del servidor: ~1 token por fragmento
+        data = {**final, "response": raw_text, "eval_count": final.get("eval_count", count)}
+        return self._ollama_result(data, "EARLY_STOP" if stopped else "STOP")
+
+    async def _arun_ollama(
+        self,
+        prompt: str,
+        gem_name: Optional[str],
+        max_retries: int,
+        static_prefix: Optional[str] = None,
+        stream_options: Optional[StreamOptions] = None,
+    ) -> GeminiResult:
+        """Envía un prompt a Ollama sin bloquear el event loop."""
+        url = f"{config.OLLAMA_BASE_URL}/api/generate"
+
+        for attempt in range(max_retries + 1):
+            try:
+                payload = self._ollama_payload(prompt, gem_name)
+                if static_prefix:
+                    handle = await self._prefix_handle(static_prefix, self._ollama_upload_prefix)
+                    if handle.get("context"):
+                        payload["context"] = handle["context"]
+                    else:
+                        # El servidor no devolvió context: enviar el prompt completo
+                        payload["prompt"] = static_prefix + prompt
+                if stream_options is not None:
+                    return await self._ollama_stream(url, payload, stream_options)
+                response = await self._async_http_client().post(url, json=payload)
+                response.raise_for_status()
+                return self._ollama_result(response.json())
+            except Exception as e:
+                if attempt < max_retries:
+                    await asyncio.sleep(2 ** (attempt + 1))
+                else:
+                    raise RuntimeError(f"Ollama falló: {e}")
+        raise RuntimeError("Unreachable")
+
+    async def _gemini_upload_prefix(self, static_prefix: str) -> dict[str, Any]:
+        """
+        Crea un cached content con el prefijo. Si es muy chico para el mínimo de caching
+        del modelo (o la creación falla) se usa como system_instruction en cada llamada.
+        """
+        if len(static_prefix) // 4 >= config.GEMINI_CONTEXT_CACHE_MIN_TOKENS:
+            try:
+                cached = await self.client.aio.caches.create(
+                    model=self.model,
+                    config={
+                        "system_instruction": static_prefix,
+                        "ttl": f"{config.GEMINI_CONTEXT_CACHE_TTL_SECONDS}s",
+                    },
+                )
+                return {"cached_content": cached.name, "ttl_seconds": config.GEMINI_CONTEXT_CACHE_TTL_SECONDS}
+            except Exception as e:
+                console.print(f"[dim]  ⚠️  Context cache no disponible, usando system_instruction: {e}[/dim]")
+        return {"system_instruction": static_prefix}
+
+    def _gemini_request_config(self, gem_name: Optional[str]) -> dict[str, Any]:
+        cfg = self._gem_config(gem_name)
+        return {
+            "temperature": cfg.get("temperature"),
+            "top_p": cfg.get("top_p"),
+            "max_output_tokens": cfg.get("max_tokens"),
+        }
+
+    def _gemini_result(
+        self, response: Any, raw_text: Optional[str] = None, finish_reason: Optional[str] = None
+    ) -> GeminiResult:
+        """Convierte una respuesta del SDK de Gemini en un GeminiResult."""
+        if raw_text is None:
+            raw_text = response.text
+
+        usage_dict: GeminiUsage = {
+            "prompt_tokens": 0,
+            "candidates_tokens": 0,
+            "total_tokens": 0,
+            "finish_reason": "UNKNOWN"
+        }
+
+        if hasattr(response, "usage_metadata") and response.usage_metadata:
+            usage_dict["prompt_tokens"] = getattr(
+                response.usage_metadata, "prompt_token_count", 0
+            )
+            usage_dict["candidates_tokens"] = getattr(
+                response.usage_metadata, "candidates_token_count", 0
+            )
+            usage_dict["total_tokens"] = getattr(
+                response.usage_metadata, "total_token_count", 0
+            )
+
+        if hasattr(response, "candidates") and response.candidates:
+            usage_dict["finish_reason"] = getattr(response.candidates[0], "finish_reason", "STOP")
+        if finish_reason:
+            usage_dict["finish_reason"] = finish_reason
+
+        result_content = self._parse_response(raw_text)
+
+        return {
+            "json": result_content["json"],
+            "markdown": result_content["markdown"],
+            "raw": raw_text,
+            "usage": usage_dict,
+            "repairs": result_content["repairs"]
+        }
+
+    def _retry_wait(self, attempt: int, max_retries: int, error: Exception) -> int:
+        """Informa el error de un intento fallido y devuelve los segundos de espera."""
+        wait = 2 ** (attempt + 1)
+        console.print(f"[yellow]  ⚠️  Error (intento {attempt + 1}/{max_retries + 1}): {error}[/yellow]")
+        console.print(f"[dim]  ⏳ Reintentando en {wait}s...[/dim]")
+        return wait
+
     def _run_gemini(self, prompt: str, gem_name: Optional[str] = None, max_retries: int = config.MAX_RETRIES_ON_BLOCK) -> GeminiResult:
         """
         Envía un prompt al modelo Gemini y parsea la respuesta.
@@ -98,59 +507,80 @@ class GeminiClient:
         Returns:
             GeminiResult con el contenido parseado y metadatos de uso.
         """
-        # Cargar configuración específica o usar default
-        cfg = config.GEM_CONFIGS.get(gem_name, {"temperature": 0.3, "top_p": 0.8, "max_tokens": 4096})
-        
         for attempt in range(max_retries + 1):
             try:
                 response = self.client.models.generate_content(
                     model=self.model,
                     contents=prompt,
-                    config={
-                        "temperature": cfg.get("temperature"),
-                        "top_p": cfg.get("top_p"),
-                        "max_output_tokens": cfg.get("max_tokens"),
-                    },
+                    config=self._gemini_request_config(gem_name),
                 )
+                return self._gemini_result(response)
 
-                raw_text = response.text
-                
-                usage_dict: GeminiUsage = {
-                    "prompt_tokens": 0,
-                    "candidates_tokens": 0,
-                    "total_tokens": 0,
-                    "finish_reason": "UNKNOWN"
-                }
-                
-                if hasattr(response, "usage_metadata") and response.usage_metadata:
-                    usage_dict["prompt_tokens"] = getattr(
-                        response.usage_metadata, "prompt_token_count", 0
-                    )
-                    usage_dict["candidates_tokens"] = getattr(
-                        response.usage_metadata, "candidates_token_count", 0
-                    )
-                    usage_dict["total_tokens"] = getattr(
-                        response.usage_metadata, "total_token_count", 0
+            except Exception as e:
+                if attempt < max_retries:
+                    time.sleep(self._retry_wait(attempt, max_retries, e))
+                else:
+                    raise RuntimeError(
+                        f"Gemini API falló después de {max_retries + 1} intentos: {e}"
                     )
-                
-                if hasattr(response, "candidates") and response.candidates:
-                    usage_dict["finish_reason"] = getattr(response.candidates[0], "finish_reason", "STOP")
-                
-                result_content = self._parse_response(raw_text)
-                
-                return {
-                    "json": result_content["json"],
-                    "markdown": result_content["markdown"],
-                    "raw": raw_text,
-                    "usage": usage_dict
-                }
+        raise RuntimeError("Unreachable")
+
+    async def _gemini_stream(self, prompt: str, request_config: dict[str, Any], options: StreamOptions) -> GeminiResult:
+        """Generación en streaming con el SDK (generate_content_stream)."""
+        last: dict[str, Any] = {}
+
+        async def chunks() -> AsyncIterator[str]:
+            stream = self.client.aio.models.generate_content_stream(
+                model=self.model,
+                contents=prompt,
+                config=request_config,
+            )
+            if inspect.isawaitable(stream):
+                stream = await stream
+            try:
+                async for chunk in stream:
+                    last["chunk"] = chunk
+                    yield chunk.text or ""
+            finally:
+                if hasattr(stream, "aclose"):
+                    await stream.aclose()
+
+        raw_text, stopped, _ = await self._consume_stream(chunks(), options)
+        # Cada fragmento trae usage_metadata acumulado: se usa el último recibido
+        return self._gemini_result(last.get("chunk"), raw_text, "EARLY_STOP" if stopped else None)
+
+    async def _arun_gemini(
+        self,
+        prompt: str,
+        gem_name: Optional[str] = None,
+        max_retries: int = config.MAX_RETRIES_ON_BLOCK,
+        static_prefix: Optional[str] = None,
+        stream_options: Optional[StreamOptions] = None,
+    ) -> GeminiResult:
+        """Igual que _run_gemini pero usando el cliente asíncrono del SDK (client.aio)."""
+        for attempt in range(max_retries + 1):
+            handle = None
+            try:
+                request_config = self._gemini_request_config(gem_name)
+                if static_prefix:
+                    handle = await self._prefix_handle(static_prefix, self._gemini_upload_prefix)
+                    request_config.update(handle)
+                if stream_options is not None:
+                    return await self._gemini_stream(prompt, request_config, stream_options)
+                response = await self.client.aio.models.generate_content(
+                    model=self.model,
+                    contents=prompt,
+                    config=request_config,
+                )
+                return self._gemini_result(response)
 
             except Exception as e:
+                if handle and handle.get("cached_content"):
+                    # Puede haber vencido o sido borrado: el reintento sube el prefijo de nuevo
+                    # (o cae a system_instruction si no se puede crear)
+                    self._drop_prefix_handle(static_prefix, handle)
                 if attempt < max_retries:
-                    wait = 2 ** (attempt + 1)
-                    console.print(f"[yellow]  ⚠️  Error (intento {attempt + 1}/{max_retries + 1}): {e}[/yellow]")
-                    console.print(f"[dim]  ⏳ Reintentando en {wait}s...[/dim]")
-                    time.sleep(wait)
+                    await asyncio.sleep(self._retry_wait(attempt, max_retries, e))
                 else:
                     raise RuntimeError(
                         f"Gemini API falló después de {max_retries + 1} intentos: {e}"
@@ -158,45 +588,30 @@ class GeminiClient:
         raise RuntimeError("Unreachable")
 
     def _parse_response(self, raw_text: str) -> dict[str, Any]:
-        """Parsea la respuesta de Gemini separando JSON y Markdown."""
-        json_data = None
-        markdown = raw_text
-
-        # Intentar encontrar bloques de código JSON
-        json_match = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", raw_text, re.DOTALL)
-        
-        if not json_match:
-            # Intentar encontrar cualquier bloque que empiece con { y termine con }
-            json_match = re.search(r"(\{.*\})", raw_text, re.DOTALL)
-
-        if json_match:
-            json_str = json_match.group(1).strip()
-            
-            # Limpieza básica de JSON: eliminar comas finales antes de cerrar llaves/corchetes
-            json_str = re.sub(r",\s*([\]}])", r"\1", json_str)
-            
-            try:
-                json_data = json.loads(json_str)
-                # Separar markdown (lo que queda fuera del bloque JSON detectado)
-                # Usamos una versión segura del reemplazo para evitar errores si json_match.group(0) aparece múltiples veces
-                markdown = raw_text.replace(json_match.group(0), "").strip()
-            except json.JSONDecodeError as e:
-                # Si falla, intentar cargar el texto crudo si parece un objeto
-                try:
-                    json_data = json.loads(raw_text.strip())
-                    markdown = ""
-                except json.JSONDecodeError:
-                    console.print(f"[dim]  ⚠️  JSON parse error: {e}[/dim]")
-                    json_data = {"_raw_json": json_str, "_parse_error": str(e)}
-        else:
-            # Fallback final: ¿Es todo el texto un JSON?
-            try:
-                json_data = json.loads(raw_text.strip())
-                markdown = ""
-            except json.JSONDecodeError:
-                pass
+        """
+        Parsea la respuesta separando JSON y Markdown.
+
+        Un único recorrido lineal localiza el primer objeto JSON de nivel superior; si no
+        parsea se aplican reparaciones locales (ver agent/json_extract.py) y se informan
+        en "repairs". El markdown es el texto que queda fuera del objeto (y de su ```json).
+        """
+        extraction = extract_json(raw_text)
 
+        if extraction.value is not None:
+            if extraction.repairs:
+                console.print(f"[dim]  🩹 JSON reparado: {', '.join(extraction.repairs)}[/dim]")
+            return {
+                "json": extraction.value,
+                "markdown": strip_span(raw_text, extraction.start, extraction.end),
+                "repairs": extraction.repairs,
+            }
+
+        json_data = None
+        if extraction.candidate:
+            console.print(f"[dim]  ⚠️  JSON parse error: {extraction.error}[/dim]")
+            json_data = {"_raw_json": extraction.candidate, "_parse_error": extraction.error}
         return {
             "json": json_data,
-            "markdown": markdown,
+            "markdown": raw_text,
+            "repairs": [],
         }
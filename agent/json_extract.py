@@ -0,0 +1,302 @@
+"""
+json_extract.py – Detección de objetos JSON en texto generado por LLMs.
+
+JsonStreamDetector recibe el texto por fragmentos (streaming) y detecta en tiempo
+lineal cuándo se cierra el primer objeto JSON de nivel superior, para poder cortar
+la generación sin esperar el markdown que suele venir después.
+
+extract_json hace lo mismo sobre un texto completo: un único recorrido localiza los
+objetos de nivel superior y, si json.loads falla, aplica reparaciones locales
+(comas finales, comillas tipográficas, saltos de línea sin escapar dentro de strings
+y llaves/corchetes sin cerrar por truncado) informando cuáles se usaron.
+"""
+
+import json
+import re
+from typing import Any, Iterator, NamedTuple, Optional
+
+# Nombres de las reparaciones que puede informar extract_json
+REPAIR_SMART_QUOTES = "smart_quotes"
+REPAIR_NEWLINES = "unescaped_newlines"
+REPAIR_TRAILING_COMMAS = "trailing_commas"
+REPAIR_TRUNCATED = "truncated_brackets"
+
+SMART_QUOTES = str.maketrans({"\u201c": '"', "\u201d": '"', "\u201e": '"', "\u201f": '"'})
+CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+CLOSERS = {"{": "}", "[": "]"}
+STRUCTURAL_RE = re.compile(r'[{}"]')
+STRING_SPECIAL_RE = re.compile(r'["\\]')
+_DECODER = json.JSONDecoder()
+# Máximo de re-escaneos tras candidatos fallidos (cada uno es lineal: acota el peor caso)
+MAX_RESCANS = 16
+
+
+class JsonExtraction(NamedTuple):
+    """Resultado de extract_json. `value` es None si no se pudo obtener un objeto."""
+    value: Optional[Any]
+    start: int
+    end: int
+    repairs: list[str]
+    error: Optional[str] = None
+    candidate: str = ""
+
+
+def scan_objects(text: str, pos: int = 0) -> Iterator[tuple[int, int, bool]]:
+    """
+    Recorre el texto (desde `pos`) una sola vez y devuelve (inicio, fin, cerrado) de cada
+    objeto de nivel superior. Si el texto termina con un objeto abierto se emite con
+    cerrado=False.
+
+    Salta directamente entre caracteres estructurales con regex compiladas, así que el
+    costo es lineal y el contenido de los strings no se recorre carácter a carácter.
+    """
+    depth = 0
+    start = 0
+    i = text.find("{", pos)
+    n = len(text)
+    while 0 <= i < n:
+        ch = text[i]
+        if ch == '"':
+            # Dentro de un string: saltar hasta la comilla de cierre, ignorando escapes
+            while True:
+                m = STRING_SPECIAL_RE.search(text, i + 1)
+                if m is None:
+                    i = n
+                    break
+                i = m.start()
+                if text[i] == "\\":
+                    i += 1
+                    continue
+                break
+        elif ch == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                yield start, i + 1, True
+                i = text.find("{", i + 1)
+                continue
+        m = STRUCTURAL_RE.search(text, i + 1)
+        i = m.start() if m else n
+    if depth > 0:
+        yield start, n, False
+
+
+def repair_json(candidate: str) -> tuple[str, list[str]]:
+    """
+    Aplica reparaciones locales en una sola pasada y devuelve (texto, reparaciones).
+
+    Sólo toca lo que está fuera de lugar: los caracteres de control dentro de strings se
+    escapan, las comas antes de } o ] se eliminan y, si el texto quedó truncado, se
+    cierran el string y los contenedores abiertos en orden inverso.
+    """
+    repairs: list[str] = []
+    if any(q in candidate for q in "\u201c\u201d\u201e\u201f"):
+        candidate = candidate.translate(SMART_QUOTES)
+        repairs.append(REPAIR_SMART_QUOTES)
+
+    out: list[str] = []
+    stack: list[str] = []
+    in_string = False
+    escape = False
+    last_sig = -1  # índice en `out` del último carácter significativo fuera de strings
+    newlines = commas = False
+
+    for ch in candidate:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+                last_sig = len(out)
+            elif ch in CONTROL_ESCAPES:
+                out.append(CONTROL_ESCAPES[ch])
+                newlines = True
+                continue
+            out.append(ch)
+            continue
+
+        if ch in " \t\r\n":
+            out.append(ch)
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in CLOSERS:
+            stack.append(ch)
+        elif ch in "}]":
+            if last_sig >= 0 and out[last_sig] == ",":
+                out[last_sig] = ""
+                commas = True
+            if stack:
+                stack.pop()
+        last_sig = len(out)
+        out.append(ch)
+
+    if newlines:
+        repairs.append(REPAIR_NEWLINES)
+    if commas:
+        repairs.append(REPAIR_TRAILING_COMMAS)
+
+    if in_string or stack:
+        if in_string:
+            if escape:
+                out.pop()
+            out.append('"')
+        else:
+            # Quitar una coma colgante o completar una clave sin valor
+            if last_sig >= 0 and out[last_sig] == ",":
+                del out[last_sig:]
+            elif last_sig >= 0 and out[last_sig] == ":":
+                out.append(" null")
+        out.extend(CLOSERS[opener] for opener in reversed(stack))
+        repairs.append(REPAIR_TRUNCATED)
+
+    return "".join(out), repairs
+
+
+def _parse_candidate(candidate: str) -> tuple[Any, list[str]]:
+    """json.loads directo y, si falla, con reparaciones. Propaga el error original."""
+    try:
+        return json.loads(candidate), []
+    except json.JSONDecodeError as original:
+        repaired, repairs = repair_json(candidate)
+        if not repairs:
+            raise
+        try:
+            return json.loads(repaired), repairs
+        except json.JSONDecodeError:
+            raise original
+
+
+def extract_json(text: str) -> JsonExtraction:
+    """
+    Localiza el primer objeto JSON válido (reparándolo si hace falta) en tiempo lineal.
+
+    Un candidato que no cierra o no parsea puede empezar en una llave suelta de la prosa
+    (ej. "el set {a, b ...") que se tragó al objeto real: se vuelve a escanear desde la
+    llave siguiente a su inicio (hasta MAX_RESCANS veces).
+
+    Si ningún objeto puede parsearse se devuelve value=None con el error y el texto del
+    primer candidato; si no hay ninguna llave se intenta parsear el texto completo.
+    """
+    # Camino rápido: el caso habitual es que el primer "{" abra un objeto válido
+    first = text.find("{")
+    if first >= 0:
+        try:
+            value, end = _DECODER.raw_decode(text, first)
+        except json.JSONDecodeError:
+            pass
+        else:
+            if isinstance(value, dict):
+                return JsonExtraction(value, first, end, [])
+
+    first_error: Optional[JsonExtraction] = None
+    pos: Optional[int] = 0
+    rescans = 0
+    while pos is not None and rescans <= MAX_RESCANS:
+        rescans += 1
+        rescan_from = None
+        for start, end, closed in scan_objects(text, pos):
+            candidate = text[start:end]
+            try:
+                value, repairs = _parse_candidate(candidate)
+            except json.JSONDecodeError as e:
+                if first_error is None:
+                    first_error = JsonExtraction(None, start, end, [], str(e), candidate)
+                rescan_from = start + 1
+                break
+            if isinstance(value, dict):
+                return JsonExtraction(value, start, end, repairs)
+        pos = rescan_from
+
+    if first_error is not None:
+        return first_error
+
+    stripped = text.strip()
+    try:
+        return JsonExtraction(json.loads(stripped), 0, len(text), [])
+    except json.JSONDecodeError as e:
+        return JsonExtraction(None, 0, 0, [], str(e) if stripped else None)
+
+
+def strip_span(text: str, start: int, end: int) -> str:
+    """Quita text[start:end] junto con el bloque ```json que lo rodea, si existe."""
+    before = text[:start].rstrip()
+    after = text[end:].lstrip()
+    if after.startswith("```"):
+        for fence in ("```json", "```JSON", "```"):
+            if before.endswith(fence):
+                before = before[:-len(fence)]
+                after = after[3:]
+                break
+    return (before.rstrip() + "\n" + after.lstrip()).strip()
+
+
+class JsonStreamDetector:
+    """Escáner incremental de llaves balanceadas (respeta strings y escapes)."""
+
+    def __init__(self):
+        self.buffer: list[str] = []
+        self.length = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.start: Optional[int] = None
+        self.end: Optional[int] = None
+        self.value: Optional[Any] = None
+        self._text_cache = ""
+
+    @property
+    def complete(self) -> bool:
+        return self.value is not None
+
+    def text(self) -> str:
+        if len(self._text_cache) != self.length:
+            self._text_cache = "".join(self.buffer)
+        return self._text_cache
+
+    def feed(self, chunk: str) -> bool:
+        """Agrega un fragmento; devuelve True cuando hay un objeto JSON completo y válido."""
+        if not chunk:
+            return self.complete
+
+        offset = self.length
+        self.buffer.append(chunk)
+        self.length += len(chunk)
+        if self.complete:
+            return True
+
+        for i, ch in enumerate(chunk):
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                if self.depth > 0:
+                    self.in_string = True
+            elif ch == "{":
+                if self.depth == 0:
+                    self.start = offset + i
+                self.depth += 1
+            elif ch == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    candidate = self.text()[self.start:offset + i + 1]
+                    try:
+                        value = json.loads(candidate)
+                    except json.JSONDecodeError:
+                        # Llaves en prosa (ej. "{ejemplo}"): seguir buscando
+                        self.start = None
+                        continue
+                    if isinstance(value, dict):
+                        self.value = value
+                        self.end = offset + i + 1
+                        return True
+        return False
@@ -0,0 +1,276 @@
+"""
+llm_cache.py – Cache persistente (SQLite) de respuestas LLM direccionado por contenido.
+
+La clave es un hash SHA-256 de proveedor, modelo, parámetros de muestreo y prompt
+completo, por lo que cualquier cambio en el prompt o en GEM_CONFIGS invalida la
+entrada de forma natural. Soporta TTL, evicción LRU por tamaño total y coalescing
+de llamadas idénticas concurrentes (una sola llamada real en vuelo por clave).
+
+La ruta asíncrona hace las lecturas/escrituras de SQLite en un hilo aparte, y las
+marcas LRU de los hits se acumulan en memoria y se escriben juntas (cada
+`touch_interval` segundos, o antes de evictar), no con un commit por hit.
+"""
+
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterator, Optional
+
+import config
+
+
+def make_cache_key(provider: str, model: str, params: dict[str, Any], prompt: str) -> str:
+    """Hash determinista de todo lo que influye en la respuesta del modelo."""
+    material = json.dumps(
+        {"provider": provider, "model": model, "params": params, "prompt": prompt},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Cache de respuestas en SQLite con TTL, evicción LRU por tamaño y contadores."""
+
+    def __init__(
+        self,
+        path: str = config.LLM_CACHE_PATH,
+        max_bytes: int = config.LLM_CACHE_MAX_BYTES,
+        ttl_seconds: float = config.LLM_CACHE_TTL_SECONDS,
+        touch_interval: float = config.LLM_CACHE_TOUCH_INTERVAL,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        # Marcas LRU pendientes de escribir: key -> last_access
+        self._touched: dict[str, float] = {}
+        self._touched_at = time.time()
+        # key -> [lock, hilos que lo usan]; se borra cuando nadie lo usa
+        self._key_locks: dict[str, list] = {}
+        self._key_locks_guard = threading.Lock()
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    def _db(self) -> sqlite3.Connection:
+        # Apertura diferida: no se crea el archivo hasta el primer uso
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_llm_responses_last_access ON llm_responses(last_access)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _lookup(self, key: str) -> Optional[dict[str, Any]]:
+        """Lee una entrada vigente y anota su marca LRU (sin tocar contadores)."""
+        now = time.time()
+        with self._db_lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT value, created_at FROM llm_responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                db.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                self._touched.pop(key, None)
+                db.commit()
+                return None
+            self._touched[key] = now
+            if now - self._touched_at >= self.touch_interval:
+                self._write_touches(db)
+                db.commit()
+        return json.loads(row[0])
+
+    def _write_touches(self, db: sqlite3.Connection) -> None:
+        """Escribe las marcas LRU acumuladas (sin commit; se llama con _db_lock tomado)."""
+        if self._touched:
+            db.executemany(
+                "UPDATE llm_responses SET last_access = ? WHERE key = ?",
+                [(at, key) for key, at in self._touched.items()],
+            )
+            self._touched.clear()
+        self._touched_at = time.time()
+
+    def get(self, key: str) -> Optional[dict[str, Any]]:
+        value = self._lookup(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: dict[str, Any]) -> None:
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        now = time.time()
+        with self._db_lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, value, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, data, size, now, now),
+            )
+            self._touched.pop(key, None)
+            # La evicción LRU necesita las marcas al día
+            self._write_touches(db)
+            self._evict(db, now)
+            db.commit()
+
+    def _evict(self, db: sqlite3.Connection, now: float) -> None:
+        """Elimina entradas vencidas y luego las menos usadas hasta respetar max_bytes."""
+        if self.ttl_seconds:
+            cur = db.execute("DELETE FROM llm_responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            self.evictions += max(cur.rowcount, 0)
+
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        victims = []
+        for key, size in db.execute("SELECT key, size FROM llm_responses ORDER BY last_access ASC"):
+            if total <= self.max_bytes:
+                break
+            victims.append((key,))
+            total -= size
+        db.executemany("DELETE FROM llm_responses WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def clear(self) -> None:
+        with self._db_lock:
+            db = self._db()
+            db.execute("DELETE FROM llm_responses")
+            self._touched.clear()
+            db.commit()
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._conn is not None:
+                self._write_touches(self._conn)
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> dict[str, Any]:
+        entries, total = 0, 0
+        if self._conn is not None or os.path.exists(self.path):
+            with self._db_lock:
+                entries, total = self._db().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_responses"
+                ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "bytes": total,
+        }
+
+    @contextmanager
+    def _key_lock(self, key: str) -> Iterator[None]:
+        """Lock por clave, descartado al terminar el último hilo que lo usa."""
+        with self._key_locks_guard:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._key_locks_guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._key_locks[key]
+
+    def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], dict[str, Any]],
+        should_store: Callable[[dict[str, Any]], bool] = lambda value: True,
+    ) -> dict[str, Any]:
+        """Versión síncrona: los hilos con la misma clave esperan a la primera llamada."""
+        cached = self._lookup(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        with self._key_lock(key):
+            cached = self._lookup(key)
+            if cached is not None:
+                self.coalesced += 1
+                return cached
+            self.misses += 1
+            value = compute()
+            if should_store(value):
+                self.set(key, value)
+            return value
+
+    async def aget_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[dict[str, Any]]],
+        should_store: Callable[[dict[str, Any]], bool] = lambda value: True,
+    ) -> dict[str, Any]:
+        """
+        Versión asíncrona: las corrutinas con la misma clave comparten un único future.
+        SQLite se usa desde un hilo aparte para no bloquear el event loop.
+        """
+        cached = await asyncio.to_thread(self._lookup, key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        pending = self._inflight.get(key)
+        if pending is not None and pending.get_loop() is asyncio.get_running_loop():
+            self.coalesced += 1
+            # Cada llamador recibe su propia copia: mutar el resultado no afecta a los demás
+            return copy.deepcopy(await asyncio.shield(pending))
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.misses += 1
+        try:
+            value = await compute()
+            if should_store(value):
+                await asyncio.to_thread(self.set, key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Evita el warning "exception was never retrieved" si nadie esperaba
+            future.exception()
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
@@ -1,39 +1,173 @@
 """
 prompt_builder.py – Construye prompts finales inyectando variables de template.
+
+Los prompts se cargan y compilan una sola vez en un registro (TemplateRegistry):
+cada template se parte en segmentos literales y placeholders {{variable}}, de modo
+que renderizar es un único join. Los archivos se recargan solos si cambia su mtime.
 """
 
+import hashlib
+import json
 import os
 import re
+import threading
+from typing import Any, NamedTuple, Optional, Union
 
 
 PROMPTS_DIR = os.path.join(os.path.dirname(__file__), "..", "prompts")
 
+MAESTRO_NAME = "00_prompt_maestro"
+PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\}\}")
+# Variables que se resuelven solas o que son metadata, no inputs
+AUTO_RESOLVED = {"PROMPT_MAESTRO", "VERSION"}
+
+
+class PromptParts(NamedTuple):
+    """
+    Prompt separado en un prefijo estable (idéntico en todos los pasos y candidatos de
+    una búsqueda) y un sufijo dinámico. El proveedor puede cachear el prefijo.
+    """
+    static: str
+    dynamic: str
+
+    @property
+    def text(self) -> str:
+        return self.static + self.dynamic
+
+
+class Placeholder(str):
+    """Nombre de variable dentro de la lista de segmentos de un template compilado."""
+
+
+class PromptTemplate:
+    """Prompt compilado: segmentos literales intercalados con placeholders."""
+
+    def __init__(self, name: str, source: str, maestro: Optional[str] = None):
+        self.name = name
+        self.source = source
+        self.version = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+
+        text = source
+        if maestro is not None:
+            text = text.replace("{{PROMPT_MAESTRO}}", maestro)
+
+        self.segments: list[Union[str, Placeholder]] = []
+        for i, part in enumerate(PLACEHOLDER_RE.split(text)):
+            if i % 2:
+                self.segments.append(Placeholder(part))
+            elif part:
+                self.segments.append(part)
+        self.variables = {s for s in self.segments if isinstance(s, Placeholder)}
+        self.required_variables = self.variables - AUTO_RESOLVED
+        self._warned: set[frozenset] = set()
+
+    def render(self, variables: dict[str, Any]) -> str:
+        """Renderiza en una sola pasada; los placeholders sin valor quedan intactos."""
+        if not self.variables:
+            return "".join(self.segments)
+
+        rendered = {}
+        for key in self.variables & variables.keys():
+            value = variables[key]
+            if isinstance(value, dict):
+                value = json.dumps(value, ensure_ascii=False, indent=2)
+            rendered[key] = str(value)
+
+        missing = frozenset(self.required_variables - rendered.keys())
+        if missing and missing not in self._warned:
+            # Se avisa una sola vez por combinación faltante, no en cada render
+            self._warned.add(missing)
+            print(f"  ⚠️  Variables sin reemplazar en {self.name}: {sorted(missing)}")
+
+        return "".join(
+            rendered.get(s, "{{" + s + "}}") if isinstance(s, Placeholder) else s
+            for s in self.segments
+        )
+
+
+class TemplateRegistry:
+    """Cache de templates compilados con recarga por mtime."""
+
+    def __init__(self, prompts_dir: str = PROMPTS_DIR):
+        self.prompts_dir = prompts_dir
+        self._templates: dict[str, tuple[tuple, PromptTemplate]] = {}
+        self._sources: dict[str, tuple[tuple, str]] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.prompts_dir, f"{name}.md")
+
+    def _stamp(self, name: str) -> tuple:
+        filepath = self._path(name)
+        try:
+            st = os.stat(filepath)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Prompt no encontrado: {filepath}")
+        return (st.st_mtime_ns, st.st_size)
+
+    def source(self, name: str) -> str:
+        """Texto crudo del prompt (releído sólo si el archivo cambió)."""
+        stamp = self._stamp(name)
+        cached = self._sources.get(name)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        with open(self._path(name), "r", encoding="utf-8") as f:
+            text = f.read()
+        with self._lock:
+            self._sources[name] = (stamp, text)
+        return text
+
+    def get(self, name: str) -> PromptTemplate:
+        """Template compilado; se recompila si cambió el archivo o el maestro que embebe."""
+        stamp = self._stamp(name)
+        if name != MAESTRO_NAME:
+            stamp += self._stamp(MAESTRO_NAME)
+        cached = self._templates.get(name)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        source = self.source(name)
+        maestro = self.source(MAESTRO_NAME) if name != MAESTRO_NAME and "{{PROMPT_MAESTRO}}" in source else None
+        template = PromptTemplate(name, source, maestro)
+        with self._lock:
+            self._templates[name] = (stamp, template)
+        return template
+
+    def load_all(self) -> dict[str, PromptTemplate]:
+        """Compila (o revalida) todos los prompts del directorio."""
+        names = sorted(f[:-3] for f in os.listdir(self.prompts_dir) if f.endswith(".md"))
+        return {name: self.get(name) for name in names}
+
+
+registry = TemplateRegistry()
+
 
 def load_prompt(gem_name: str) -> str:
     """Carga un prompt desde el directorio de prompts."""
-    filename = f"{gem_name}.md"
-    filepath = os.path.join(PROMPTS_DIR, filename)
+    return registry.source(gem_name)
 
-    if not os.path.exists(filepath):
-        raise FileNotFoundError(f"Prompt no encontrado: {filepath}")
 
-    with open(filepath, "r", encoding="utf-8") as f:
-        return f.read()
+def get_prompt_versions() -> dict[str, str]:
+    """
+    Devuelve un hash corto del contenido de cada prompt en PROMPTS_DIR.
+
+    Sirve como "versión" de los prompts: cualquier edición cambia el hash.
+    """
+    return {name: template.version for name, template in registry.load_all().items()}
 
 
 def load_maestro() -> str:
     """Carga el prompt maestro."""
-    return load_prompt("00_prompt_maestro")
+    return load_prompt(MAESTRO_NAME)
 
 
 def build_prompt(gem_name: str, variables: dict) -> str:
     """
     Construye el prompt final para un GEM.
 
-    1. Carga el prompt del GEM
-    2. Inyecta {{PROMPT_MAESTRO}}
-    3. Reemplaza todas las {{variables}}
-    4. Valida que no queden variables sin reemplazar
+    1. Obtiene el template compilado (con {{PROMPT_MAESTRO}} ya inyectado)
+    2. Reemplaza todas las {{variables}} en una sola pasada
+    3. Avisa (una vez) si quedan variables requeridas sin valor
 
     Args:
         gem_name: nombre del GEM (ej: "gem1", "gem5")
@@ -42,31 +176,7 @@ def build_prompt(gem_name: str, variables: dict) -> str:
     Returns:
         str con el prompt listo para enviar al modelo
     """
-    # Cargar prompt maestro y del GEM
-    maestro = load_maestro()
-    prompt = load_prompt(gem_name)
-
-    # Inyectar prompt maestro
-    prompt = prompt.replace("{{PROMPT_MAESTRO}}", maestro)
-
-    # Inyectar variables
-    for key, value in variables.items():
-        placeholder = "{{" + key + "}}"
-        if isinstance(value, dict):
-            import json
-
-            value = json.dumps(value, ensure_ascii=False, indent=2)
-        prompt = prompt.replace(placeholder, str(value))
-
-    # Validar que no queden variables sin reemplazar
-    remaining = re.findall(r"\{\{(\w+)\}\}", prompt)
-    if remaining:
-        # Filtrar VERSION que es metadata, no un input
-        remaining = [v for v in remaining if v != "VERSION"]
-        if remaining:
-            print(f"  ⚠️  Variables sin reemplazar: {remaining}")
-
-    return prompt
+    return registry.get(gem_name).render(variables)
 
 
 def get_required_variables(gem_name: str) -> list[str]:
@@ -76,11 +186,7 @@ def get_required_variables(gem_name: str) -> list[str]:
     Returns:
         Lista de nombres de variables (sin {{ }})
     """
-    prompt = load_prompt(gem_name)
-    variables = re.findall(r"\{\{(\w+)\}\}", prompt)
-    # Filtrar las que se resuelven automáticamente
-    auto_resolved = {"PROMPT_MAESTRO", "VERSION"}
-    return [v for v in set(variables) if v not in auto_resolved]
+    return list(registry.get(gem_name).required_variables)
 
 
 def build_gem5_prompt(search_inputs: dict) -> str:
@@ -88,15 +194,53 @@ def build_gem5_prompt(search_inputs: dict) -> str:
     return build_prompt("gem5", {"input": search_inputs})
 
 
-def build_agent_prompt(gem_id: str, payload: dict) -> str:
-    """Helper genérico para construir prompts de agentes con inyección de datos."""
-    base_prompt = load_prompt(gem_id)
-    # Intentamos inyectar en {{input}} o {{context}}
-    prompt = build_prompt(gem_id, {"input": payload, "context": payload})
+def build_gem6_prompt_parts(search_id: str, candidate_id: str, context: dict) -> PromptParts:
+    """
+    Prompt de GEM 6 como prefijo estático + sufijo dinámico.
+
+    Prefijo: maestro + system prompt de GEM 6 + inputs de la búsqueda (JD, kickoff, contexto).
+    Sufijo: datos del candidato y working memory. Si el template intercala {{context}} o
+    {{candidate_id}} no hay prefijo estable y todo va en la parte dinámica.
+    """
+    template = registry.get("gem6")
+    variables = {"search_id": search_id, "candidate_id": candidate_id, "context": context}
+
+    if template.variables & {"context", "candidate_id"}:
+        prompt = template.render(variables)
+        if "context" not in template.variables:
+            prompt += f"\n\n### CONTEXTO ACTUAL:\n{json.dumps(context, ensure_ascii=False, indent=2)}"
+        return PromptParts("", prompt)
+
+    search_inputs = context.get("search_inputs", {})
+    static = (
+        template.render(variables)
+        + f"\n\n### INPUTS DE LA BÚSQUEDA:\n{json.dumps(search_inputs, ensure_ascii=False, indent=2)}"
+    )
+    dynamic_context = {k: v for k, v in context.items() if k != "search_inputs"}
+    dynamic = f"\n\n### CONTEXTO ACTUAL:\n{json.dumps(dynamic_context, ensure_ascii=False, indent=2)}"
+    return PromptParts(static, dynamic)
+
+
+def build_gem6_prompt(search_id: str, candidate_id: str, context: dict) -> str:
+    """Prompt de GEM 6 completo (prefijo + sufijo)."""
+    return build_gem6_prompt_parts(search_id, candidate_id, context).text
+
+
+def build_agent_prompt_parts(gem_id: str, payload: dict) -> PromptParts:
+    """Prompt de agente como prefijo estático (system prompt) + datos del payload."""
+    template = registry.get(gem_id)
+
+    # Si el template tiene {{input}} o {{context}}, los datos van intercalados: sin prefijo estable
+    if template.variables & {"input", "context"}:
+        return PromptParts("", template.render({"input": payload, "context": payload}))
 
     # Si no se encontró ningún placeholder de datos en el prompt original, los anexamos al final
-    if "{{input}}" not in base_prompt and "{{context}}" not in base_prompt:
-        import json
-        prompt += f"\n\n### DATA INPUT:\n{json.dumps(payload, ensure_ascii=False, indent=2)}"
+    return PromptParts(
+        template.render({}),
+        f"\n\n### DATA INPUT:\n{json.dumps(payload, ensure_ascii=False, indent=2)}",
+    )
 
-    return prompt
+
+def build_agent_prompt(gem_id: str, payload: dict) -> str:
+    """Helper genérico para construir prompts de agentes con inyección de datos."""
+    return build_agent_prompt_parts(gem_id, payload).text
@@ -4,9 +4,9 @@ from contextlib import asynccontextmanager
 from typing import Optional
 
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import httpx
 import asyncio
 
@@ -15,7 +15,8 @@ from agent.gemini_client import GeminiClient
 from agent.gem6.orchestrator import GEM6Orchestrator
 from agent.drive_client import DriveClient
 from utils.input_loader import load_local_inputs
-from utils.ws_logger import active_connections
+from utils.ws_logger import broadcaster, pipeline_state
+from utils.gem_core import GEMClient
 
 
 @asynccontextmanager
@@ -25,7 +26,12 @@ async def lifespan(app: FastAPI):
         print(
             "⚠️  WARNING: GEMINI_API_KEY no detectada. La API fallará si no se configura al momento del request."
         )
-    yield
+    # Pool de conexiones al DB API compartido por todas las corridas
+    async with GEMClient(config.DB_API_URL) as db_client:
+        app.state.db_client = db_client
+        yield
+    # Escribe a disco los últimos pasos que el flush en segundo plano aún no guardó
+    await pipeline_state.flush()
 
 
 app = FastAPI(
@@ -58,6 +64,8 @@ class PipelineRequest(BaseModel):
     candidate_id: Optional[str] = None  # Si se quiere procesar solo uno
     model: str = config.DEFAULT_MODEL
     webhook_url: Optional[str] = None  # Para n8n asíncrono
+    concurrency: int = Field(default=config.MAX_CONCURRENT_CANDIDATES, ge=1)  # Candidatos en paralelo
+    force: bool = False  # Reprocesar aunque los inputs no hayan cambiado
 
 
 class PipelineResponse(BaseModel):
@@ -78,28 +86,47 @@ async def run_pipeline(request: PipelineRequest) -> dict:
 
     search_inputs = {}
     candidates = {}
+    drive = None
 
-    if request.drive_folder:
-        drive = DriveClient(credentials_path=config.DRIVE_CREDENTIALS_PATH)
-        structure = drive.discover_search_structure(request.drive_folder)
-        search_inputs = structure["search_inputs"]
-        candidates = structure["candidates"]
-    else:
-        search_inputs, candidates = load_local_inputs(request.local_dir)
-
-    if request.candidate_id:
-        if request.candidate_id not in candidates:
-            raise ValueError(f"Candidato {request.candidate_id} no encontrado.")
-        candidates = {request.candidate_id: candidates[request.candidate_id]}
-
-    output_dir = os.path.join("runs", request.search_id, "outputs")
-    os.makedirs(output_dir, exist_ok=True)
-
-    gemini = GeminiClient(api_key=api_key, model=request.model)
-    orchestrator = GEM6Orchestrator(gemini=gemini, search_id=request.search_id, output_dir=output_dir)
+    try:
+        if request.drive_folder:
+            # El cliente de Drive es bloqueante (descargas en su propio pool de hilos): fuera del event loop
+            drive = await asyncio.to_thread(DriveClient, credentials_path=config.DRIVE_CREDENTIALS_PATH)
+            structure = await asyncio.to_thread(drive.discover_search_structure, request.drive_folder)
+            search_inputs = structure["search_inputs"]
+            candidates = structure["candidates"]
+        else:
+            search_inputs, candidates = load_local_inputs(request.local_dir)
+
+        if request.candidate_id:
+            if request.candidate_id not in candidates:
+                raise ValueError(f"Candidato {request.candidate_id} no encontrado.")
+            candidates = {request.candidate_id: candidates[request.candidate_id]}
+
+        output_dir = os.path.join("runs", request.search_id, "outputs")
+        os.makedirs(output_dir, exist_ok=True)
+
+        gemini = GeminiClient(api_key=api_key, model=request.model)
+        orchestrator = GEM6Orchestrator(
+            gemini=gemini,
+            search_id=request.search_id,
+            output_dir=output_dir,
+            concurrency=request.concurrency,
+            force=request.force,
+            db_client=getattr(app.state, "db_client", None),
+            drive=drive,
+        )
 
-    # Ejecución asíncrona no bloqueante
-    await orchestrator.run_pipeline(search_inputs, candidates)
+        # Ejecución asíncrona no bloqueante
+        try:
+            await orchestrator.run_pipeline(search_inputs, candidates)
+        finally:
+            await orchestrator.aclose()
+            await gemini.aclose()
+    finally:
+        if drive is not None:
+            # Cierra la conexión SQLite del cache de descargas de Drive
+            await asyncio.to_thread(drive.close)
 
     summary_path = os.path.join(output_dir, "pipeline_summary.json")
     summary_data = {}
@@ -181,11 +208,11 @@ async def setup_search(request: SetupSearchRequest):
         "company_context": request.company_context or ""
     }
     
-    gemini = GeminiClient(api_key=config.GEMINI_API_KEY)
     # Ejecutar GEM 5 directamente
     from agent.prompt_builder import build_gem5_prompt
     prompt = build_gem5_prompt(search_inputs)
-    result = gemini.run_gem(prompt, gem_name="gem5")
+    async with GeminiClient(api_key=config.GEMINI_API_KEY) as gemini:
+        result = await gemini.arun_gem(prompt, gem_name="gem5")
     
     # Guardar resultados
     with open(os.path.join(output_dir, "gem5.json"), "w", encoding="utf-8") as f:
@@ -263,8 +290,8 @@ async def refine_gem(request: RefineRequest):
     4. NO agregues explicaciones, solo el contenido del nuevo prompt.
     """
     
-    gemini = GeminiClient(api_key=config.GEMINI_API_KEY)
-    result = gemini.run_gem(refinement_prompt)
+    async with GeminiClient(api_key=config.GEMINI_API_KEY) as gemini:
+        result = await gemini.arun_gem(refinement_prompt)
     new_prompt = result.get("markdown", "") or result.get("raw", "")
     
     if new_prompt:
@@ -274,17 +301,58 @@ async def refine_gem(request: RefineRequest):
     
     return {"status": "error", "message": "Failed to generate new prompt"}
 
+# Cada cuánto manda un comentario SSE para que proxies y clientes no corten la conexión
+SSE_KEEPALIVE_SECONDS = 15.0
+
+
+def format_sse(event: dict) -> str:
+    return f"id: {event['seq']}\nevent: log\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+@app.get("/api/v1/runs/{search_id}/events")
+async def run_events(search_id: str, request: Request, after: int = 0, timeout: float = 25.0, limit: int = 500):
+    """
+    Eventos de una corrida con su número de secuencia (`seq`), a partir de `after`.
+
+    - `Accept: text/event-stream`: Server-Sent Events; reenvía desde el cursor (o desde
+      el header Last-Event-ID al reconectar) y después sigue en vivo.
+    - Si no, long-poll: responde apenas hay eventos con seq > `after`, o vacío tras
+      `timeout` segundos. El próximo pedido usa `after=last_seq`.
+    """
+    limit = max(1, min(limit, 1000))
+    if "text/event-stream" not in request.headers.get("accept", ""):
+        events = await pipeline_state.wait_events(search_id, after, max(0.0, min(timeout, 60.0)), limit)
+        return {"search_id": search_id, "events": events, "last_seq": events[-1]["seq"] if events else after}
+
+    last_event_id = request.headers.get("last-event-id", "")
+    cursor = int(last_event_id) if last_event_id.isdigit() else after
+
+    async def stream():
+        nonlocal cursor
+        while not await request.is_disconnected():
+            events = await pipeline_state.wait_events(search_id, cursor, SSE_KEEPALIVE_SECONDS, limit)
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            yield "".join(format_sse(event) for event in events)
+            cursor = events[-1]["seq"]
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
 @app.websocket("/ws/logs")
-async def websocket_logs(websocket: WebSocket):
+async def websocket_logs(websocket: WebSocket, search_id: Optional[str] = None, entity_id: Optional[str] = None):
+    """Logs en vivo; `?search_id=` / `?entity_id=` filtran los mensajes que recibe este cliente."""
     await websocket.accept()
-    active_connections.append(websocket)
+    subscriber = broadcaster.subscribe(websocket, search_id=search_id, entity_id=entity_id)
     try:
         while True:
-            # Keep connection alive
-            await asyncio.sleep(60)
+            # Solo detecta la desconexión: el envío lo hace la tarea propia del suscriptor
+            await websocket.receive_text()
     except WebSocketDisconnect:
-        if websocket in active_connections:
-            active_connections.remove(websocket)
+        pass
+    finally:
+        await broadcaster.unsubscribe(subscriber)
 
 @app.get("/health")
 def health_check():
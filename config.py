@@ -13,6 +13,65 @@ DEFAULT_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.3:70b")
 
+# Ollama HTTP transport (pooled keep-alive connections, seconds for timeouts)
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "16"))
+OLLAMA_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OLLAMA_MAX_KEEPALIVE_CONNECTIONS", "8"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "60"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "120"))
+# How long Ollama keeps the model (and the KV cache of a reused prompt prefix) loaded
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Streaming generation in arun_gem (progress updates every N seconds)
+LLM_STREAMING = os.getenv("LLM_STREAMING", "false").lower() in ("1", "true", "yes")
+LLM_STREAM_PROGRESS_INTERVAL = float(os.getenv("LLM_STREAM_PROGRESS_INTERVAL", "1.0"))
+
+# Gemini explicit context caching of static prompt prefixes (smaller prefixes go as system_instruction)
+GEMINI_CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "1024"))
+GEMINI_CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+# A cached content is re-created this many seconds before its TTL runs out
+GEMINI_CONTEXT_CACHE_REFRESH_SECONDS = int(os.getenv("GEMINI_CONTEXT_CACHE_REFRESH_SECONDS", "60"))
+
+# DB API client (utils.gem_core.GEMClient): pooled HTTP/1.1 keep-alive connections
+DB_API_URL = os.getenv("DB_API_URL", "http://localhost:8000")
+DB_API_MAX_CONNECTIONS = int(os.getenv("DB_API_MAX_CONNECTIONS", "20"))
+DB_API_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("DB_API_MAX_KEEPALIVE_CONNECTIONS", "10"))
+DB_API_KEEPALIVE_EXPIRY = float(os.getenv("DB_API_KEEPALIVE_EXPIRY", "30"))
+DB_API_CONNECT_TIMEOUT = float(os.getenv("DB_API_CONNECT_TIMEOUT", "2"))
+DB_API_TIMEOUT = float(os.getenv("DB_API_TIMEOUT", "10"))
+# Write-behind: upserts/logs are queued and flushed in batches by a background task
+DB_WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+DB_WRITE_BEHIND_MAX_QUEUE = int(os.getenv("DB_WRITE_BEHIND_MAX_QUEUE", "1000"))
+DB_WRITE_BEHIND_BATCH_SIZE = int(os.getenv("DB_WRITE_BEHIND_BATCH_SIZE", "100"))
+DB_WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("DB_WRITE_BEHIND_FLUSH_INTERVAL", "0.5"))
+# Batches failing with a network error or 5xx are retried (exponential backoff from this base, in
+# seconds) and then queued again
+DB_WRITE_BEHIND_RETRIES = int(os.getenv("DB_WRITE_BEHIND_RETRIES", "3"))
+DB_WRITE_BEHIND_RETRY_BACKOFF = float(os.getenv("DB_WRITE_BEHIND_RETRY_BACKOFF", "0.5"))
+
+# LLM response cache (agent/llm_cache.py)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_responses.sqlite")
+LLM_CACHE_MAX_BYTES = int(float(os.getenv("LLM_CACHE_MAX_MB", "256")) * 1024 * 1024)
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_HOURS", "168")) * 3600
+# Cache hits update their LRU timestamp in memory; pending timestamps are written at most this often
+LLM_CACHE_TOUCH_INTERVAL = float(os.getenv("LLM_CACHE_TOUCH_INTERVAL", "5"))
+# Calls with a sampling temperature above this are treated as non-deterministic and bypass the cache
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.5"))
+
+# Live pipeline state for the dashboard (utils/ws_logger.py): runs/<search_id>/pipeline_state.json
+PIPELINE_STATE_DIR = os.getenv("PIPELINE_STATE_DIR", "runs")
+PIPELINE_STATE_MAX_STEPS = int(os.getenv("PIPELINE_STATE_MAX_STEPS", "50"))
+PIPELINE_STATE_FLUSH_INTERVAL = float(os.getenv("PIPELINE_STATE_FLUSH_INTERVAL", "0.5"))
+# Events per search kept in memory for /api/v1/runs/{search_id}/events (older ones replay from events.ndjson)
+PIPELINE_EVENTS_MAX = int(os.getenv("PIPELINE_EVENTS_MAX", "1000"))
+# Searches kept in memory: least recently used ones beyond the cap, or idle this long, are dropped
+# (their history stays in events.ndjson and is reloaded on the next event)
+PIPELINE_STATE_MAX_SEARCHES = int(os.getenv("PIPELINE_STATE_MAX_SEARCHES", "100"))
+PIPELINE_STATE_IDLE_SECONDS = float(os.getenv("PIPELINE_STATE_IDLE_SECONDS", "3600"))
+# Per-websocket send queue for /ws/logs; slow clients lose their oldest messages
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "100"))
+
 # Gating Thresholds
 SCORING_CUTOFF = float(os.getenv("SCORING_CUTOFF", "0.4"))
 QA_GATE_CUTOFF = float(os.getenv("QA_GATE_CUTOFF", "0.85"))
@@ -24,6 +83,13 @@ THRESHOLDS = {
     "gem4": 7,
 }
 
+# Max candidates processed in parallel by GEM6Orchestrator.run_pipeline (1 = sequential)
+MAX_CONCURRENT_CANDIDATES = int(os.getenv("MAX_CONCURRENT_CANDIDATES", "1"))
+
+# GEM 6 working memory: last N steps in full, older steps as digests, capped by an estimated token budget
+GEM6_MEMORY_WINDOW = int(os.getenv("GEM6_MEMORY_WINDOW", "3"))
+GEM6_MEMORY_TOKEN_BUDGET = int(os.getenv("GEM6_MEMORY_TOKEN_BUDGET", "2000"))
+
 # Max retries for validation/JSON failures
 MAX_RETRIES_ON_BLOCK = int(os.getenv("MAX_RETRIES_ON_BLOCK", "2"))
 
@@ -44,3 +110,11 @@ GEM_CONFIGS = {
 # Google Drive Settings
 DRIVE_CREDENTIALS_PATH = os.getenv("DRIVE_CREDENTIALS_PATH", "credentials.json")
 DRIVE_TOKEN_FILE = "token.json"
+# Parallel Drive downloads: worker threads, retries per file (429/5xx/network) and base backoff in seconds
+DRIVE_DOWNLOAD_WORKERS = int(os.getenv("DRIVE_DOWNLOAD_WORKERS", "8"))
+DRIVE_DOWNLOAD_RETRIES = int(os.getenv("DRIVE_DOWNLOAD_RETRIES", "3"))
+DRIVE_RETRY_BACKOFF = float(os.getenv("DRIVE_RETRY_BACKOFF", "0.5"))
+# Drive download cache (agent/drive_cache.py): content per file id + revision (md5Checksum/modifiedTime)
+DRIVE_CACHE_ENABLED = os.getenv("DRIVE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+DRIVE_CACHE_PATH = os.getenv("DRIVE_CACHE_PATH", ".cache/drive_files.sqlite")
+DRIVE_CACHE_MAX_BYTES = int(float(os.getenv("DRIVE_CACHE_MAX_MB", "512")) * 1024 * 1024)
@@ -1,51 +1,100 @@
 import streamlit as st
-import json
 from pathlib import Path
 import time
 import os
 
+from utils.run_monitor import RunMonitor
+
 st.set_page_config(page_title="Raadbot Live", layout="wide", page_icon="🚀")
 st.title("🚀 Raadbot - Visor en Vivo de GEMs")
 
-log_file = Path("pipeline_state.json")
+# Cada búsqueda escribe su log de eventos en runs/<search_id>/events.ndjson (utils/ws_logger.py)
+state_dir = Path(os.getenv("PIPELINE_STATE_DIR", "runs"))
+refresh_seconds = float(os.getenv("DASHBOARD_REFRESH_SECONDS", "2"))
+# Pasos que se muestran (los más recientes primero)
+max_steps = int(os.getenv("DASHBOARD_MAX_STEPS", "50"))
+
+
+def list_searches():
+    files = sorted(state_dir.glob("*/events.ndjson"), key=lambda p: p.stat().st_mtime, reverse=True)
+    return [p.parent.name for p in files]
+
+
+searches = list_searches()
 
 # Sidebar info
 st.sidebar.header("Sistema")
 st.sidebar.info(f"Proveedor: {os.getenv('LLM_PROVIDER', 'gemini')}")
+search_id = st.sidebar.selectbox("Búsqueda", searches, key="search_id") if searches else None
+log_file = state_dir / search_id / "events.ndjson" if search_id else None
 st.sidebar.info(f"Archivo: {log_file}")
 
-placeholder = st.empty()
+
+def render_step(step):
+    gem_name = step.get('gem', 'GEM')
+    status = step.get('status', 'N/A')
+    score = step.get('score', 'N/A')
+
+    col1, col2 = st.columns([1, 4])
+    with col1:
+        if status == "OK":
+            st.success(f"{gem_name}")
+        elif status == "BLOCKED":
+            st.error(f"{gem_name}")
+        else:
+            st.info(f"{gem_name}")
+
+    with col2:
+        with st.expander(f"#{step.get('seq', '-')} {step.get('action', 'Acción')} - Score: {score}"):
+            st.json(step)
+
+
+def render_panels(stats):
+    totals = stats.totals()
+    cols = st.columns(4)
+    cols[0].metric("Pasos OK", totals["ok"])
+    cols[1].metric("Bloqueados", totals["blocked"])
+    cols[2].metric("Candidatos en curso", totals["in_flight"])
+    cols[3].metric("Finalizados", totals["finished"])
+    if stats.gems:
+        st.table(stats.gem_rows())
+
+
+def render_steps(stats):
+    for step in list(stats.recent)[::-1][:max_steps]:
+        render_step(step)
+
+
+if log_file is None:
+    st.warning("Esperando a que se inicie el pipeline (no hay runs/*/events.ndjson)...")
+    time.sleep(refresh_seconds)
+    st.rerun()
+
+monitor = RunMonitor(str(log_file), recent=max_steps)
+panels = st.empty()
+steps_box = st.empty()
+
+# Primera lectura: el archivo completo una vez, pero solo se dibujan los pasos recientes
+monitor.refresh()
+with panels.container():
+    render_panels(monitor.stats)
+with steps_box.container():
+    render_steps(monitor.stats)
 
 while True:
-    if log_file.exists():
-        try:
-            # Read state
-            content = log_file.read_text(encoding="utf-8")
-            if content:
-                data = json.loads(content)
-                with placeholder.container():
-                    steps = data.get("steps", [])
-                    # Show last steps first
-                    for step in reversed(steps):
-                        gem_name = step.get('gem', 'GEM')
-                        status = step.get('status', 'N/A')
-                        score = step.get('score', 'N/A')
-
-                        col1, col2 = st.columns([1, 4])
-                        with col1:
-                            if status == "OK":
-                                st.success(f"{gem_name}")
-                            elif status == "BLOCKED":
-                                st.error(f"{gem_name}")
-                            else:
-                                st.info(f"{gem_name}")
-
-                        with col2:
-                            with st.expander(f"{step.get('action', 'Acción')} - Score: {score}"):
-                                st.json(step)
-        except Exception as e:
-            st.error(f"Error leyendo logs: {e}")
-    else:
-        st.warning("Esperando a que se inicie el pipeline (archivo pipeline_state.json no encontrado)...")
-
-    time.sleep(2)
+    time.sleep(refresh_seconds)
+    # Búsquedas nuevas (o borradas) aparecen en el selector
+    if set(list_searches()) != set(searches):
+        st.rerun()
+    resets = monitor.tail.resets
+    # Sin cambios de mtime/tamaño no se lee ni se redibuja nada
+    new_steps = monitor.refresh()
+    if monitor.tail.resets != resets:
+        st.rerun()
+    if not new_steps:
+        continue
+    with panels.container():
+        render_panels(monitor.stats)
+    # Ventana fija de pasos: se redibuja entera, así la página no crece con la corrida
+    with steps_box.container():
+        render_steps(monitor.stats)
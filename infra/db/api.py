@@ -1,33 +1,33 @@
 import os
-import sqlite3
 import json
-from datetime import datetime
+import base64
+from datetime import date, datetime
 from typing import List, Optional, Dict, Any
-from fastapi import FastAPI, HTTPException, Request
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+
+from infra.db.storage import ENTITY_COLUMNS, EntityQuery, create_storage
 
 app = FastAPI(title="GEM v3.0 DB API")
 
 DB_PATH = os.getenv("DB_PATH", "infra/db/gem_v3.sqlite")
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_db():
-    schema_path = "infra/db/schema.sql"
-    if os.path.exists(schema_path):
-        with open(schema_path, "r") as f:
-            schema = f.read()
-        conn = get_db()
-        conn.executescript(schema)
-        conn.commit()
-        conn.close()
+# Storage backend: DB_URL=postgresql://... for PostgreSQL, otherwise SQLite at DB_PATH
+storage = create_storage(os.getenv("DB_URL") or DB_PATH)
+
+# GET /entities page size (default and upper bound for ?limit=)
+PAGE_SIZE = int(os.getenv("DB_API_PAGE_SIZE", "500"))
+MAX_PAGE_SIZE = int(os.getenv("DB_API_MAX_PAGE_SIZE", "5000"))
 
 @app.on_event("startup")
-def startup_event():
-    init_db()
+async def startup_event():
+    await storage.open()
+    await storage.init_schema()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await storage.close()
 
 # Models
 class EntityUpdate(BaseModel):
@@ -49,104 +49,151 @@ class DiscardEntity(BaseModel):
     agent_responsible: str
     trace_id: str
 
+def encode_cursor(row: Dict[str, Any]) -> str:
+    raw = json.dumps([row["updated_at"], row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        updated_at, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(updated_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_fields(fields: Optional[str]) -> tuple:
+    if not fields:
+        return ENTITY_COLUMNS
+    names = tuple(f.strip() for f in fields.split(",") if f.strip())
+    unknown = [f for f in names if f not in ENTITY_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {unknown}")
+    return names
+
+def project(rows: List[Dict[str, Any]], fields: tuple) -> List[Dict[str, Any]]:
+    # The storage always returns the keyset columns; drop them unless requested
+    if "id" in fields and "updated_at" in fields:
+        return rows
+    return [{f: row[f] for f in fields} for row in rows]
+
+def batch_response(total: int, errors: List[Dict[str, Any]]) -> Dict[str, Any]:
+    errors.sort(key=lambda e: e["index"])
+    return {
+        "status": "success" if not errors else ("partial" if len(errors) < total else "failed"),
+        "written": total - len(errors),
+        "errors": errors,
+    }
+
 # Endpoints
 @app.post("/entity/upsert")
 async def upsert_entity(data: EntityUpdate):
-    conn = get_db()
-    cursor = conn.cursor()
-    now = datetime.now().isoformat()
-    
     try:
-        cursor.execute("""
-            INSERT INTO entity_state (
-                entity_id, current_stage, state, last_score, 
-                human_required, metadata, agent_responsible, trace_id, 
-                created_at, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(entity_id) DO UPDATE SET
-                current_stage=excluded.current_stage,
-                state=excluded.state,
-                last_score=excluded.last_score,
-                human_required=excluded.human_required,
-                metadata=excluded.metadata,
-                agent_responsible=excluded.agent_responsible,
-                trace_id=excluded.trace_id,
-                updated_at=excluded.updated_at
-        """, (
-            data.entity_id, data.current_stage, data.state, data.last_score,
-            data.human_required, json.dumps(data.metadata), data.agent_responsible, data.trace_id,
-            now, now
-        ))
-        conn.commit()
+        await storage.upsert_entity(data.model_dump(), datetime.now())
         return {"status": "success"}
     except Exception as e:
-        conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+
+@app.post("/entity/upsert_batch")
+async def upsert_entity_batch(rows: List[Dict[str, Any]]):
+    """Upserts N entities in one transaction; invalid rows are reported by index."""
+    errors, valid, indexes = [], [], []
+    for i, row in enumerate(rows):
+        try:
+            valid.append(EntityUpdate(**row).model_dump())
+            indexes.append(i)
+        except ValidationError as e:
+            errors.append({"index": i, "error": str(e)})
+
+    if valid:
+        errors += await storage.upsert_entities(valid, indexes, datetime.now())
+    return batch_response(len(rows), errors)
 
 @app.post("/entity/discard")
 async def discard_entity(data: DiscardEntity):
-    conn = get_db()
-    cursor = conn.cursor()
-    
     try:
-        # Move to discarded table
-        cursor.execute("""
-            INSERT INTO discarded_entities (
-                entity_id, stage_at_discard, reason, score_at_discard, 
-                metadata, agent_responsible, trace_id
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
-            data.entity_id, data.stage_at_discard, data.reason, data.score_at_discard,
-            json.dumps(data.metadata), data.agent_responsible, data.trace_id
-        ))
-        # Remove from active state
-        cursor.execute("DELETE FROM entity_state WHERE entity_id = ?", (data.entity_id,))
-        conn.commit()
+        await storage.discard_entity(data.model_dump(), datetime.now())
         return {"status": "discarded"}
     except Exception as e:
-        conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @app.get("/entities")
-async def get_entities(stage: Optional[str] = None):
-    conn = get_db()
-    cursor = conn.cursor()
-    if stage:
-        cursor.execute("SELECT * FROM entity_state WHERE current_stage = ?", (stage,))
-    else:
-        cursor.execute("SELECT * FROM entity_state")
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+async def get_entities(
+    stage: Optional[str] = None,
+    state: Optional[str] = None,
+    min_score: Optional[float] = None,
+    max_score: Optional[float] = None,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    """
+    Entities ordered by (updated_at, id), one keyset page at a time.
+
+    JSON: a list with at most `limit` rows; when more rows exist the `X-Next-Cursor`
+    header holds the cursor for the next page. NDJSON: every matching row from
+    `cursor` on, streamed one line per row, fetched `limit` rows at a time.
+    """
+    columns = parse_fields(fields)
+    query = EntityQuery(
+        stage=stage, state=state, min_score=min_score, max_score=max_score, fields=columns,
+        after=decode_cursor(cursor) if cursor else None, limit=limit,
+    )
+
+    if format == "ndjson":
+        async def stream():
+            page = query
+            while True:
+                rows = await storage.query_entities(page)
+                if rows:
+                    yield "".join(json.dumps(row) + "\n" for row in project(rows, columns))
+                if len(rows) < page.limit:
+                    return
+                page = page._replace(after=(rows[-1]["updated_at"], rows[-1]["id"]))
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    # One extra row tells whether there is a next page without a COUNT(*)
+    rows = await storage.query_entities(query._replace(limit=limit + 1))
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1])
+    # Rows are plain scalars: json.dumps directly, jsonable_encoder is not needed
+    return Response(content=json.dumps(project(rows, columns)), media_type="application/json", headers=headers)
+
+@app.get("/entity/{entity_id}")
+async def get_entity(entity_id: str):
+    entity = await storage.get_entity(entity_id)
+    if entity is None:
+        raise HTTPException(status_code=404, detail="Entity not found")
+    entity["metadata"] = json.loads(entity["metadata"] or "{}")
+    return entity
 
 @app.post("/log/discovery")
 async def log_discovery(data: Dict[str, Any]):
-    conn = get_db()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            INSERT INTO discovery_logs (
-                entity_id, agent_id, input_contract_verified, 
-                output_contract_verified, execution_time_ms, status, 
-                error_message, trace_id
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            data.get("entity_id"), data.get("agent_id"), data.get("input_ok"),
-            data.get("output_ok"), data.get("time_ms"), data.get("status"),
-            data.get("error"), data.get("trace_id")
-        ))
-        conn.commit()
-        return {"status": "logged"}
-    finally:
-        conn.close()
+    await storage.insert_log(data, datetime.now())
+    return {"status": "logged"}
+
+@app.post("/log/discovery/batch")
+async def log_discovery_batch(rows: List[Dict[str, Any]]):
+    """Inserts N discovery logs in one transaction; failing rows are reported by index."""
+    errors = await storage.insert_logs(rows, datetime.now()) if rows else []
+    return batch_response(len(rows), errors)
+
+@app.get("/metrics/funnel")
+async def funnel_metrics(search_id: Optional[str] = None, day_from: Optional[date] = None, day_to: Optional[date] = None):
+    """
+    Funnel counts, discard/acceptance rates and per-agent log metrics, read from the
+    funnel_rollup aggregates the write endpoints maintain (no scan of the logs).
+    """
+    return await storage.funnel(
+        search_id,
+        day_from.isoformat() if day_from else None,
+        day_to.isoformat() if day_to else None,
+    )
 
 @app.get("/health")
 async def health_check():
-    return {"status": "ok", "service": "db-api"}
+    return {"status": "ok", "service": "db-api", "backend": storage.dialect}
 
 if __name__ == "__main__":
     import uvicorn
@@ -52,8 +52,21 @@ CREATE TABLE IF NOT EXISTS performance_metrics (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Funnel aggregates maintained by the DB API on every write (signed deltas per
+-- search/agent/stage/day); metrics are: active, discarded, logs, errors, time_ms, timed
+CREATE TABLE IF NOT EXISTS funnel_rollup (
+    search_id TEXT NOT NULL DEFAULT '',
+    agent_id TEXT NOT NULL DEFAULT '',
+    stage TEXT NOT NULL DEFAULT '',
+    day TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (search_id, agent_id, stage, day, metric)
+);
+
 -- Indexes for performance
 CREATE INDEX IF NOT EXISTS idx_entity_state_entity_id ON entity_state(entity_id);
 CREATE INDEX IF NOT EXISTS idx_entity_state_state ON entity_state(state);
+CREATE INDEX IF NOT EXISTS idx_entity_state_updated ON entity_state(updated_at, id);
 CREATE INDEX IF NOT EXISTS idx_discovery_logs_entity_id ON discovery_logs(entity_id);
 CREATE INDEX IF NOT EXISTS idx_performance_metrics_name ON performance_metrics(metric_name);
@@ -0,0 +1,797 @@
+import abc
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "schema.sql")
+
+# SQL shared by every backend, written with `?` placeholders (see to_postgres)
+UPSERT_ENTITY_SQL = """
+    INSERT INTO entity_state (
+        entity_id, current_stage, state, last_score,
+        human_required, metadata, agent_responsible, trace_id,
+        created_at, updated_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(entity_id) DO UPDATE SET
+        current_stage=excluded.current_stage,
+        state=excluded.state,
+        last_score=excluded.last_score,
+        human_required=excluded.human_required,
+        metadata=excluded.metadata,
+        agent_responsible=excluded.agent_responsible,
+        trace_id=excluded.trace_id,
+        updated_at=excluded.updated_at
+"""
+
+INSERT_DISCARD_SQL = """
+    INSERT INTO discarded_entities (
+        entity_id, stage_at_discard, reason, score_at_discard,
+        metadata, agent_responsible, trace_id
+    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+DELETE_ENTITY_SQL = "DELETE FROM entity_state WHERE entity_id = ?"
+
+INSERT_LOG_SQL = """
+    INSERT INTO discovery_logs (
+        entity_id, agent_id, input_contract_verified,
+        output_contract_verified, execution_time_ms, status,
+        error_message, trace_id
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Funnel rollups are signed deltas keyed by (search_id, agent_id, stage, day, metric);
+# summing `value` over any subset of the key gives the aggregate for that slice
+ROLLUP_SQL = """
+    INSERT INTO funnel_rollup (search_id, agent_id, stage, day, metric, value)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(search_id, agent_id, stage, day, metric) DO UPDATE SET
+        value = funnel_rollup.value + excluded.value
+"""
+
+MIGRATIONS_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version TEXT PRIMARY KEY,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+TABLES = ("entity_state", "discarded_entities", "discovery_logs", "performance_metrics", "funnel_rollup")
+
+ENTITY_COLUMNS = (
+    "id", "entity_id", "current_stage", "state", "last_score", "human_required",
+    "metadata", "agent_responsible", "trace_id", "created_at", "updated_at",
+)
+
+
+class EntityQuery(NamedTuple):
+    """
+    Filters and keyset position for listing entities. Rows are ordered by
+    (updated_at, id); `after` is the (updated_at, id) of the last row already seen.
+    """
+    stage: Optional[str] = None
+    state: Optional[str] = None
+    min_score: Optional[float] = None
+    max_score: Optional[float] = None
+    fields: Tuple[str, ...] = ENTITY_COLUMNS
+    after: Optional[Tuple[str, int]] = None
+    limit: int = 500
+
+
+def build_entity_query(query: EntityQuery) -> Tuple[str, list]:
+    """SELECT for one page of entities. The keyset columns are always selected."""
+    unknown = set(query.fields) - set(ENTITY_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {sorted(unknown)}")
+    columns = list(dict.fromkeys((*query.fields, "updated_at", "id")))
+
+    where, params = [], []
+    for column, op, value in (
+        ("current_stage", "=", query.stage),
+        ("state", "=", query.state),
+        ("last_score", ">=", query.min_score),
+        ("last_score", "<=", query.max_score),
+    ):
+        if value is not None:
+            where.append(f"{column} {op} ?")
+            params.append(value)
+    if query.after is not None:
+        # Row-value comparison lets the (updated_at, id) index seek straight to the page
+        where.append("(updated_at, id) > (?, ?)")
+        params.extend(query.after)
+
+    sql = f"SELECT {', '.join(columns)} FROM entity_state"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY updated_at, id LIMIT ?"
+    params.append(query.limit)
+    return sql, params
+
+
+def entity_params(data: Dict[str, Any], now: datetime) -> tuple:
+    return (
+        data["entity_id"], data["current_stage"], data["state"], data.get("last_score"),
+        data.get("human_required"), json.dumps(data.get("metadata") or {}), data["agent_responsible"],
+        data["trace_id"], now, now
+    )
+
+
+def discard_params(data: Dict[str, Any]) -> tuple:
+    return (
+        data["entity_id"], data["stage_at_discard"], data.get("reason"), data.get("score_at_discard"),
+        json.dumps(data.get("metadata") or {}), data["agent_responsible"], data["trace_id"]
+    )
+
+
+def log_params(data: Dict[str, Any]) -> tuple:
+    return (
+        data.get("entity_id"), data.get("agent_id"), data.get("input_ok"),
+        data.get("output_ok"), data.get("time_ms"), data.get("status"),
+        data.get("error"), data.get("trace_id")
+    )
+
+
+def search_of(metadata: Any) -> str:
+    """The search an entity belongs to, as recorded in its metadata (JSON text or dict)."""
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except ValueError:
+            return ""
+    return str((metadata or {}).get("search_id") or "") if isinstance(metadata, dict) else ""
+
+
+def entity_snapshot(data: Dict[str, Any]) -> Tuple[str, str, str]:
+    """The rollup key (search_id, agent_id, stage) an active entity is counted under."""
+    return search_of(data.get("metadata")), data.get("agent_responsible") or "", data["current_stage"]
+
+
+def entity_deltas(old: Optional[tuple], data: Dict[str, Any], day: str) -> list:
+    """Moves the entity's `active` count from its previous slice (if any) to the new one."""
+    new = entity_snapshot(data)
+    if old == new:
+        return []
+    deltas = [((*new, day, "active"), 1)]
+    if old is not None:
+        deltas.append(((*old, day, "active"), -1))
+    return deltas
+
+
+def discard_deltas(old: Optional[tuple], data: Dict[str, Any], day: str) -> list:
+    deltas = [((search_of(data.get("metadata")), data["agent_responsible"], data["stage_at_discard"], day, "discarded"), 1)]
+    if old is not None:
+        deltas.append(((*old, day, "active"), -1))
+    return deltas
+
+
+def log_deltas(data: Dict[str, Any], day: str) -> list:
+    key = (str(data.get("search_id") or ""), data.get("agent_id") or "", "", day)
+    deltas = [((*key, "logs"), 1)]
+    if data.get("status") != "OK":
+        deltas.append(((*key, "errors"), 1))
+    if data.get("time_ms") is not None:
+        deltas += [((*key, "time_ms"), int(data["time_ms"])), ((*key, "timed"), 1)]
+    return deltas
+
+
+def rollup_params(deltas: Sequence[Tuple[tuple, int]]) -> List[tuple]:
+    """ROLLUP_SQL rows for `deltas`, merged per key and sorted (stable lock order)."""
+    totals: Dict[tuple, int] = {}
+    for key, value in deltas:
+        totals[key] = totals.get(key, 0) + value
+    return [(*key, value) for key, value in sorted(totals.items()) if value]
+
+
+def rollup_rebuild_sql(dialect: str) -> List[str]:
+    """
+    Statements that rebuild funnel_rollup from the base tables, run once when the
+    rollup table is first created on a database that already holds data. Logs are
+    not linked to a search in discovery_logs, so rebuilt log rows have search_id ''.
+    """
+    if dialect == "postgresql":
+        search = "COALESCE(metadata::json ->> 'search_id', '')"
+        day = "to_char({}, 'YYYY-MM-DD')"
+    else:
+        search = "COALESCE(json_extract(metadata, '$.search_id'), '')"
+        day = "substr({}, 1, 10)"
+    insert = "INSERT INTO funnel_rollup (search_id, agent_id, stage, day, metric, value) "
+    log_group = "FROM discovery_logs GROUP BY 1, 2, 3, 4"
+    log_key = f"'', COALESCE(agent_id, ''), '', {day.format('created_at')}"
+    return [
+        insert + f"SELECT {search}, COALESCE(agent_responsible, ''), current_stage, {day.format('updated_at')}, "
+                 "'active', COUNT(*) FROM entity_state GROUP BY 1, 2, 3, 4",
+        insert + f"SELECT {search}, COALESCE(agent_responsible, ''), stage_at_discard, {day.format('created_at')}, "
+                 "'discarded', COUNT(*) FROM discarded_entities GROUP BY 1, 2, 3, 4",
+        insert + f"SELECT {log_key}, 'logs', COUNT(*) {log_group}",
+        insert + f"SELECT {log_key}, 'errors', COUNT(*) FROM discovery_logs "
+                 "WHERE COALESCE(status, '') <> 'OK' GROUP BY 1, 2, 3, 4",
+        insert + f"SELECT {log_key}, 'time_ms', SUM(execution_time_ms) FROM discovery_logs "
+                 "WHERE execution_time_ms IS NOT NULL GROUP BY 1, 2, 3, 4",
+        insert + f"SELECT {log_key}, 'timed', COUNT(execution_time_ms) FROM discovery_logs "
+                 "WHERE execution_time_ms IS NOT NULL GROUP BY 1, 2, 3, 4",
+    ]
+
+
+def build_funnel_query(search_id: Optional[str] = None, day_from: Optional[str] = None,
+                       day_to: Optional[str] = None) -> Tuple[str, list]:
+    where, params = [], []
+    for clause, value in (("search_id = ?", search_id), ("day >= ?", day_from), ("day <= ?", day_to)):
+        if value is not None:
+            where.append(clause)
+            params.append(value)
+    sql = "SELECT metric, agent_id, stage, CAST(SUM(value) AS BIGINT) AS value FROM funnel_rollup"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return sql + " GROUP BY metric, agent_id, stage", params
+
+
+def funnel_summary(rows: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    The metrics scripts/metrics_summary.py used to compute with full scans, from the
+    grouped rollup rows of build_funnel_query. With a day range, `funnel_counts` is
+    the net change over those days rather than the current state.
+    """
+    def by(metric, dim):
+        totals: Dict[str, int] = {}
+        for row in rows:
+            if row["metric"] == metric:
+                totals[row[dim]] = totals.get(row[dim], 0) + row["value"]
+        return {k: v for k, v in sorted(totals.items()) if v}
+
+    funnel, discarded = by("active", "stage"), by("discarded", "stage")
+    logs, errors, time_ms, timed = (by(m, "agent_id") for m in ("logs", "errors", "time_ms", "timed"))
+    active_total, discarded_total = sum(funnel.values()), sum(discarded.values())
+    gem3_logs = sum(n for agent, n in logs.items() if agent.upper() == "GEM3")
+    return {
+        "funnel_counts": funnel,
+        "discarded": discarded,
+        "discard_rate": discarded_total / (active_total + discarded_total) if active_total + discarded_total else None,
+        "acceptance_rate": funnel.get("COMPLETED", 0) / gem3_logs if gem3_logs else None,
+        "results_per_query": logs,
+        "errors": errors,
+        "avg_processing_time": {agent: time_ms.get(agent, 0) / n for agent, n in timed.items()},
+    }
+
+
+def to_postgres(sql: str) -> str:
+    """Rewrites `?` placeholders as PostgreSQL's numbered `$1, $2, ...`."""
+    counter = iter(range(1, 10_000))
+    return re.sub(r"\?", lambda _: f"${next(counter)}", sql)
+
+
+def load_schema(dialect: str, schema_path: str = SCHEMA_PATH) -> str:
+    """
+    Reads infra/db/schema.sql (written for SQLite) and translates it to `dialect`.
+    The schema only uses portable DDL plus AUTOINCREMENT keys and 0/1 boolean defaults.
+    """
+    with open(schema_path, "r") as f:
+        sql = f.read()
+    if dialect == "postgresql":
+        sql = re.sub(r"INTEGER PRIMARY KEY AUTOINCREMENT", "BIGSERIAL PRIMARY KEY", sql)
+        sql = re.sub(r"BOOLEAN DEFAULT 0\b", "BOOLEAN DEFAULT FALSE", sql)
+        sql = re.sub(r"BOOLEAN DEFAULT 1\b", "BOOLEAN DEFAULT TRUE", sql)
+    return sql
+
+
+def schema_version(schema_path: str = SCHEMA_PATH) -> str:
+    with open(schema_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def _check_table(table: str) -> str:
+    if table not in TABLES:
+        raise ValueError(f"Unknown table: {table}")
+    return table
+
+
+class Storage(abc.ABC):
+    """
+    Backend used by the DB API endpoints. Implementations: SQLiteStorage and
+    PostgresStorage; pick one with create_storage().
+
+    Batch writes run in a single transaction and return per-row errors as
+    `[{"index": i, "error": "..."}]` (empty when every row was written).
+
+    Every write also applies its funnel_rollup deltas in the same transaction, so
+    the rollups never drift from the base tables. `now` dates those deltas.
+    """
+
+    dialect = ""
+
+    async def open(self):
+        """Opens connections/pools. Must be called from the serving event loop."""
+
+    @abc.abstractmethod
+    async def close(self):
+        """Closes every connection."""
+
+    @abc.abstractmethod
+    async def init_schema(self, schema_path: str = SCHEMA_PATH) -> bool:
+        """Applies schema.sql unless this version was already applied. Returns True if applied."""
+
+    @abc.abstractmethod
+    async def upsert_entity(self, data: Dict[str, Any], now: datetime):
+        ...
+
+    @abc.abstractmethod
+    async def upsert_entities(self, rows: List[Dict[str, Any]], indexes: List[int], now: datetime) -> List[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    async def discard_entity(self, data: Dict[str, Any], now: datetime):
+        ...
+
+    @abc.abstractmethod
+    async def query_entities(self, query: EntityQuery) -> List[Dict[str, Any]]:
+        """One page of entities (see EntityQuery), oldest update first."""
+
+    @abc.abstractmethod
+    async def get_entity(self, entity_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    async def insert_log(self, data: Dict[str, Any], now: datetime):
+        ...
+
+    @abc.abstractmethod
+    async def insert_logs(self, rows: List[Dict[str, Any]], now: datetime) -> List[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    async def funnel(self, search_id: Optional[str] = None, day_from: Optional[str] = None,
+                     day_to: Optional[str] = None) -> Dict[str, Any]:
+        """Funnel metrics (see funnel_summary) read from funnel_rollup only."""
+
+    @abc.abstractmethod
+    async def count(self, table: str) -> int:
+        ...
+
+
+class SQLiteStorage(Storage):
+    """
+    SQLite backend.
+
+    Queries run on a small dedicated thread pool, never on the event loop. Each
+    worker thread opens one connection and reuses it for its lifetime. Connections
+    use WAL journaling so readers don't block the writer (and vice versa), with
+    `synchronous=NORMAL` (safe under WAL) and a busy timeout instead of immediate
+    "database is locked" errors.
+    """
+
+    dialect = "sqlite"
+
+    def __init__(
+        self,
+        path: str,
+        workers: Optional[int] = None,
+        busy_timeout_ms: Optional[int] = None,
+        synchronous: Optional[str] = None,
+        journal_mode: str = "WAL",
+    ):
+        self.path = path
+        self.workers = workers or int(os.getenv("DB_POOL_SIZE", "4"))
+        self.busy_timeout_ms = busy_timeout_ms or int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+        self.synchronous = (synchronous or os.getenv("DB_SYNCHRONOUS", "NORMAL")).upper()
+        self.journal_mode = journal_mode.upper()
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def connect(self) -> sqlite3.Connection:
+        """The calling thread's connection (opened and configured on first use)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _call(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        conn = self.connect()
+        try:
+            return fn(conn)
+        except BaseException:
+            # Never leave a reused connection inside a failed transaction
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+    async def run(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        """Runs `fn(conn)` on a worker thread and awaits its result."""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sqlite")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._call, fn)
+
+    async def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+    async def init_schema(self, schema_path: str = SCHEMA_PATH) -> bool:
+        schema = load_schema(self.dialect, schema_path)
+        version = schema_version(schema_path)
+
+        def migrate(conn):
+            conn.execute(MIGRATIONS_SQL)
+            conn.commit()
+            if conn.execute("SELECT 1 FROM schema_migrations WHERE version = ?", (version,)).fetchone():
+                return False
+            conn.executescript(schema)
+            if conn.execute("SELECT COUNT(*) FROM funnel_rollup").fetchone()[0] == 0:
+                for sql in rollup_rebuild_sql(self.dialect):
+                    conn.execute(sql)
+            conn.execute("INSERT INTO schema_migrations (version) VALUES (?)", (version,))
+            conn.commit()
+            return True
+
+        return await self.run(migrate)
+
+    @staticmethod
+    def _params(params: tuple) -> tuple:
+        # Timestamps are stored as ISO-8601 text, as before
+        return tuple(p.isoformat() if isinstance(p, (datetime, date)) else p for p in params)
+
+    @staticmethod
+    def _entity_states(conn: sqlite3.Connection, entity_ids: Sequence[str]) -> Dict[str, tuple]:
+        """Current rollup key of each existing entity in `entity_ids`."""
+        states = {}
+        ids = list(dict.fromkeys(entity_ids))
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = conn.execute(
+                "SELECT entity_id, current_stage, agent_responsible, metadata FROM entity_state "
+                f"WHERE entity_id IN ({', '.join('?' * len(chunk))})", chunk
+            )
+            for row in rows:
+                states[row["entity_id"]] = entity_snapshot(dict(row))
+        return states
+
+    @staticmethod
+    def _write_batch(conn: sqlite3.Connection, sql: str, rows: List[tuple], indexes: List[int],
+                     plan: Callable[[Dict[str, tuple], int], Tuple[list, Dict[str, tuple]]],
+                     load: Callable[[sqlite3.Connection], Dict[str, tuple]] = lambda conn: {}) -> List[Dict[str, Any]]:
+        """
+        Writes all rows in one transaction with executemany. If the batch fails, it is
+        replayed row by row under savepoints so only the offending rows are reported.
+
+        `plan(known, i)` returns row i's rollup deltas plus its updates to `known`, the
+        entity states loaded by `load` once the write lock is held (BEGIN IMMEDIATE).
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            known, deltas = load(conn), []
+            for i in range(len(rows)):
+                row_deltas, updates = plan(known, i)
+                deltas += row_deltas
+                known.update(updates)
+            conn.executemany(sql, rows)
+            conn.executemany(ROLLUP_SQL, rollup_params(deltas))
+            conn.commit()
+            return []
+        except sqlite3.Error:
+            conn.rollback()
+
+        errors = []
+        # Explicit BEGIN so releasing a savepoint does not commit each row on its own
+        conn.execute("BEGIN IMMEDIATE")
+        known, deltas = load(conn), []
+        for i, (index, row) in enumerate(zip(indexes, rows)):
+            conn.execute("SAVEPOINT batch_row")
+            try:
+                conn.execute(sql, row)
+                conn.execute("RELEASE SAVEPOINT batch_row")
+            except sqlite3.Error as e:
+                conn.execute("ROLLBACK TO SAVEPOINT batch_row")
+                conn.execute("RELEASE SAVEPOINT batch_row")
+                errors.append({"index": index, "error": str(e)})
+                continue
+            row_deltas, updates = plan(known, i)
+            deltas += row_deltas
+            known.update(updates)
+        conn.executemany(ROLLUP_SQL, rollup_params(deltas))
+        conn.commit()
+        return errors
+
+    async def _execute(self, statements: Sequence[Tuple[str, tuple]],
+                       plan: Callable[[sqlite3.Connection], list] = lambda conn: []):
+        """Runs the statements and the rollup deltas from `plan` (read first) in one transaction."""
+        def write(conn):
+            conn.execute("BEGIN IMMEDIATE")
+            deltas = plan(conn)
+            for sql, params in statements:
+                conn.execute(sql, self._params(params))
+            conn.executemany(ROLLUP_SQL, rollup_params(deltas))
+            conn.commit()
+        await self.run(write)
+
+    async def upsert_entity(self, data: Dict[str, Any], now: datetime):
+        day = now.date().isoformat()
+        await self._execute(
+            [(UPSERT_ENTITY_SQL, entity_params(data, now))],
+            lambda conn: entity_deltas(self._entity_states(conn, [data["entity_id"]]).get(data["entity_id"]), data, day),
+        )
+
+    async def upsert_entities(self, rows, indexes, now):
+        params = [self._params(entity_params(row, now)) for row in rows]
+        day = now.date().isoformat()
+
+        def plan(known, i):
+            row = rows[i]
+            return entity_deltas(known.get(row["entity_id"]), row, day), {row["entity_id"]: entity_snapshot(row)}
+
+        load = lambda conn: self._entity_states(conn, [row["entity_id"] for row in rows])
+        return await self.run(lambda conn: self._write_batch(conn, UPSERT_ENTITY_SQL, params, indexes, plan, load))
+
+    async def discard_entity(self, data: Dict[str, Any], now: datetime):
+        day = now.date().isoformat()
+        # Move to discarded table and remove from active state
+        await self._execute(
+            [
+                (INSERT_DISCARD_SQL, discard_params(data)),
+                (DELETE_ENTITY_SQL, (data["entity_id"],)),
+            ],
+            lambda conn: discard_deltas(self._entity_states(conn, [data["entity_id"]]).get(data["entity_id"]), data, day),
+        )
+
+    async def query_entities(self, query: EntityQuery) -> List[Dict[str, Any]]:
+        sql, params = build_entity_query(query)
+        return await self.run(lambda conn: [dict(row) for row in conn.execute(sql, params)])
+
+    async def get_entity(self, entity_id: str) -> Optional[Dict[str, Any]]:
+        row = await self.run(
+            lambda conn: conn.execute("SELECT * FROM entity_state WHERE entity_id = ?", (entity_id,)).fetchone()
+        )
+        return dict(row) if row is not None else None
+
+    async def insert_log(self, data: Dict[str, Any], now: datetime):
+        day = now.date().isoformat()
+        await self._execute([(INSERT_LOG_SQL, log_params(data))], lambda conn: log_deltas(data, day))
+
+    async def insert_logs(self, rows: List[Dict[str, Any]], now: datetime) -> List[Dict[str, Any]]:
+        params = [log_params(row) for row in rows]
+        day = now.date().isoformat()
+        plan = lambda known, i: (log_deltas(rows[i], day), {})
+        return await self.run(lambda conn: self._write_batch(conn, INSERT_LOG_SQL, params, list(range(len(rows))), plan))
+
+    async def funnel(self, search_id=None, day_from=None, day_to=None) -> Dict[str, Any]:
+        sql, params = build_funnel_query(search_id, day_from, day_to)
+        rows = await self.run(lambda conn: [dict(row) for row in conn.execute(sql, params)])
+        return funnel_summary(rows)
+
+    async def count(self, table: str) -> int:
+        sql = f"SELECT COUNT(*) FROM {_check_table(table)}"
+        return await self.run(lambda conn: conn.execute(sql).fetchone()[0])
+
+
+class PostgresStorage(Storage):
+    """
+    PostgreSQL backend on an asyncpg connection pool (async driver: queries never
+    block the event loop). `schema` isolates the tables in their own PostgreSQL
+    schema via search_path, which is how the test suite keeps runs apart.
+    """
+
+    dialect = "postgresql"
+
+    def __init__(self, url: str, pool_size: Optional[int] = None, schema: Optional[str] = None):
+        self.url = url
+        self.pool_size = pool_size or int(os.getenv("DB_POOL_SIZE", "4"))
+        self.schema = schema
+        self._pool = None
+
+    async def open(self):
+        if self._pool is not None:
+            return
+        import asyncpg
+
+        server_settings = {}
+        if self.schema:
+            conn = await asyncpg.connect(self.url)
+            try:
+                await conn.execute(f'CREATE SCHEMA IF NOT EXISTS "{self.schema}"')
+            finally:
+                await conn.close()
+            server_settings["search_path"] = self.schema
+        self._pool = await asyncpg.create_pool(
+            self.url, min_size=1, max_size=self.pool_size, server_settings=server_settings
+        )
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def _acquire(self):
+        if self._pool is None:
+            await self.open()
+        return self._pool.acquire()
+
+    async def init_schema(self, schema_path: str = SCHEMA_PATH) -> bool:
+        schema = load_schema(self.dialect, schema_path)
+        version = schema_version(schema_path)
+        async with await self._acquire() as conn:
+            async with conn.transaction():
+                # Serialize concurrent workers migrating the same database
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext('gem_v3_schema'))")
+                await conn.execute(MIGRATIONS_SQL)
+                if await conn.fetchval("SELECT 1 FROM schema_migrations WHERE version = $1", version):
+                    return False
+                await conn.execute(schema)
+                if await conn.fetchval("SELECT COUNT(*) FROM funnel_rollup") == 0:
+                    for sql in rollup_rebuild_sql(self.dialect):
+                        await conn.execute(sql)
+                await conn.execute("INSERT INTO schema_migrations (version) VALUES ($1)", version)
+        return True
+
+    @staticmethod
+    def _row(record) -> Dict[str, Any]:
+        # Match the SQLite API output: timestamps as ISO-8601 strings
+        return {k: (v.isoformat() if isinstance(v, (datetime, date)) else v) for k, v in record.items()}
+
+    @staticmethod
+    async def _entity_states(conn, entity_ids: Sequence[str]) -> Dict[str, tuple]:
+        """
+        Current rollup key of each existing entity in `entity_ids`. Takes a transaction
+        advisory lock per entity first (in sorted order), so concurrent writers of the
+        same entity can't both count it as new.
+        """
+        ids = sorted(set(entity_ids))
+        await conn.execute(
+            "SELECT pg_advisory_xact_lock(hashtext(e)) FROM (SELECT unnest($1::text[]) AS e ORDER BY 1) ids", ids
+        )
+        records = await conn.fetch(
+            "SELECT entity_id, current_stage, agent_responsible, metadata FROM entity_state "
+            "WHERE entity_id = ANY($1::text[])", ids
+        )
+        return {r["entity_id"]: entity_snapshot(dict(r)) for r in records}
+
+    async def _write_batch(self, sql: str, rows: List[tuple], indexes: List[int], plan, load=None) -> List[Dict[str, Any]]:
+        """Same contract as SQLiteStorage._write_batch; nested transactions are savepoints."""
+        sql, rollup_sql = to_postgres(sql), to_postgres(ROLLUP_SQL)
+        async with await self._acquire() as conn:
+            try:
+                async with conn.transaction():
+                    known, deltas = (await load(conn) if load else {}), []
+                    for i in range(len(rows)):
+                        row_deltas, updates = plan(known, i)
+                        deltas += row_deltas
+                        known.update(updates)
+                    await conn.executemany(sql, rows)
+                    await conn.executemany(rollup_sql, rollup_params(deltas))
+                return []
+            except Exception:
+                pass
+
+            errors = []
+            async with conn.transaction():
+                known, deltas = (await load(conn) if load else {}), []
+                for i, (index, row) in enumerate(zip(indexes, rows)):
+                    try:
+                        async with conn.transaction():
+                            await conn.execute(sql, *row)
+                    except Exception as e:
+                        errors.append({"index": index, "error": str(e)})
+                        continue
+                    row_deltas, updates = plan(known, i)
+                    deltas += row_deltas
+                    known.update(updates)
+                await conn.executemany(rollup_sql, rollup_params(deltas))
+            return errors
+
+    async def _execute(self, statements: Sequence[Tuple[str, tuple]], plan=None):
+        """Runs the statements and the rollup deltas from `plan` (read first) in one transaction."""
+        async with await self._acquire() as conn:
+            async with conn.transaction():
+                deltas = await plan(conn) if plan else []
+                for sql, params in statements:
+                    await conn.execute(to_postgres(sql), *params)
+                await conn.executemany(to_postgres(ROLLUP_SQL), rollup_params(deltas))
+
+    async def upsert_entity(self, data: Dict[str, Any], now: datetime):
+        day = now.date().isoformat()
+
+        async def plan(conn):
+            old = (await self._entity_states(conn, [data["entity_id"]])).get(data["entity_id"])
+            return entity_deltas(old, data, day)
+
+        await self._execute([(UPSERT_ENTITY_SQL, entity_params(data, now))], plan)
+
+    async def upsert_entities(self, rows, indexes, now):
+        day = now.date().isoformat()
+
+        def plan(known, i):
+            row = rows[i]
+            return entity_deltas(known.get(row["entity_id"]), row, day), {row["entity_id"]: entity_snapshot(row)}
+
+        return await self._write_batch(
+            UPSERT_ENTITY_SQL, [entity_params(row, now) for row in rows], indexes, plan,
+            lambda conn: self._entity_states(conn, [row["entity_id"] for row in rows]),
+        )
+
+    async def discard_entity(self, data: Dict[str, Any], now: datetime):
+        day = now.date().isoformat()
+
+        async def plan(conn):
+            old = (await self._entity_states(conn, [data["entity_id"]])).get(data["entity_id"])
+            return discard_deltas(old, data, day)
+
+        await self._execute([
+            (INSERT_DISCARD_SQL, discard_params(data)),
+            (DELETE_ENTITY_SQL, (data["entity_id"],)),
+        ], plan)
+
+    async def query_entities(self, query: EntityQuery) -> List[Dict[str, Any]]:
+        if query.after is not None:
+            # Cursors carry the ISO string the API returned; the column is a TIMESTAMP
+            query = query._replace(after=(datetime.fromisoformat(query.after[0]), query.after[1]))
+        sql, params = build_entity_query(query)
+        async with await self._acquire() as conn:
+            records = await conn.fetch(to_postgres(sql), *params)
+        return [self._row(r) for r in records]
+
+    async def get_entity(self, entity_id: str) -> Optional[Dict[str, Any]]:
+        async with await self._acquire() as conn:
+            record = await conn.fetchrow("SELECT * FROM entity_state WHERE entity_id = $1", entity_id)
+        return self._row(record) if record is not None else None
+
+    async def insert_log(self, data: Dict[str, Any], now: datetime):
+        day = now.date().isoformat()
+
+        async def plan(conn):
+            return log_deltas(data, day)
+
+        await self._execute([(INSERT_LOG_SQL, log_params(data))], plan)
+
+    async def insert_logs(self, rows: List[Dict[str, Any]], now: datetime) -> List[Dict[str, Any]]:
+        day = now.date().isoformat()
+        return await self._write_batch(
+            INSERT_LOG_SQL, [log_params(row) for row in rows], list(range(len(rows))),
+            lambda known, i: (log_deltas(rows[i], day), {}),
+        )
+
+    async def funnel(self, search_id=None, day_from=None, day_to=None) -> Dict[str, Any]:
+        sql, params = build_funnel_query(search_id, day_from, day_to)
+        async with await self._acquire() as conn:
+            records = await conn.fetch(to_postgres(sql), *params)
+        return funnel_summary([dict(r) for r in records])
+
+    async def count(self, table: str) -> int:
+        async with await self._acquire() as conn:
+            return await conn.fetchval(f"SELECT COUNT(*) FROM {_check_table(table)}")
+
+
+def create_storage(url: Optional[str] = None) -> Storage:
+    """
+    Backend for a DB URL: `postgresql://...` (or `postgres://`) selects PostgreSQL,
+    anything else is a SQLite path (`sqlite:///path` or a bare path).
+    """
+    url = url or os.getenv("DB_URL") or os.getenv("DB_PATH", "infra/db/gem_v3.sqlite")
+    if url.startswith(("postgresql://", "postgres://")):
+        return PostgresStorage(url)
+    if url.startswith("sqlite:///"):
+        url = url[len("sqlite:///"):]
+    return SQLiteStorage(url)
@@ -11,6 +11,9 @@ Uso:
 
     # Solo un candidato
     python run.py --search-id SEARCH-2026-001 --local-dir ./inputs --candidate CAND-001
+
+    # Procesar hasta 8 candidatos en paralelo
+    python run.py --search-id SEARCH-2026-001 --local-dir ./inputs --concurrency 8
 """
 
 import argparse
@@ -36,6 +39,7 @@ Ejemplos:
   python run.py --search-id SEARCH-2026-001 --local-dir runs/SEARCH-2026-001/inputs
   python run.py --search-id SEARCH-2026-001 --drive-folder 1aBcDeFgHiJkLmNoPqRsT
   python run.py --search-id SEARCH-2026-001 --local-dir ./inputs --candidate CAND-001
+  python run.py --search-id SEARCH-2026-001 --local-dir ./inputs --concurrency 8
         """,
     )
 
@@ -64,6 +68,17 @@ Ejemplos:
         default=config.DEFAULT_MODEL,
         help=f"Modelo Gemini (default: {config.DEFAULT_MODEL})",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=config.MAX_CONCURRENT_CANDIDATES,
+        help=f"Máximo de candidatos procesados en paralelo (default: {config.MAX_CONCURRENT_CANDIDATES})",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Reprocesar todos los candidatos aunque sus inputs no hayan cambiado",
+    )
     parser.add_argument(
         "--output-dir",
         help="Directorio de salida (default: runs/<search_id>/outputs)",
@@ -76,6 +91,9 @@ Ejemplos:
 
     args = parser.parse_args()
 
+    if args.concurrency < 1:
+        parser.error("--concurrency debe ser >= 1")
+
     # --- CLI Support ---
     if args.json:
         # Disable rich output for JSON mode
@@ -94,6 +112,7 @@ Ejemplos:
     # --- Load inputs ---
     search_inputs = {}
     candidates = {}
+    drive = None
 
     if args.drive_folder:
         console.print(f"📁 [cyan]Leyendo inputs desde Google Drive...[/cyan]")
@@ -132,12 +151,29 @@ Ejemplos:
 
     # --- Run GEM 6 Orchestrator ---
     gemini = GeminiClient(api_key=api_key, model=args.model)
-    orchestrator = GEM6Orchestrator(gemini=gemini, search_id=args.search_id, output_dir=output_dir)
+    orchestrator = GEM6Orchestrator(
+        gemini=gemini,
+        search_id=args.search_id,
+        output_dir=output_dir,
+        concurrency=args.concurrency,
+        force=args.force,
+        drive=drive,
+    )
 
     # El orquestador maneja los eventos y el procesamiento asíncrono
     try:
         import asyncio
-        results = asyncio.run(orchestrator.run_pipeline(search_inputs, candidates))
+
+        async def run_and_close():
+            try:
+                return await orchestrator.run_pipeline(search_inputs, candidates)
+            finally:
+                await orchestrator.aclose()
+                await gemini.aclose()
+                if drive is not None:
+                    drive.close()
+
+        results = asyncio.run(run_and_close())
     except Exception as e:
         console.print(f"[bold red]❌ Error durante la ejecución del pipeline: {e}[/bold red]")
         import traceback
@@ -0,0 +1,71 @@
+"""
+Micro-benchmark de validación de contratos: validaciones por segundo.
+
+Compara la validación anterior (abrir y parsear el contrato en cada llamada) con el
+registro compilado de utils/contracts.py, sobre los outputs mock de cada agente.
+
+Uso: python scripts/bench_contracts.py [--iterations N]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.contracts import CONTRACTS_DIR, ContractRegistry
+
+SAMPLES = {
+    "gem1": {"discovery_dataset": ["item1"], "confidence_score": 0.9, "execution_metadata": {}},
+    "gem2": {"score": 0.85},
+    "gem3": {"decision": "ACCEPT", "decision_confidence": 0.95, "reasoning_summary": "Meets all criteria"},
+    "gem4": {"qa_score": 0.98, "issues": [], "human_required": False},
+}
+
+
+def legacy_validate(data, contract_path):
+    """Validación previa de utils.gem_core: relee el archivo y corta en la primera violación."""
+    if not os.path.exists(contract_path):
+        return True
+    with open(contract_path, "r") as f:
+        contract = json.load(f)
+    for key, expected_type in contract.items():
+        if key not in data:
+            return False
+        val = data[key]
+        if expected_type == "array" and not isinstance(val, list): return False
+        if expected_type == "number" and not isinstance(val, (int, float)): return False
+        if expected_type == "string" and not isinstance(val, str): return False
+        if expected_type == "object" and not isinstance(val, dict): return False
+        if expected_type == "boolean" and not isinstance(val, bool): return False
+    return True
+
+
+def bench(validate, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for agent_id, sample in SAMPLES.items():
+            validate(agent_id, sample)
+    elapsed = time.perf_counter() - start
+    return iterations * len(SAMPLES) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de validación de contratos")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    registry = ContractRegistry()
+    registry.load()
+
+    def legacy(agent_id, sample):
+        return legacy_validate(sample, os.path.join(CONTRACTS_DIR, f"{agent_id}_output.schema.json"))
+
+    print(f"--- CONTRACT VALIDATION BENCHMARK ({len(SAMPLES)} contratos, x{args.iterations}) ---")
+    for name, validate in (("legacy_file", legacy), ("compiled", registry.validate)):
+        print(f"{name:12s} {bench(validate, args.iterations):12,.0f} validaciones/s")
+
+
+if __name__ == "__main__":
+    main()
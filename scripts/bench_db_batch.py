@@ -0,0 +1,74 @@
+"""
+Throughput del DB API: escrituras de a una fila vs. endpoints batch.
+
+Levanta infra/db/api.py en proceso (TestClient) sobre una base SQLite temporal (o la
+de --db-url) y escribe N upserts + N logs, primero con /entity/upsert y /log/discovery
+y luego con /entity/upsert_batch y /log/discovery/batch en lotes de --batch-size filas.
+
+Uso: python scripts/bench_db_batch.py [--rows N] [--batch-size B] [--db-url URL]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+from infra.db import api as db_api
+from infra.db.storage import create_storage
+
+
+def entity(i):
+    return {
+        "entity_id": f"BENCH-{i:06d}",
+        "current_stage": "GEM2",
+        "state": "PROCESSING",
+        "last_score": 0.5,
+        "metadata": {"step": i},
+        "agent_responsible": "GEM6",
+        "trace_id": f"T{i}",
+    }
+
+
+def log(i):
+    return {"entity_id": f"BENCH-{i:06d}", "agent_id": "gem2", "input_ok": True,
+            "output_ok": True, "time_ms": 10, "status": "OK", "trace_id": f"T{i}"}
+
+
+def run_single(client, rows):
+    for i in range(rows):
+        client.post("/entity/upsert", json=entity(i)).raise_for_status()
+        client.post("/log/discovery", json=log(i)).raise_for_status()
+
+
+def run_batch(client, rows, batch_size):
+    for start in range(0, rows, batch_size):
+        ids = range(start, min(start + batch_size, rows))
+        client.post("/entity/upsert_batch", json=[entity(i) for i in ids]).raise_for_status()
+        client.post("/log/discovery/batch", json=[log(i) for i in ids]).raise_for_status()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark single vs. batch del DB API")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--db-url", help="postgresql://... para medir PostgreSQL (por defecto SQLite temporal)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"--- DB API WRITE THROUGHPUT ({args.rows} upserts + {args.rows} logs) ---")
+        for name, run in (("single", lambda c: run_single(c, args.rows)),
+                          (f"batch x{args.batch_size}", lambda c: run_batch(c, args.rows, args.batch_size))):
+            db_api.storage = create_storage(args.db_url or os.path.join(tmp, f"{name.split()[0]}.sqlite"))
+            with TestClient(db_api.app) as client:
+                start = time.perf_counter()
+                run(client)
+                elapsed = time.perf_counter() - start
+            print(f"{name:12s} {2 * args.rows / elapsed:10,.0f} filas/s  ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark del storage SQLite del DB API: escrituras/s sostenidas con lectores
+concurrentes golpeando /entities.
+
+Corre infra/db/api.py en proceso (httpx.ASGITransport) sobre una base temporal con
+--writers tareas haciendo /entity/upsert y --readers tareas haciendo GET /entities
+durante --seconds segundos. Compara journal WAL contra el journal por defecto (DELETE).
+
+Uso: python scripts/bench_db_storage.py [--seconds S] [--writers W] [--readers R]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from infra.db import api as db_api
+from infra.db.storage import SQLiteStorage
+
+
+async def writer(client, worker, deadline, counts):
+    i = 0
+    while time.perf_counter() < deadline:
+        resp = await client.post("/entity/upsert", json={
+            "entity_id": f"BENCH-{worker}-{i % 25}",
+            "current_stage": "GEM2",
+            "state": "PROCESSING",
+            "last_score": 0.5,
+            "agent_responsible": "GEM6",
+            "trace_id": f"T{i}",
+        })
+        counts["writes" if resp.status_code == 200 else "errors"] += 1
+        i += 1
+
+
+async def reader(client, deadline, counts):
+    while time.perf_counter() < deadline:
+        resp = await client.get("/entities")
+        counts["reads" if resp.status_code == 200 else "errors"] += 1
+
+
+async def run(journal_mode, path, args):
+    db_api.storage = SQLiteStorage(path, journal_mode=journal_mode)
+    await db_api.startup_event()
+    counts = {"writes": 0, "reads": 0, "errors": 0}
+    transport = httpx.ASGITransport(app=db_api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://db-api") as client:
+        deadline = time.perf_counter() + args.seconds
+        await asyncio.gather(
+            *(writer(client, w, deadline, counts) for w in range(args.writers)),
+            *(reader(client, deadline, counts) for _ in range(args.readers)),
+        )
+    await db_api.shutdown_event()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de escrituras con lectores concurrentes")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"--- DB STORAGE BENCHMARK ({args.writers} writers, {args.readers} readers, {args.seconds:.0f}s) ---")
+    with tempfile.TemporaryDirectory() as tmp:
+        for journal_mode in ("DELETE", "WAL"):
+            counts = asyncio.run(run(journal_mode, os.path.join(tmp, f"{journal_mode}.sqlite"), args))
+            print(f"{journal_mode:7s} {counts['writes'] / args.seconds:9,.0f} writes/s  "
+                  f"{counts['reads'] / args.seconds:9,.0f} reads/s  errors={counts['errors']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Micro-benchmark del parseo de respuestas: regex anterior vs. extract_json.
+
+Recorre las salidas crudas guardadas en runs/*/outputs/ (*.raw.txt) y mide, para
+cada estrategia, el tiempo por archivo y cuántas respuestas terminan en un objeto.
+
+Uso: python scripts/bench_json_extract.py [--repeat N] [--runs-dir runs]
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.json_extract import extract_json
+
+
+def legacy_parse(raw_text):
+    """Parseo previo de GeminiClient._parse_response (regex greedy + hasta 3 json.loads)."""
+    json_match = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", raw_text, re.DOTALL)
+    if not json_match:
+        json_match = re.search(r"(\{.*\})", raw_text, re.DOTALL)
+    if json_match:
+        json_str = re.sub(r",\s*([\]}])", r"\1", json_match.group(1).strip())
+        try:
+            return json.loads(json_str)
+        except json.JSONDecodeError:
+            try:
+                return json.loads(raw_text.strip())
+            except json.JSONDecodeError:
+                return None
+    try:
+        return json.loads(raw_text.strip())
+    except json.JSONDecodeError:
+        return None
+
+
+def new_parse(raw_text):
+    return extract_json(raw_text).value
+
+
+def find_raw_outputs(runs_dir):
+    patterns = [os.path.join(runs_dir, "*", "outputs", "*.raw.txt"),
+                os.path.join(runs_dir, "*", "outputs", "*", "*.raw.txt")]
+    return sorted(path for pattern in patterns for path in glob.glob(pattern))
+
+
+def bench(parse, texts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            parse(text)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de extracción de JSON sobre salidas crudas")
+    parser.add_argument("--runs-dir", default="runs")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    paths = find_raw_outputs(args.runs_dir)
+    if not paths:
+        print(f"No se encontraron *.raw.txt en {args.runs_dir}/*/outputs/")
+        return
+    texts = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            texts.append(f.read())
+    total_bytes = sum(len(t.encode("utf-8")) for t in texts)
+
+    print(f"--- JSON EXTRACT BENCHMARK ({len(texts)} archivos, {total_bytes / 1024:.0f} KiB, x{args.repeat}) ---")
+    for name, parse in (("legacy_regex", legacy_parse), ("extract_json", new_parse)):
+        elapsed = bench(parse, texts, args.repeat)
+        parsed = sum(isinstance(parse(t), dict) for t in texts)
+        per_file_us = elapsed / (len(texts) * args.repeat) * 1e6
+        mb_s = total_bytes * args.repeat / elapsed / 1e6
+        print(f"{name:14s} parsed={parsed}/{len(texts)}  {per_file_us:9.1f} us/archivo  {mb_s:7.1f} MB/s")
+
+    print("\nReparaciones aplicadas:")
+    for path, text in zip(paths, texts):
+        result = extract_json(text)
+        if result.repairs or result.value is None:
+            status = ", ".join(result.repairs) if result.value is not None else f"ERROR: {result.error}"
+            print(f"  {os.path.relpath(path, args.runs_dir)}: {status}")
+
+
+if __name__ == "__main__":
+    main()
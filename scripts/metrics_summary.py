@@ -1,49 +1,42 @@
-import sqlite3
+import argparse
+import asyncio
 import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from infra.db.storage import create_storage
 
 DB_PATH = os.getenv("DB_PATH", "infra/db/gem_v3.sqlite")
 
-QUERIES = {
-    "results_per_query": """
-        SELECT agent_id, COUNT(*) as count 
-        FROM discovery_logs 
-        GROUP BY agent_id
-    """,
-    "discard_rate": """
-        SELECT 
-            (SELECT COUNT(*) FROM discarded_entities) * 1.0 / 
-            ((SELECT COUNT(*) FROM entity_state) + (SELECT COUNT(*) FROM discarded_entities)) as rate
-    """,
-    "acceptance_rate": """
-        SELECT 
-            COUNT(*) * 1.0 / (SELECT COUNT(*) FROM discovery_logs WHERE agent_id = 'GEM3')
-        FROM entity_state 
-        WHERE current_stage = 'COMPLETED'
-    """,
-    "avg_processing_time": """
-        SELECT agent_id, AVG(execution_time_ms) as avg_time 
-        FROM discovery_logs 
-        GROUP BY agent_id
-    """,
-    "funnel_counts": """
-        SELECT current_stage, COUNT(*) as count 
-        FROM entity_state 
-        GROUP BY current_stage
-    """
-}
+# Read from the funnel_rollup aggregates the DB API maintains on every write
+# (same data as GET /metrics/funnel), not by scanning discovery_logs/entity_state
+async def load_metrics(search_id=None, day_from=None, day_to=None):
+    storage = create_storage(os.getenv("DB_URL") or DB_PATH)
+    await storage.open()
+    try:
+        # Creates (and backfills) funnel_rollup on databases from before it existed
+        await storage.init_schema()
+        return await storage.funnel(search_id, day_from, day_to)
+    finally:
+        await storage.close()
+
+def print_metrics(search_id=None, day_from=None, day_to=None):
+    metrics = asyncio.run(load_metrics(search_id, day_from, day_to))
 
-def print_metrics():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     print("--- GEM v3.0 FUNNEL METRICS ---")
-    for name, query in QUERIES.items():
+    for name, value in metrics.items():
         print(f"\nMetric: {name}")
-        cursor.execute(query)
-        results = cursor.fetchall()
-        for row in results:
-            print(row)
-    conn.close()
+        if isinstance(value, dict):
+            for row in value.items():
+                print(row)
+        else:
+            print(value)
 
 if __name__ == "__main__":
-    print_metrics()
+    parser = argparse.ArgumentParser(description="GEM v3.0 funnel metrics")
+    parser.add_argument("--search-id")
+    parser.add_argument("--day-from", help="YYYY-MM-DD")
+    parser.add_argument("--day-to", help="YYYY-MM-DD")
+    args = parser.parse_args()
+    print_metrics(args.search_id, args.day_from, args.day_to)
@@ -1,59 +1,184 @@
+import argparse
+import json
 import os
 import sqlite3
-import pandas as pd
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
+from typing import Any, Dict, List, Optional
 
 # Config
 DB_PATH = os.getenv("DB_PATH", "infra/db/gem_v3.sqlite")
 SPREADSHEET_ID = os.getenv("SPREADSHEET_ID")
 SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_SERVICE_ACCOUNT_FILE", "config/service_account.json")
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+SHEET_NAME = os.getenv("SHEETS_SHEET_NAME", "Dashboard")
+# Watermarks and row positions of the last sync (incremental mode)
+STATE_PATH = os.getenv("SHEETS_SYNC_STATE", "infra/db/sheets_sync_state.json")
+# Max ranges per values.batchUpdate request
+BATCH_RANGES = int(os.getenv("SHEETS_BATCH_RANGES", "500"))
 
-def get_db_data():
-    conn = sqlite3.connect(DB_PATH)
-    query = """
-    SELECT 
-        entity_id, current_stage, state, last_score, 
-        human_required, updated_at, agent_responsible 
+COLUMNS = [
+    "entity_id", "current_stage", "state", "last_score",
+    "human_required", "updated_at", "agent_responsible",
+]
+
+# One row per entity: active entities come from entity_state; discarded ones
+# (deleted from entity_state) show their latest discard. Each table keeps its own
+# watermark because their timestamps are written in different formats.
+ACTIVE_SQL = """
+    SELECT
+        entity_id, current_stage, state, last_score,
+        human_required, updated_at, agent_responsible
     FROM entity_state
-    UNION ALL
-    SELECT 
-        entity_id, stage_at_discard as current_stage, 'DISCARDED' as state, 
-        score_at_discard as last_score, 0 as human_required, 
+    WHERE updated_at >= ?
+    ORDER BY updated_at, id
+"""
+
+DISCARDED_SQL = """
+    SELECT
+        entity_id, stage_at_discard as current_stage, 'DISCARDED' as state,
+        score_at_discard as last_score, 0 as human_required,
         created_at as updated_at, agent_responsible
     FROM discarded_entities
+    WHERE created_at >= ?
+      AND entity_id NOT IN (SELECT entity_id FROM entity_state)
+    ORDER BY created_at, id
+"""
+
+
+def get_db_data(conn: sqlite3.Connection, watermarks: Optional[Dict[str, str]] = None):
+    """
+    Rows changed since `watermarks` (all rows when None) keyed by entity_id, plus the
+    new watermarks. `>=` re-reads rows stamped exactly at the watermark, which is
+    harmless (the same values are written again) and never skips a row.
     """
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
+    watermarks = dict(watermarks or {})
+    rows: Dict[str, List[Any]] = {}
+    for table, sql in (("entity_state", ACTIVE_SQL), ("discarded_entities", DISCARDED_SQL)):
+        for row in conn.execute(sql, (watermarks.get(table, ""),)):
+            rows[row[0]] = ["" if v is None else v for v in row]
+            watermarks[table] = row[5]
+    return rows, watermarks
 
-def sync_to_sheets():
-    if not SPREADSHEET_ID or not os.path.exists(SERVICE_ACCOUNT_FILE):
-        print("Missing Sheets config. Skipping sync.")
-        return
 
-    creds = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    service = build('sheets', 'v4', credentials=creds)
+def load_state(path: str = STATE_PATH) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
-    df = get_db_data()
-    values = [df.columns.tolist()] + df.values.tolist()
 
-    body = {
-        'values': values
-    }
-    
-    # Clear and update (Production mode: Overwrite whole sheet as dashboard)
-    range_name = 'Dashboard!A1'
+def save_state(state: Dict[str, Any], path: str = STATE_PATH):
+    # Write-then-rename so an interrupted run never leaves a truncated state file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def row_ranges(sheet: str, updates: Dict[int, List[Any]]) -> List[Dict[str, Any]]:
+    """batchUpdate `data` for {row_number: values}, merging consecutive rows into one range."""
+    data = []
+    for number in sorted(updates):
+        if data and data[-1]["_next"] == number:
+            data[-1]["values"].append(updates[number])
+            data[-1]["_next"] += 1
+        else:
+            data.append({"range": f"{sheet}!A{number}", "values": [updates[number]], "_next": number + 1})
+    for item in data:
+        del item["_next"]
+    return data
+
+
+def full_sync(service, conn: sqlite3.Connection, spreadsheet_id: str, sheet: str = SHEET_NAME) -> Dict[str, Any]:
+    """Clears the sheet and rewrites every row. Returns the state for later incremental runs."""
+    rows, watermarks = get_db_data(conn)
+    values = [COLUMNS] + list(rows.values())
+
     service.spreadsheets().values().clear(
-        spreadsheetId=SPREADSHEET_ID, range='Dashboard!A:Z').execute()
-    
+        spreadsheetId=spreadsheet_id, range=f'{sheet}!A:Z').execute()
     result = service.spreadsheets().values().update(
-        spreadsheetId=SPREADSHEET_ID, range=range_name,
-        valueInputOption='RAW', body=body).execute()
-    
-    print(f"{result.get('updatedCells')} cells updated in Google Sheets.")
+        spreadsheetId=spreadsheet_id, range=f'{sheet}!A1',
+        valueInputOption='RAW', body={'values': values}).execute()
+
+    print(f"{result.get('updatedCells')} cells updated in Google Sheets (full rewrite).")
+    return {
+        "spreadsheet_id": spreadsheet_id,
+        "sheet": sheet,
+        "columns": COLUMNS,
+        "watermarks": watermarks,
+        # Row 1 is the header
+        "rows": {entity_id: i + 2 for i, entity_id in enumerate(rows)},
+    }
+
+
+def incremental_sync(service, conn: sqlite3.Connection, state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Sends only the rows changed since the last sync: existing entities are updated in
+    place (row index per entity_id), new ones appended below the last row.
+    """
+    rows, watermarks = get_db_data(conn, state["watermarks"])
+    positions = dict(state["rows"])
+    next_row = max(positions.values(), default=1) + 1
+    updates = {}
+    for entity_id, values in rows.items():
+        if entity_id not in positions:
+            positions[entity_id] = next_row
+            next_row += 1
+        updates[positions[entity_id]] = values
+
+    data = row_ranges(state["sheet"], updates)
+    cells = 0
+    for start in range(0, len(data), BATCH_RANGES):
+        result = service.spreadsheets().values().batchUpdate(
+            spreadsheetId=state["spreadsheet_id"],
+            body={'valueInputOption': 'RAW', 'data': data[start:start + BATCH_RANGES]}).execute()
+        cells += result.get('totalUpdatedCells', 0)
+
+    print(f"{cells} cells updated in Google Sheets ({len(updates)} changed rows).")
+    return {**state, "watermarks": watermarks, "rows": positions}
+
+
+def sync(service, conn: sqlite3.Connection, spreadsheet_id: str, sheet: str = SHEET_NAME,
+         state_path: str = STATE_PATH, full: bool = False) -> Dict[str, Any]:
+    """
+    Incremental sync, falling back to a full rewrite when there is no previous state
+    or the layout changed (other spreadsheet, sheet or columns), or when `full`.
+    """
+    state = load_state(state_path)
+    layout_changed = state is None or (
+        state.get("spreadsheet_id"), state.get("sheet"), state.get("columns")
+    ) != (spreadsheet_id, sheet, COLUMNS)
+    if full or layout_changed:
+        state = full_sync(service, conn, spreadsheet_id, sheet)
+    else:
+        state = incremental_sync(service, conn, state)
+    save_state(state, state_path)
+    return state
+
+
+def get_service():
+    from googleapiclient.discovery import build
+    from google.oauth2 import service_account
+
+    creds = service_account.Credentials.from_service_account_file(
+        SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+    return build('sheets', 'v4', credentials=creds)
+
+
+def sync_to_sheets(full: bool = False):
+    if not SPREADSHEET_ID or not os.path.exists(SERVICE_ACCOUNT_FILE):
+        print("Missing Sheets config. Skipping sync.")
+        return
+
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        sync(get_service(), conn, SPREADSHEET_ID, full=full)
+    finally:
+        conn.close()
+
 
 if __name__ == "__main__":
-    sync_to_sheets()
+    parser = argparse.ArgumentParser(description="Sync entity_state to the Google Sheets dashboard")
+    parser.add_argument("--full", action="store_true", help="Clear the sheet and rewrite every row")
+    args = parser.parse_args()
+    sync_to_sheets(full=args.full)
@@ -0,0 +1,74 @@
+import asyncio
+from collections import OrderedDict
+import os
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+from infra.db.storage import PostgresStorage, SQLiteStorage
+
+
+@pytest.fixture(scope="session")
+def postgres_url(tmp_path_factory):
+    """
+    PostgreSQL server for the storage tests: TEST_POSTGRES_URL when set, otherwise a
+    throwaway local server launched with `pgserver` if installed. Skips if neither.
+    """
+    pytest.importorskip("asyncpg")
+    url = os.getenv("TEST_POSTGRES_URL")
+    if url:
+        yield url
+        return
+    pgserver = pytest.importorskip("pgserver")
+    server = pgserver.get_server(str(tmp_path_factory.mktemp("pgdata")), cleanup_mode="stop")
+    yield server.get_uri()
+    server.cleanup()
+
+
+async def _drop_schema(url, schema):
+    import asyncpg
+
+    conn = await asyncpg.connect(url)
+    try:
+        await conn.execute(f'DROP SCHEMA IF EXISTS "{schema}" CASCADE')
+    finally:
+        await conn.close()
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def storage(request, tmp_path):
+    """Every DB test runs once per backend, each on an empty database."""
+    if request.param == "sqlite":
+        yield SQLiteStorage(str(tmp_path / "gem_v3.sqlite"))
+        return
+    url = request.getfixturevalue("postgres_url")
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    yield PostgresStorage(url, schema=schema)
+    asyncio.run(_drop_schema(url, schema))
+
+
+@pytest.fixture
+def db_client(storage, monkeypatch):
+    """DB API client on `storage`; startup/shutdown open, migrate and close it."""
+    from infra.db import api as db_api
+
+    monkeypatch.setattr(db_api, "storage", storage)
+    with TestClient(db_api.app) as client:
+        yield client
+
+
+@pytest.fixture(autouse=True)
+def pipeline_state_dir(tmp_path, monkeypatch):
+    """Keeps broadcast_log's pipeline_state.json files out of the working tree."""
+    from utils import ws_logger
+
+    state_dir = tmp_path / "pipeline_state"
+    monkeypatch.setattr(ws_logger.pipeline_state, "state_dir", str(state_dir))
+    monkeypatch.setattr(ws_logger.pipeline_state, "_steps", {})
+    monkeypatch.setattr(ws_logger.pipeline_state, "_seq", {})
+    monkeypatch.setattr(ws_logger.pipeline_state, "_last_used", OrderedDict())
+    monkeypatch.setattr(ws_logger.pipeline_state, "_dirty", set())
+    monkeypatch.setattr(ws_logger.pipeline_state, "_unsaved", {})
+    monkeypatch.setattr(ws_logger, "DEFAULT_STATE_FILE", str(state_dir / "pipeline_state.json"))
+    return state_dir
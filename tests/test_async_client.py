@@ -0,0 +1,128 @@
+import asyncio
+import json
+import threading
+
+import httpx
+
+from agent.gemini_client import GeminiClient
+
+
+def make_ollama_client(monkeypatch, handler):
+    """GeminiClient in Ollama mode whose HTTP calls are served by `handler`."""
+    real_async_client = httpx.AsyncClient
+    created = []
+
+    def fake_async_client(*args, **kwargs):
+        kwargs["transport"] = httpx.MockTransport(handler)
+        created.append(kwargs)
+        return real_async_client(*args, **kwargs)
+
+    monkeypatch.setattr(httpx, "AsyncClient", fake_async_client)
+    client = GeminiClient(api_key="dummy", use_cache=False)
+    client.provider = "ollama"
+    client.created_http_clients = created
+    return client
+
+
+async def test_arun_gem_does_not_block_event_loop(monkeypatch):
+    async def handler(request):
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={
+            "response": '{"action": "finalize"}',
+            "prompt_eval_count": 10,
+            "eval_count": 5,
+        })
+
+    client = make_ollama_client(monkeypatch, handler)
+    ticks = 0
+
+    async def heartbeat():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.005)
+
+    beat = asyncio.create_task(heartbeat())
+    result = await client.arun_gem("prompt", gem_name="gem6")
+    beat.cancel()
+
+    assert result["json"] == {"action": "finalize"}
+    assert result["usage"]["total_tokens"] == 15
+    assert ticks > 3
+
+
+async def test_arun_gem_sends_gem_config(monkeypatch):
+    seen = {}
+
+    async def handler(request):
+        seen.update(json.loads(request.content))
+        return httpx.Response(200, json={"response": "{}"})
+
+    client = make_ollama_client(monkeypatch, handler)
+    await client.arun_gem("hola", gem_name="gem4", max_retries=0)
+
+    assert seen["prompt"] == "hola"
+    assert seen["options"]["temperature"] == 0.1
+    assert seen["options"]["num_predict"] == 4000
+
+
+async def test_ollama_transport_is_pooled(monkeypatch):
+    async def handler(request):
+        return httpx.Response(200, json={"response": "{}"})
+
+    client = make_ollama_client(monkeypatch, handler)
+    async with client:
+        for _ in range(5):
+            await client.arun_gem("prompt", max_retries=0)
+
+    assert len(client.created_http_clients) == 1
+    options = client.created_http_clients[0]
+    assert options["limits"] is client.http_limits
+    assert options["timeout"].connect < options["timeout"].read
+    assert client._ahttp is None
+
+
+def test_async_pool_of_a_live_loop_is_closed_on_that_loop(monkeypatch):
+    async def handler(request):
+        return httpx.Response(200, json={"response": "{}"})
+
+    client = make_ollama_client(monkeypatch, handler)
+    other = asyncio.new_event_loop()
+    thread = threading.Thread(target=other.run_forever)
+    thread.start()
+
+    async def open_pool():
+        return client._async_http_client()
+
+    async def switch_loop():
+        return client._async_http_client()
+
+    try:
+        old = asyncio.run_coroutine_threadsafe(open_pool(), other).result()
+        new = asyncio.run(switch_loop())
+        # aclose() is scheduled on the loop that owns the connections
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0.01), other).result()
+        assert new is not old
+        assert old.is_closed
+    finally:
+        other.call_soon_threadsafe(other.stop)
+        thread.join()
+        other.close()
+
+
+def test_async_pool_of_a_finished_loop_is_dropped(monkeypatch, capsys):
+    async def handler(request):
+        return httpx.Response(200, json={"response": "{}"})
+
+    client = make_ollama_client(monkeypatch, handler)
+
+    async def call():
+        await client.arun_gem("prompt", max_retries=0)
+        return client._ahttp
+
+    first = asyncio.run(call())
+    second = asyncio.run(call())
+
+    assert second is not first
+    assert len(client.created_http_clients) == 2
+    assert "descartado sin aclose()" in capsys.readouterr().out
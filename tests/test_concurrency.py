@@ -0,0 +1,54 @@
+import asyncio
+import json
+
+from agent.gem6.orchestrator import GEM6Orchestrator
+
+
+class TrackingOrchestrator(GEM6Orchestrator):
+    """Replaces the reasoning loop with a timed stub that records parallelism."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def process_context(self, context_data):
+        entity_id = context_data["entity_id"]
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            # Later candidates finish first to check result ordering
+            await asyncio.sleep(0.01 * (10 - int(entity_id.split("-")[1])))
+            if entity_id == "CAND-3":
+                raise RuntimeError("boom")
+            return {"status": "SUCCESS", "entity_id": entity_id}
+        finally:
+            self.in_flight -= 1
+
+
+async def test_run_pipeline_bounded_concurrency(tmp_path):
+    candidates = {f"CAND-{i}": {"cv_text": f"cv {i}"} for i in range(8)}
+    orch = TrackingOrchestrator(search_id="TEST-CONC", output_dir=str(tmp_path), concurrency=3)
+
+    results = await orch.run_pipeline({"jd_text": "jd"}, candidates)
+
+    assert orch.max_in_flight == 3
+    assert list(results.keys()) == list(candidates.keys())
+    assert results["CAND-3"]["status"] == "FAILED"
+    assert results["CAND-3"]["error"] == "boom"
+    assert all(results[c]["status"] == "SUCCESS" for c in candidates if c != "CAND-3")
+
+    with open(tmp_path / "pipeline_summary.json") as f:
+        summary = json.load(f)
+    assert list(summary["candidates"].keys()) == list(candidates.keys())
+    assert summary["concurrency"] == 3
+
+
+async def test_run_pipeline_defaults_to_sequential(tmp_path):
+    candidates = {f"CAND-{i}": {} for i in range(3)}
+    orch = TrackingOrchestrator(search_id="TEST-SEQ", output_dir=str(tmp_path))
+
+    await orch.run_pipeline({}, candidates)
+
+    assert orch.concurrency == 1
+    assert orch.max_in_flight == 1
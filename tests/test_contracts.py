@@ -50,3 +50,64 @@ def test_real_contracts():
             with open(path, "r") as f:
                 data = json.load(f)
                 assert isinstance(data, dict)
+
+def test_compiled_contract_reports_all_nested_violations():
+    from utils.contracts import Contract
+
+    contract = Contract("nested", {
+        "score": "number",
+        "meta": {"search_id": "string", "sources": ["string"]},
+        "items": [{"id": "string", "weight": "number"}],
+    })
+
+    assert contract.validate({
+        "score": 1,
+        "meta": {"search_id": "S1", "sources": ["CV"]},
+        "items": [{"id": "a", "weight": 0.5}],
+    }) == []
+
+    assert contract.validate({
+        "score": True,
+        "meta": {"sources": ["CV", 3]},
+        "items": [{"id": "a", "weight": "x"}, "nope"],
+    }) == [
+        "score: expected number, got boolean",
+        "meta.search_id: missing",
+        "meta.sources[1]: expected string, got number",
+        "items[0].weight: expected number, got string",
+        "items[1]: expected object, got string",
+    ]
+
+
+def test_registry_compiles_output_contracts_once(monkeypatch):
+    from utils.contracts import ContractRegistry
+
+    registry = ContractRegistry()
+    listdir_calls = []
+    real_listdir = os.listdir
+    monkeypatch.setattr(os, "listdir", lambda path: listdir_calls.append(path) or real_listdir(path))
+
+    assert sorted(registry.load()) == ["gem1", "gem2", "gem3", "gem4"]
+    assert registry.validate("gem2", {"score": 0.8}) == []
+    assert registry.validate("gem4", {"qa_score": 1}) == ["issues: missing", "human_required: missing"]
+    assert registry.validate("gem9", {}) is None
+    assert len(listdir_calls) == 1
+
+
+async def test_validate_step_logs_violations():
+    from agent.gem6.orchestrator import GEM6Orchestrator
+
+    class FakeDB:
+        def __init__(self):
+            self.logs = []
+
+        async def log_execution(self, data):
+            self.logs.append(data)
+
+    db = FakeDB()
+    orch = GEM6Orchestrator(db_client=db)
+
+    assert await orch.validate_step("E1", "gem2", {"score": "alto"}, "T1") is False
+    assert db.logs[-1]["status"] == "CONTRACT_ERROR"
+    assert db.logs[-1]["error"] == "score: expected number, got string"
+    assert await orch.validate_step("E1", "gem9", {}, "T1") is True
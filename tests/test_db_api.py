@@ -0,0 +1,246 @@
+import json
+
+import pytest
+
+from infra.db import api as db_api
+from infra.db.storage import INSERT_LOG_SQL, SQLiteStorage, Storage, load_schema
+
+# `db_client` and `storage` (conftest.py) run each test on SQLite and PostgreSQL
+
+
+def entity(entity_id, **overrides):
+    row = {
+        "entity_id": entity_id,
+        "current_stage": "GEM2",
+        "state": "PROCESSING",
+        "last_score": 0.7,
+        "agent_responsible": "GEM6",
+        "trace_id": "T1",
+    }
+    row.update(overrides)
+    return row
+
+
+def count(client, table):
+    # The storage's connections belong to the TestClient's event loop
+    return client.portal.call(db_api.storage.count, table)
+
+
+def test_upsert_batch_writes_rows_and_reports_invalid_ones(db_client):
+    rows = [entity("E1"), {"entity_id": "E2"}, entity("E3"), entity("E1", state="COMPLETED")]
+
+    response = db_client.post("/entity/upsert_batch", json=rows)
+
+    body = response.json()
+    assert response.status_code == 200
+    assert body["status"] == "partial"
+    assert body["written"] == 3
+    assert [e["index"] for e in body["errors"]] == [1]
+    assert count(db_client, "entity_state") == 2
+    assert db_client.get("/entity/E1").json()["state"] == "COMPLETED"
+    assert sorted(e["entity_id"] for e in db_client.get("/entities").json()) == ["E1", "E3"]
+
+
+def test_log_batch_isolates_rows_failing_in_the_database(db_client):
+    rows = [
+        {"entity_id": "E1", "agent_id": "gem1", "status": "OK"},
+        {"entity_id": "E1", "status": "OK"},
+        {"entity_id": "E2", "agent_id": "gem2", "status": "OK"},
+    ]
+
+    body = db_client.post("/log/discovery/batch", json=rows).json()
+
+    assert body["written"] == 2
+    assert body["errors"][0]["index"] == 1
+    assert "null" in body["errors"][0]["error"].lower()
+    assert count(db_client, "discovery_logs") == 2
+
+
+def test_empty_batches_succeed(db_client):
+    assert db_client.post("/entity/upsert_batch", json=[]).json() == {"status": "success", "written": 0, "errors": []}
+    assert db_client.post("/log/discovery/batch", json=[]).json()["written"] == 0
+
+
+async def test_storage_reuses_one_wal_connection_per_worker_thread(tmp_path):
+    import threading
+
+    storage = SQLiteStorage(str(tmp_path / "gem_v3.sqlite"), workers=1)
+    await storage.init_schema()
+    try:
+        seen = [await storage.run(lambda conn: (threading.get_ident(), id(conn))) for _ in range(3)]
+        mode = await storage.run(lambda conn: conn.execute("PRAGMA journal_mode").fetchone()[0])
+    finally:
+        await storage.close()
+
+    assert len(set(seen)) == 1
+    assert seen[0][0] != threading.get_ident()
+    assert mode == "wal"
+
+
+async def test_storage_rolls_back_failed_work(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "gem_v3.sqlite"), workers=1)
+    await storage.init_schema()
+
+    def fail(conn):
+        conn.execute(INSERT_LOG_SQL, ("E1", "gem1", 1, 1, 5, "OK", None, "T1"))
+        raise RuntimeError("boom")
+
+    try:
+        with pytest.raises(RuntimeError):
+            await storage.run(fail)
+        assert await storage.run(lambda conn: conn.in_transaction) is False
+        assert await storage.run(lambda conn: conn.execute("SELECT COUNT(*) FROM discovery_logs").fetchone()[0]) == 0
+    finally:
+        await storage.close()
+
+
+def test_discard_moves_entity_out_of_active_state(db_client):
+    db_client.post("/entity/upsert", json=entity("E1")).raise_for_status()
+    response = db_client.post("/entity/discard", json={
+        "entity_id": "E1", "stage_at_discard": "GEM2", "reason": "LOW_SCORE",
+        "score_at_discard": 0.2, "agent_responsible": "GEM6", "trace_id": "T1",
+    })
+
+    assert response.json() == {"status": "discarded"}
+    assert db_client.get("/entity/E1").status_code == 404
+    assert count(db_client, "discarded_entities") == 1
+
+
+def test_entity_round_trip_is_backend_independent(db_client):
+    db_client.post("/entity/upsert", json=entity("E1", metadata={"k": [1, 2]}, human_required=True))
+
+    stored = db_client.get("/entity/E1").json()
+    assert stored["metadata"] == {"k": [1, 2]}
+    assert bool(stored["human_required"]) is True
+    assert stored["updated_at"].startswith(stored["created_at"][:10])
+    assert db_client.get("/entities", params={"stage": "GEM2"}).json()[0]["entity_id"] == "E1"
+    assert db_client.get("/entities", params={"stage": "GEM9"}).json() == []
+
+
+async def test_schema_migration_applies_once(storage):
+    try:
+        assert await storage.init_schema() is True
+        assert await storage.init_schema() is False
+        assert await storage.count("entity_state") == 0
+    finally:
+        await storage.close()
+
+
+def test_schema_translation_for_postgres():
+    sql = load_schema("postgresql")
+
+    assert "AUTOINCREMENT" not in sql
+    assert "BIGSERIAL PRIMARY KEY" in sql
+    assert "BOOLEAN DEFAULT FALSE" in sql
+
+
+def test_entities_keyset_pages_cover_every_row_once(db_client):
+    # One batch shares a single updated_at, so the id tie-breaker does the paging
+    db_client.post("/entity/upsert_batch", json=[entity(f"E{i}") for i in range(7)]).raise_for_status()
+    db_client.post("/entity/upsert", json=entity("E0", state="COMPLETED")).raise_for_status()
+
+    seen, cursor = [], None
+    while True:
+        response = db_client.get("/entities", params={"limit": 3, "fields": "entity_id", **({"cursor": cursor} if cursor else {})})
+        assert all(list(row) == ["entity_id"] for row in response.json())
+        seen += [row["entity_id"] for row in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert seen == ["E1", "E2", "E3", "E4", "E5", "E6", "E0"]
+
+
+def test_entities_filters_and_rejects_bad_arguments(db_client):
+    db_client.post("/entity/upsert_batch", json=[
+        entity("E1", last_score=0.2), entity("E2", last_score=0.6, state="COMPLETED"),
+        entity("E3", last_score=0.9), entity("E4", last_score=0.8, current_stage="GEM3"),
+    ]).raise_for_status()
+
+    def ids(**params):
+        return [row["entity_id"] for row in db_client.get("/entities", params=params).json()]
+
+    assert ids(min_score=0.5) == ["E2", "E3", "E4"]
+    assert ids(min_score=0.5, max_score=0.85, stage="GEM2") == ["E2"]
+    assert ids(state="PROCESSING", stage="GEM2") == ["E1", "E3"]
+    assert db_client.get("/entities", params={"fields": "entity_id,password"}).status_code == 400
+    assert db_client.get("/entities", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert db_client.get("/entities", params={"limit": 0}).status_code == 422
+
+
+def test_entities_ndjson_streams_every_page(db_client):
+    db_client.post("/entity/upsert_batch", json=[entity(f"E{i}") for i in range(5)]).raise_for_status()
+
+    response = db_client.get("/entities", params={"format": "ndjson", "limit": 2, "fields": "entity_id,state"})
+
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == [{"entity_id": f"E{i}", "state": "PROCESSING"} for i in range(5)]
+
+
+def test_funnel_rollups_follow_every_write(db_client):
+    s1, s2 = {"search_id": "S1"}, {"search_id": "S2"}
+    db_client.post("/entity/upsert_batch", json=[
+        entity("E1", metadata=s1), entity("E2", metadata=s1), entity("E3", metadata=s2),
+        entity("E1", metadata=s1, current_stage="GEM3"),
+    ]).raise_for_status()
+    db_client.post("/entity/upsert", json=entity("E2", metadata=s1, current_stage="COMPLETED")).raise_for_status()
+    db_client.post("/entity/upsert", json=entity("E2", metadata=s1, current_stage="COMPLETED")).raise_for_status()
+    db_client.post("/entity/discard", json={
+        "entity_id": "E3", "stage_at_discard": "GEM2", "reason": "LOW_SCORE",
+        "metadata": s2, "agent_responsible": "GEM6", "trace_id": "T1",
+    }).raise_for_status()
+    db_client.post("/log/discovery/batch", json=[
+        {"entity_id": "E1", "agent_id": "GEM3", "status": "OK", "time_ms": 100, "search_id": "S1"},
+        {"entity_id": "E2", "agent_id": "GEM3", "status": "CONTRACT_ERROR", "time_ms": 300, "search_id": "S1"},
+        {"entity_id": "E2", "status": "OK"},
+    ]).raise_for_status()
+    db_client.post("/log/discovery", json={"entity_id": "E3", "agent_id": "GEM2", "status": "OK", "search_id": "S2"})
+
+    funnel = db_client.get("/metrics/funnel").json()
+    assert funnel["funnel_counts"] == {"COMPLETED": 1, "GEM3": 1}
+    assert funnel["discarded"] == {"GEM2": 1}
+    assert funnel["discard_rate"] == pytest.approx(1 / 3)
+    assert funnel["acceptance_rate"] == 0.5
+    assert funnel["results_per_query"] == {"GEM2": 1, "GEM3": 2}
+    assert funnel["errors"] == {"GEM3": 1}
+    assert funnel["avg_processing_time"] == {"GEM3": 200}
+
+    s1_funnel = db_client.get("/metrics/funnel", params={"search_id": "S1"}).json()
+    assert s1_funnel["funnel_counts"] == {"COMPLETED": 1, "GEM3": 1}
+    assert s1_funnel["discarded"] == {}
+    assert db_client.get("/metrics/funnel", params={"day_from": "2999-01-01"}).json()["funnel_counts"] == {}
+
+
+async def test_migration_backfills_rollups_from_existing_rows(storage):
+    from datetime import datetime
+
+    try:
+        await storage.init_schema()
+        now = datetime.now()
+        await storage.upsert_entities([entity("E1", metadata={"search_id": "S1"}), entity("E2")], [0, 1], now)
+        await storage.insert_logs([{"entity_id": "E1", "agent_id": "GEM2", "status": "OK", "time_ms": 40}], now)
+        expected = await storage.funnel()
+
+        # A database from before funnel_rollup existed: no rollups, schema not yet applied
+        for sql in ("DROP TABLE funnel_rollup", "DELETE FROM schema_migrations"):
+            if storage.dialect == "sqlite":
+                await storage.run(lambda conn: (conn.execute(sql), conn.commit()))
+            else:
+                async with await storage._acquire() as conn:
+                    await conn.execute(sql)
+
+        assert await storage.init_schema() is True
+        assert await storage.funnel() == expected
+        assert (await storage.funnel(search_id="S1"))["funnel_counts"] == {"GEM2": 1}
+    finally:
+        await storage.close()
+
+
+def test_storage_backends_must_implement_the_interface():
+    class Incomplete(Storage):
+        async def close(self):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,287 @@
+import hashlib
+import json
+import threading
+import time
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from agent.drive_cache import DriveFileCache
+from agent.drive_client import FOLDER_MIME, DriveClient
+from agent.gem6.orchestrator import GEM6Orchestrator
+
+
+class FakeMediaRequest:
+    """What MediaIoBaseDownload reads from an HttpRequest: uri, headers and http."""
+
+    def __init__(self, drive, file_id):
+        self.uri = f"https://fake.drive/{file_id}"
+        self.headers = {}
+        self.http = self
+        self.drive = drive
+        self.file_id = file_id
+
+    def request(self, uri, method="GET", headers=None, **kwargs):
+        return self.drive._serve(self.file_id)
+
+
+class FakeDrive:
+    """
+    In-memory stand-in for the Drive v3 `files()` resource: files.list pages through
+    `page_size` items per page and media requests can fail with an injected status.
+    """
+
+    def __init__(self, page_size=2, latency=0.0):
+        self.page_size = page_size
+        self.latency = latency
+        self.items = []
+        self.failures = {}
+        self.downloads = {}
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def add(self, file_id, name, parent, mime="text/plain", content=""):
+        self.items.append({"id": file_id, "name": name, "mimeType": mime, "parent": parent})
+        self.edit(file_id, content)
+
+    def edit(self, file_id, content):
+        # Like Drive: Google Docs only have modifiedTime, other files also an md5Checksum
+        item = next(i for i in self.items if i["id"] == file_id)
+        item["content"] = content
+        item["modifiedTime"] = f"2026-01-01T00:00:{time.perf_counter_ns()}Z"
+        if item["mimeType"] != FOLDER_MIME and "google-apps" not in item["mimeType"]:
+            item["md5Checksum"] = hashlib.md5(content.encode("utf-8")).hexdigest()
+
+    def fail(self, file_id, status, times):
+        self.failures[file_id] = [status] * times
+
+    def files(self):
+        return self
+
+    def list(self, q, fields, pageSize, pageToken=None):
+        parent = q.split("'")[1]
+        matches = [i for i in self.items if i["parent"] == parent
+                   and ("mimeType =" not in q or i["mimeType"] == FOLDER_MIME)]
+        start = int(pageToken or 0)
+        page = matches[start:start + self.page_size]
+        result = {"files": [{k: i[k] for k in ("id", "name", "mimeType", "modifiedTime", "md5Checksum") if k in i}
+                            for i in page]}
+        if start + self.page_size < len(matches):
+            result["nextPageToken"] = str(start + self.page_size)
+        return type("Request", (), {"execute": lambda _: result})()
+
+    def get_media(self, fileId):
+        return FakeMediaRequest(self, fileId)
+
+    def export_media(self, fileId, mimeType):
+        return FakeMediaRequest(self, fileId)
+
+    def _serve(self, file_id):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.downloads[file_id] = self.downloads.get(file_id, 0) + 1
+            pending = self.failures.get(file_id)
+            status = pending.pop() if pending else 200
+        time.sleep(self.latency)
+        with self._lock:
+            self.active -= 1
+        if status != 200:
+            return httplib2.Response({"status": status}), b"error"
+        body = next(i for i in self.items if i["id"] == file_id)["content"].encode("utf-8")
+        return httplib2.Response({"status": 200, "content-length": str(len(body))}), body
+
+
+def make_client(drive, **kwargs):
+    progress = []
+    kwargs.setdefault("retry_backoff", 0)
+    kwargs.setdefault("use_cache", False)
+    client = DriveClient(service=drive, on_progress=lambda *args: progress.append(args), **kwargs)
+    return client, progress
+
+
+def test_discover_search_structure_pages_and_downloads_everything():
+    drive = FakeDrive(page_size=2)
+    drive.add("jd", "brief_jd.txt", "ROOT", content="JD")
+    drive.add("ko", "kickoff_notes.txt", "ROOT", content="KO")
+    drive.add("cc", "company_context.txt", "ROOT", content="CC")
+    for n in range(5):
+        drive.add(f"F{n}", f"cand_{n}", "ROOT", mime=FOLDER_MIME)
+        drive.add(f"cv{n}", "cv.txt", f"F{n}", content=f"CV {n}")
+        drive.add(f"int{n}", "interview_notes.txt", f"F{n}", content=f"INT {n}")
+        drive.add(f"ref{n}", "references.txt", f"F{n}", mime="application/vnd.google-apps.document",
+                  content=f"REF {n}")
+
+    client, progress = make_client(drive, workers=4)
+    structure = client.discover_search_structure("ROOT")
+
+    assert structure["search_inputs"] == {"jd_text": "JD", "kickoff_notes": "KO", "company_context": "CC"}
+    assert len(structure["candidates"]) == 5
+    assert structure["candidates"]["cand_4"] == {
+        "cv_text": "CV 4", "interview_notes": "INT 4", "references_text": "REF 4",
+    }
+    # Folders are listed, never downloaded
+    assert set(drive.downloads) == {i["id"] for i in drive.items if i["mimeType"] != FOLDER_MIME}
+    assert [p[:2] for p in sorted(progress, key=lambda p: p[0])] == [(n, 18) for n in range(1, 19)]
+
+
+def test_download_many_retries_transient_errors():
+    drive = FakeDrive()
+    drive.add("a", "cv.txt", "ROOT", content="A")
+    drive.add("b", "tests.txt", "ROOT", content="B")
+    drive.fail("a", 503, times=2)
+    drive.fail("b", 404, times=1)
+
+    client, progress = make_client(drive, retries=3)
+    results = client.download_many([{"id": "a", "name": "cv.txt"}, {"id": "b", "name": "tests.txt"}])
+
+    assert results["a"] == "A"
+    assert drive.downloads["a"] == 3
+    # A 404 is not retried: the file fails, the rest of the batch does not
+    assert isinstance(results["b"], HttpError) and results["b"].resp.status == 404
+    assert drive.downloads["b"] == 1
+    assert sorted((p[2]["id"], p[3] is None) for p in progress) == [("a", True), ("b", False)]
+
+
+def test_download_many_gives_up_after_retries():
+    drive = FakeDrive()
+    drive.add("a", "cv.txt", "ROOT", content="A")
+    drive.fail("a", 429, times=10)
+
+    client, _ = make_client(drive, retries=2)
+    results = client.download_many([{"id": "a", "name": "cv.txt"}])
+
+    assert isinstance(results["a"], HttpError)
+    assert drive.downloads["a"] == 3
+
+
+def test_downloads_run_in_parallel():
+    drive = FakeDrive(page_size=100, latency=0.05)
+    files = []
+    for n in range(40):
+        drive.add(f"f{n}", f"cv_{n}.txt", "ROOT", content=str(n))
+        files.append({"id": f"f{n}", "name": f"cv_{n}.txt"})
+
+    client, _ = make_client(drive, workers=8)
+    started = time.perf_counter()
+    results = client.download_many(files)
+    elapsed = time.perf_counter() - started
+
+    assert results == {f"f{n}": str(n) for n in range(40)}
+    assert drive.max_active > 1
+    # Serially this is 40 * 50ms = 2s
+    assert elapsed < 1.0
+
+
+def test_download_folder_as_inputs_skips_failed_files(tmp_path):
+    drive = FakeDrive()
+    drive.add("a", "cv", "ROOT", content="CV")
+    drive.add("b", "broken.txt", "ROOT", content="X")
+    drive.add("sub", "nested", "ROOT", mime=FOLDER_MIME)
+    drive.fail("b", 403, times=1)
+
+    client, _ = make_client(drive)
+    inputs = client.download_folder_as_inputs("ROOT", str(tmp_path))
+
+    assert inputs == {"cv.txt": "CV"}
+    assert (tmp_path / "cv.txt").read_text(encoding="utf-8") == "CV"
+
+
+def build_search(drive, candidates=3):
+    drive.add("jd", "brief_jd.txt", "ROOT", content="JD")
+    for n in range(candidates):
+        drive.add(f"F{n}", f"cand_{n}", "ROOT", mime=FOLDER_MIME)
+        drive.add(f"cv{n}", "cv.txt", f"F{n}", content=f"CV {n}")
+        drive.add(f"notes{n}", "interview_notes", f"F{n}", mime="application/vnd.google-apps.document",
+                  content=f"INT {n}")
+
+
+def test_repeat_run_only_downloads_changed_files(tmp_path):
+    drive = FakeDrive()
+    build_search(drive)
+    cache_path = str(tmp_path / "drive.sqlite")
+
+    client, _ = make_client(drive, use_cache=True, cache=DriveFileCache(cache_path))
+    first = client.discover_search_structure("ROOT")
+    assert sum(drive.downloads.values()) == 7
+
+    drive.downloads.clear()
+    drive.edit("cv1", "CV 1 updated")
+    drive.edit("notes2", "INT 2 updated")
+    # A new process: the cache lives on disk
+    client, progress = make_client(drive, use_cache=True, cache=DriveFileCache(cache_path))
+    second = client.discover_search_structure("ROOT")
+
+    assert drive.downloads == {"cv1": 1, "notes2": 1}
+    assert second["candidates"]["cand_0"] == first["candidates"]["cand_0"]
+    assert second["candidates"]["cand_1"]["cv_text"] == "CV 1 updated"
+    assert second["candidates"]["cand_2"]["interview_notes"] == "INT 2 updated"
+    assert sorted(p[0] for p in progress) == list(range(1, 8))
+    stats = client.cache.stats()
+    assert (stats["hits"], stats["misses"], stats["stale"]) == (5, 2, 2)
+    assert stats["hit_rate"] == round(5 / 7, 4)
+
+
+def test_failed_downloads_and_files_without_revision_are_not_cached(tmp_path):
+    drive = FakeDrive()
+    drive.add("a", "cv.txt", "ROOT", content="A")
+    drive.fail("a", 404, times=1)
+    cache = DriveFileCache(str(tmp_path / "drive.sqlite"))
+    client, _ = make_client(drive, use_cache=True, cache=cache)
+
+    assert isinstance(client.download_many(client.list_files("ROOT"))["a"], HttpError)
+    assert client.download_many([{"id": "a", "name": "cv.txt"}]) == {"a": "A"}
+    assert client.download_many(client.list_files("ROOT")) == {"a": "A"}
+    assert drive.downloads["a"] == 3
+    assert cache.stats()["bypassed"] == 1
+
+
+def test_cache_evicts_least_recently_used_by_size(tmp_path):
+    cache = DriveFileCache(str(tmp_path / "drive.sqlite"), max_bytes=250)
+    files = [{"id": f"f{n}", "md5Checksum": f"md5-{n}"} for n in range(3)]
+    cache.set(files[0], "x" * 100)
+    cache.set(files[1], "y" * 100)
+    assert cache.get(files[0]) == "x" * 100
+    cache.set(files[2], "z" * 100)
+
+    assert cache.get(files[1]) is None
+    assert cache.get(files[0]) == "x" * 100
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 200
+
+
+async def test_run_summary_reports_drive_cache(tmp_path):
+    class StubOrchestrator(GEM6Orchestrator):
+        async def process_context(self, context_data):
+            return {"status": "SUCCESS"}
+
+    drive = FakeDrive()
+    build_search(drive, candidates=1)
+    client, _ = make_client(drive, use_cache=True, cache=DriveFileCache(str(tmp_path / "drive.sqlite")))
+    structure = client.discover_search_structure("ROOT")
+
+    orch = StubOrchestrator(search_id="TEST-DRIVE", output_dir=str(tmp_path), force=True, drive=client)
+    await orch.run_pipeline(structure["search_inputs"], structure["candidates"])
+
+    with open(tmp_path / "pipeline_summary.json") as f:
+        summary = json.load(f)
+    assert summary["drive_cache"]["misses"] == 3
+    assert summary["drive_cache"]["hit_rate"] == 0.0
+
+
+def test_close_releases_the_cache_connection(tmp_path):
+    drive = FakeDrive()
+    drive.add("a", "cv.txt", "ROOT", content="A")
+    cache = DriveFileCache(str(tmp_path / "drive.sqlite"))
+    client, _ = make_client(drive, use_cache=True, cache=cache)
+    client.download_many(client.list_files("ROOT"))
+    assert cache._conn is not None
+
+    client.close()
+
+    assert cache._conn is None
+    # Reusing the client reopens the cache, with its entries intact
+    assert client.download_many(client.list_files("ROOT")) == {"a": "A"}
+    assert drive.downloads["a"] == 1
+    client.close()
@@ -0,0 +1,67 @@
+from agent.gem6.orchestrator import GEM6Orchestrator
+from utils.input_loader import fingerprint_candidate
+
+
+class FakeDB:
+    """In-memory stand-in for GEMClient backed by a dict of entity rows."""
+
+    def __init__(self):
+        self.entities = {}
+
+    async def get_entity(self, entity_id):
+        return self.entities.get(entity_id)
+
+    async def upsert_entity(self, data):
+        self.entities[data["entity_id"]] = data
+
+    async def log_execution(self, data):
+        pass
+
+    async def aclose(self):
+        pass
+
+
+class FinalizingGemini:
+    provider = "ollama"
+    model = "fake"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def arun_gem(self, prompt, gem_name=None, **kwargs):
+        self.calls += 1
+        return {"json": {"action": "finalize", "status": "SUCCESS", "final_output": {"ok": True}}}
+
+
+def test_fingerprint_is_stable_and_input_sensitive():
+    versions = {"prompts": {"gem6": "abc"}}
+    base = fingerprint_candidate({"jd_text": "jd"}, {"cv_text": "cv"}, versions)
+    assert base == fingerprint_candidate({"jd_text": "jd"}, {"cv_text": "cv"}, versions)
+    assert base != fingerprint_candidate({"jd_text": "jd2"}, {"cv_text": "cv"}, versions)
+    assert base != fingerprint_candidate({"jd_text": "jd"}, {"cv_text": "cv2"}, versions)
+    assert base != fingerprint_candidate({"jd_text": "jd"}, {"cv_text": "cv"}, {"prompts": {"gem6": "abd"}})
+
+
+async def test_unchanged_candidates_are_skipped(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db, gemini = FakeDB(), FinalizingGemini()
+    search_inputs = {"jd_text": "jd"}
+    candidates = {"CAND-1": {"cv_text": "a"}, "CAND-2": {"cv_text": "b"}}
+
+    def orchestrator(**kwargs):
+        return GEM6Orchestrator(gemini=gemini, search_id="S", output_dir=str(tmp_path), db_client=db, **kwargs)
+
+    first = await orchestrator().run_pipeline(search_inputs, candidates)
+    assert gemini.calls == 2
+    assert not any(r.get("skipped") for r in first.values())
+
+    candidates["CAND-2"] = {"cv_text": "b, updated"}
+    second = await orchestrator().run_pipeline(search_inputs, candidates)
+    assert gemini.calls == 3
+    assert second["CAND-1"]["skipped"] is True
+    assert second["CAND-1"]["output"] == {"ok": True}
+    assert not second["CAND-2"].get("skipped")
+
+    forced = await orchestrator(force=True).run_pipeline(search_inputs, candidates)
+    assert gemini.calls == 5
+    assert not any(r.get("skipped") for r in forced.values())
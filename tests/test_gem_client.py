@@ -0,0 +1,204 @@
+import asyncio
+import json
+
+import httpx
+
+from utils.gem_core import GEMClient
+
+
+def patch_transport(monkeypatch, handler):
+    real_async_client = httpx.AsyncClient
+    created = []
+
+    def fake_async_client(*args, **kwargs):
+        kwargs["transport"] = httpx.MockTransport(handler)
+        created.append(kwargs)
+        return real_async_client(*args, **kwargs)
+
+    monkeypatch.setattr(httpx, "AsyncClient", fake_async_client)
+    return created
+
+
+async def test_gem_client_reuses_one_pool(monkeypatch):
+    paths = []
+
+    def handler(request):
+        paths.append(request.url.path)
+        return httpx.Response(200, json={"status": "ok"})
+
+    created = patch_transport(monkeypatch, handler)
+
+    async with GEMClient("http://db-api.test") as client:
+        assert await client.upsert_entity({"entity_id": "E1"}) == {"status": "ok"}
+        await client.log_execution({"entity_id": "E1"})
+        await client.discard_entity({"entity_id": "E1"})
+
+    assert paths == ["/entity/upsert", "/log/discovery", "/entity/discard"]
+    assert len(created) == 1
+    assert created[0]["headers"]["Connection"] == "keep-alive"
+    assert client._client is None
+
+
+async def test_gem_client_swallows_http_errors(monkeypatch):
+    patch_transport(monkeypatch, lambda request: httpx.Response(500))
+
+    async with GEMClient("http://db-api.test") as client:
+        assert await client.upsert_entity({"entity_id": "E1"}) is None
+
+
+def recording_handler(calls, batch_status=200):
+    def handler(request):
+        rows = json.loads(request.content) if request.content else None
+        calls.append((request.url.path, rows))
+        if request.url.path.endswith("batch"):
+            if batch_status != 200:
+                return httpx.Response(batch_status)
+            return httpx.Response(200, json={"status": "success", "written": len(rows), "errors": []})
+        return httpx.Response(200, json={"status": "ok"})
+    return handler
+
+
+async def test_write_behind_coalesces_and_flushes_on_close(monkeypatch):
+    calls = []
+    patch_transport(monkeypatch, recording_handler(calls))
+
+    client = GEMClient("http://db-api.test", write_behind=True, batch_size=50, flush_interval=60)
+    assert await client.upsert_entity({"entity_id": "E1", "state": "PROCESSING"}) == {"status": "queued"}
+    await client.upsert_entity({"entity_id": "E2", "state": "PROCESSING"})
+    await client.upsert_entity({"entity_id": "E1", "state": "COMPLETED"})
+    await client.log_execution({"entity_id": "E1", "agent_id": "gem1"})
+    assert calls == []
+
+    await client.aclose()
+
+    assert calls == [
+        ("/entity/upsert_batch", [{"entity_id": "E1", "state": "COMPLETED"}, {"entity_id": "E2", "state": "PROCESSING"}]),
+        ("/log/discovery/batch", [{"entity_id": "E1", "agent_id": "gem1"}]),
+    ]
+    assert client.stats() == {
+        "write_behind": True, "queued": 4, "coalesced": 1, "flushed": 3, "failed": 0, "requeued": 0, "pending": 0,
+    }
+
+
+async def test_write_behind_flushes_when_batch_size_is_reached(monkeypatch):
+    calls = []
+    patch_transport(monkeypatch, recording_handler(calls))
+
+    async with GEMClient("http://db-api.test", write_behind=True, batch_size=2, flush_interval=60) as client:
+        await client.log_execution({"entity_id": "E1", "agent_id": "gem1"})
+        await client.log_execution({"entity_id": "E2", "agent_id": "gem1"})
+        for _ in range(20):
+            if calls:
+                break
+            await asyncio.sleep(0.01)
+        assert [len(rows) for _, rows in calls] == [2]
+
+
+async def test_write_behind_backpressure_flushes_full_queue(monkeypatch):
+    calls = []
+    patch_transport(monkeypatch, recording_handler(calls))
+
+    async with GEMClient("http://db-api.test", write_behind=True, max_queue=2, flush_interval=60) as client:
+        await client.log_execution({"entity_id": "E1", "agent_id": "gem1"})
+        await client.log_execution({"entity_id": "E2", "agent_id": "gem1"})
+        assert calls == []
+
+        await client.log_execution({"entity_id": "E3", "agent_id": "gem1"})
+        assert [len(rows) for _, rows in calls] == [2]
+        assert client.stats()["pending"] == 1
+
+    assert [len(rows) for _, rows in calls] == [2, 1]
+
+
+async def test_write_behind_falls_back_without_batch_endpoints(monkeypatch):
+    calls = []
+    patch_transport(monkeypatch, recording_handler(calls, batch_status=404))
+
+    async with GEMClient("http://db-api.test", write_behind=True, flush_interval=60) as client:
+        await client.upsert_entity({"entity_id": "E1"})
+        await client.upsert_entity({"entity_id": "E2"})
+
+    assert [path for path, _ in calls] == ["/entity/upsert_batch", "/entity/upsert", "/entity/upsert"]
+    assert client.flushed == 2
+
+
+async def test_write_behind_reads_and_discards_see_queued_upserts(monkeypatch):
+    calls = []
+    patch_transport(monkeypatch, recording_handler(calls))
+
+    async with GEMClient("http://db-api.test", write_behind=True, flush_interval=60) as client:
+        await client.upsert_entity({"entity_id": "E1"})
+        await client.get_entity("E1")
+        await client.upsert_entity({"entity_id": "E2"})
+        await client.discard_entity({"entity_id": "E2"})
+
+    assert [path for path, _ in calls] == [
+        "/entity/upsert_batch", "/entity/E1", "/entity/upsert_batch", "/entity/discard"
+    ]
+
+
+def flaky_handler(calls, statuses):
+    """Answers batch requests with the next status in `statuses` (200 once they run out)."""
+    def handler(request):
+        rows = json.loads(request.content)
+        calls.append((request.url.path, rows))
+        status = statuses.pop(0) if statuses else 200
+        if status != 200:
+            return httpx.Response(status)
+        return httpx.Response(200, json={"status": "success", "written": len(rows), "errors": []})
+    return handler
+
+
+async def test_write_behind_retries_failed_batches(monkeypatch):
+    calls = []
+    patch_transport(monkeypatch, flaky_handler(calls, [503, 502]))
+
+    async with GEMClient("http://db-api.test", write_behind=True, flush_interval=60,
+                         retries=3, retry_backoff=0) as client:
+        await client.upsert_entity({"entity_id": "E1"})
+        assert await client.flush()
+
+    assert len(calls) == 3
+    assert client.stats()["flushed"] == 1 and client.stats()["requeued"] == 0
+
+
+async def test_write_behind_requeues_rows_after_retries_without_clobbering_newer_upserts(monkeypatch):
+    calls = []
+    patch_transport(monkeypatch, flaky_handler(calls, [503] * 4))
+
+    client = GEMClient("http://db-api.test", write_behind=True, flush_interval=60, retries=1, retry_backoff=0.05)
+    await client.upsert_entity({"entity_id": "E1", "state": "PROCESSING"})
+    await client.upsert_entity({"entity_id": "E2", "state": "PROCESSING"})
+    await client.log_execution({"entity_id": "E1", "agent_id": "gem1"})
+
+    flushing = asyncio.ensure_future(client.flush())
+    await asyncio.sleep(0.01)
+    # Queued while the failing batch waits to be retried
+    await client.upsert_entity({"entity_id": "E1", "state": "COMPLETED"})
+    assert await flushing is False
+
+    assert client._pending_upserts == {
+        "E1": {"entity_id": "E1", "state": "COMPLETED"}, "E2": {"entity_id": "E2", "state": "PROCESSING"},
+    }
+    assert client._pending_logs == [{"entity_id": "E1", "agent_id": "gem1"}]
+    assert client.stats()["requeued"] == 3
+
+    await client.aclose()
+    assert calls[-2:] == [
+        ("/entity/upsert_batch", [{"entity_id": "E1", "state": "COMPLETED"}, {"entity_id": "E2", "state": "PROCESSING"}]),
+        ("/log/discovery/batch", [{"entity_id": "E1", "agent_id": "gem1"}]),
+    ]
+    assert client.stats()["pending"] == 0
+
+
+async def test_write_behind_counts_rejected_rows_without_retrying(monkeypatch):
+    calls = []
+    patch_transport(monkeypatch, flaky_handler(calls, [422]))
+
+    async with GEMClient("http://db-api.test", write_behind=True, flush_interval=60, retry_backoff=0) as client:
+        await client.upsert_entity({"entity_id": "E1"})
+        await client.upsert_entity({"entity_id": "E2"})
+        assert await client.flush()
+
+    assert len(calls) == 1
+    assert client.stats()["failed"] == 2 and client.stats()["pending"] == 0
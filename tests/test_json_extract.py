@@ -0,0 +1,77 @@
+from agent.gemini_client import GeminiClient
+from agent.json_extract import (
+    REPAIR_NEWLINES,
+    REPAIR_SMART_QUOTES,
+    REPAIR_TRAILING_COMMAS,
+    REPAIR_TRUNCATED,
+    extract_json,
+    scan_objects,
+)
+
+
+def test_scan_objects_respects_strings_and_reports_open_tail():
+    text = 'a {"x": "}"} b {"y": [1, {"z": 2}]} c {"open": ['
+    spans = list(scan_objects(text))
+
+    assert [text[s:e] for s, e, _ in spans] == ['{"x": "}"}', '{"y": [1, {"z": 2}]}', '{"open": [']
+    assert [closed for _, _, closed in spans] == [True, True, False]
+
+
+def test_extract_skips_prose_braces_and_returns_first_valid_object():
+    result = extract_json('Usá {placeholder} así.\n```json\n{"ok": true}\n```\n{"otro": 1}')
+
+    assert result.value == {"ok": True}
+    assert result.repairs == []
+
+
+def test_extract_recovers_object_after_unbalanced_prose_brace():
+    text = 'el set {a, b está incompleto.\n```json\n{"score": 7}\n```'
+    result = extract_json(text)
+
+    assert result.value == {"score": 7}
+    assert text[result.start:result.end] == '{"score": 7}'
+
+
+def test_extract_repairs_trailing_commas_and_newlines():
+    result = extract_json('{"items": [1, 2,], "note": "línea 1\nlínea 2",\n}')
+
+    assert result.value == {"items": [1, 2], "note": "línea 1\nlínea 2"}
+    assert result.repairs == [REPAIR_NEWLINES, REPAIR_TRAILING_COMMAS]
+
+
+def test_extract_keeps_commas_inside_strings():
+    result = extract_json('{"a": "x,]", "b": 1,}')
+
+    assert result.value == {"a": "x,]", "b": 1}
+
+
+def test_extract_repairs_smart_quotes():
+    result = extract_json("{“action”: “FINALIZE”}")
+
+    assert result.value == {"action": "FINALIZE"}
+    assert result.repairs == [REPAIR_SMART_QUOTES]
+
+
+def test_extract_closes_truncated_output():
+    assert extract_json('```json\n{"a": {"b": [1, 2').value == {"a": {"b": [1, 2]}}
+    assert extract_json('{"a": "texto cort').value == {"a": "texto cort"}
+    assert extract_json('{"a": 1, "b":').value == {"a": 1, "b": None}
+
+    result = extract_json('{"a": [1,')
+    assert result.value == {"a": [1]}
+    assert result.repairs == [REPAIR_TRUNCATED]
+
+
+def test_parse_response_reports_repairs_and_unrecoverable_json():
+    client = GeminiClient(api_key="dummy", use_cache=False)
+
+    parsed = client._parse_response('Intro\n```json\n{"score": 7,}\n```\n## Detalle')
+    assert parsed["json"] == {"score": 7}
+    assert parsed["markdown"] == "Intro\n## Detalle"
+    assert parsed["repairs"] == [REPAIR_TRAILING_COMMAS]
+
+    broken = client._parse_response('{"score": 7 "x": 1}')
+    assert broken["json"]["_raw_json"] == '{"score": 7 "x": 1}'
+    assert "_parse_error" in broken["json"]
+
+    assert client._parse_response("sin json")["json"] is None
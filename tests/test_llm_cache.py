@@ -0,0 +1,148 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import httpx
+
+from agent.gemini_client import GeminiClient
+from agent.llm_cache import ResponseCache, make_cache_key
+
+
+def test_cache_key_depends_on_every_input():
+    base = make_cache_key("ollama", "m", {"temperature": 0.1}, "prompt")
+    assert base == make_cache_key("ollama", "m", {"temperature": 0.1}, "prompt")
+    assert base != make_cache_key("gemini", "m", {"temperature": 0.1}, "prompt")
+    assert base != make_cache_key("ollama", "m2", {"temperature": 0.1}, "prompt")
+    assert base != make_cache_key("ollama", "m", {"temperature": 0.2}, "prompt")
+    assert base != make_cache_key("ollama", "m", {"temperature": 0.1}, "prompt!")
+
+
+def test_lru_eviction_by_size(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=250, ttl_seconds=0)
+    payload = {"raw": "x" * 90}
+    cache.set("a", payload)
+    cache.set("b", payload)
+    assert cache.get("a") == payload  # "a" becomes most recently used
+    cache.set("c", payload)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == payload
+    assert cache.get("c") == payload
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["entries"] == 2
+    assert stats["hits"] == 3 and stats["misses"] == 1
+
+
+def test_ttl_expiry(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=10_000, ttl_seconds=0.01)
+    cache.set("k", {"v": 1})
+    assert cache.get("k") == {"v": 1}
+    time.sleep(0.02)
+    assert cache.get("k") is None
+
+
+async def test_concurrent_identical_calls_coalesce(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.02)
+        return {"json": {"ok": True}}
+
+    results = await asyncio.gather(*(cache.aget_or_compute("k", compute) for _ in range(5)))
+
+    assert calls == 1
+    assert all(r == {"json": {"ok": True}} for r in results)
+    assert cache.coalesced == 4
+    # Waiters get independent copies of the shared result
+    results[0]["json"]["ok"] = False
+    assert all(r["json"] == {"ok": True} for r in results[1:])
+    assert len({id(r["json"]) for r in results}) == 5
+
+
+async def test_arun_gem_uses_cache_and_bypasses_hot_temperatures(monkeypatch, tmp_path):
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json={"response": '{"score": 0.9}'})
+
+    real_async_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        httpx, "AsyncClient",
+        lambda *a, **kw: real_async_client(*a, transport=httpx.MockTransport(handler), **kw),
+    )
+    monkeypatch.setattr("config.LLM_CACHE_MAX_TEMPERATURE", 0.3)
+
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    client = GeminiClient(api_key="dummy", response_cache=cache)
+    client.provider = "ollama"
+
+    first = await client.arun_gem("same prompt", gem_name="gem1")
+    second = await client.arun_gem("same prompt", gem_name="gem1")
+    assert first == second
+    assert len(calls) == 1
+
+    # gem2 runs at temperature 0.4 > 0.3: never cached
+    await client.arun_gem("same prompt", gem_name="gem2")
+    await client.arun_gem("same prompt", gem_name="gem2")
+    assert len(calls) == 3
+    assert cache.stats()["bypassed"] == 2
+
+    await client.arun_gem("same prompt", gem_name="gem1", use_cache=False)
+    assert len(calls) == 4
+    await client.aclose()
+    # aclose() closes the cache connection too
+    assert cache._conn is None
+
+
+def last_access(path, key):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT last_access FROM llm_responses WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_hits_batch_last_access_updates(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path, touch_interval=3600)
+    cache.set("k", {"v": 1})
+    written = last_access(path, "k")
+    time.sleep(0.01)
+
+    for _ in range(3):
+        assert cache.get("k") == {"v": 1}
+    # Hits alone do not write
+    assert last_access(path, "k") == written
+
+    cache.close()
+    assert last_access(path, "k") > written
+
+
+def test_key_locks_are_pruned(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    for i in range(10):
+        cache.get_or_compute(f"k{i}", lambda: {"v": 1})
+    assert cache._key_locks == {}
+
+
+async def test_async_lookups_run_off_the_event_loop(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    threads = []
+    lookup = cache._lookup
+
+    def tracking_lookup(key):
+        threads.append(threading.current_thread())
+        return lookup(key)
+
+    cache._lookup = tracking_lookup
+
+    async def compute():
+        return {"v": 1}
+
+    await cache.aget_or_compute("k", compute)
+    assert await cache.aget_or_compute("k", compute) == {"v": 1}
+    assert threads and threading.main_thread() not in threads
+    assert cache.hits == 1 and cache.misses == 1
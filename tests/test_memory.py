@@ -0,0 +1,49 @@
+import json
+
+from agent.gem6.memory import WorkingMemory, digest_observation, estimate_tokens
+from agent.prompt_builder import build_gem6_prompt
+
+
+def big_observation(i):
+    return {"score": 0.5 + i / 100, "decision": "ACCEPT", "evidence": ["x" * 200] * 10, "notes": "y" * 500}
+
+
+def test_digest_keeps_scalars_and_sizes():
+    digest = digest_observation(big_observation(1))
+    assert '"score": 0.51' in digest
+    assert "[10 items]" in digest
+    assert len(digest) <= 200
+
+
+def test_window_keeps_recent_steps_in_full():
+    memory = WorkingMemory(window=2, token_budget=100_000)
+    for step in range(1, 6):
+        memory.add(step, "gem2", f"thought {step}", big_observation(step), True)
+
+    rendered = memory.render()
+    assert [item["step"] for item in rendered] == [1, 2, 3, 4, 5]
+    assert all("digest" in item for item in rendered[:3])
+    assert all("observation" in item for item in rendered[3:])
+
+
+def test_token_budget_bounds_memory_growth():
+    memory = WorkingMemory(window=3, token_budget=400)
+    sizes = []
+    for step in range(1, 11):
+        memory.add(step, "gem2", "thought", big_observation(step), True)
+        sizes.append(estimate_tokens(json.dumps(memory.render())))
+
+    # Even fully digested, ten steps do not fit in 400 tokens: the oldest must be dropped
+    assert estimate_tokens(json.dumps(memory.digests)) > 400
+    assert max(sizes) <= 400
+    rendered = memory.render()
+    assert rendered[-1]["step"] == 10
+    assert "omitted_steps" in rendered[0]
+    assert rendered[0]["omitted_steps"] > 0
+    assert rendered[0]["omitted_steps"] + len(rendered) - 1 == 10
+
+
+def test_gem6_prompt_includes_context():
+    prompt = build_gem6_prompt("S-1", "CAND-1", {"working_memory": [{"step": 1, "agent": "gem2"}]})
+    assert "### CONTEXTO ACTUAL:" in prompt
+    assert '"agent": "gem2"' in prompt
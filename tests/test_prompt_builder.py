@@ -0,0 +1,58 @@
+import os
+
+from agent.prompt_builder import TemplateRegistry, build_agent_prompt, build_prompt
+
+
+def write(path, text, bump=0):
+    path.write_text(text, encoding="utf-8")
+    if bump:
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + bump))
+
+
+def make_registry(tmp_path):
+    write(tmp_path / "00_prompt_maestro.md", "MAESTRO {{VERSION}}")
+    write(tmp_path / "gemx.md", "{{PROMPT_MAESTRO}}\nID={{search_id}}\nDATA={{input}}\nEND")
+    return TemplateRegistry(str(tmp_path))
+
+
+def test_template_is_compiled_once_and_renders_in_one_pass(tmp_path):
+    registry = make_registry(tmp_path)
+    template = registry.get("gemx")
+
+    assert registry.get("gemx") is template
+    assert template.required_variables == {"search_id", "input"}
+    rendered = template.render({"search_id": "S-1", "input": {"a": 1}})
+    assert rendered == 'MAESTRO {{VERSION}}\nID=S-1\nDATA={\n  "a": 1\n}\nEND'
+
+
+def test_missing_variables_are_reported_once(tmp_path, capsys):
+    template = make_registry(tmp_path).get("gemx")
+
+    first = template.render({"search_id": "S-1"})
+    template.render({"search_id": "S-2"})
+
+    assert "{{input}}" in first
+    assert capsys.readouterr().out.count("['input']") == 1
+
+
+def test_templates_reload_when_file_or_maestro_changes(tmp_path):
+    registry = make_registry(tmp_path)
+    original = registry.get("gemx")
+
+    write(tmp_path / "gemx.md", "v2 {{search_id}}", bump=10**9)
+    updated = registry.get("gemx")
+    assert updated is not original
+    assert updated.render({"search_id": "S"}) == "v2 S"
+
+    write(tmp_path / "gemx.md", "{{PROMPT_MAESTRO}}", bump=2 * 10**9)
+    registry.get("gemx")
+    write(tmp_path / "00_prompt_maestro.md", "NEW MAESTRO", bump=10**9)
+    assert registry.get("gemx").render({}) == "NEW MAESTRO"
+
+
+def test_real_prompts_build():
+    prompt = build_prompt("gem6", {"search_id": "S"})
+    assert "GEM 6" in prompt
+    agent_prompt = build_agent_prompt("gem2", {"candidate": "CAND-001"})
+    assert agent_prompt.endswith('"candidate": "CAND-001"\n}')
@@ -0,0 +1,162 @@
+import json
+from types import SimpleNamespace
+
+import httpx
+
+from agent.gem6.orchestrator import GEM6Orchestrator
+from agent.gemini_client import GeminiClient
+from agent.prompt_builder import build_gem6_prompt_parts
+from tests.test_fingerprint import FakeDB
+
+JD_MARKER = "JD-UNIQUE-MARKER"
+
+
+class FakeOllama:
+    """Local /api/generate stand-in that honours prefix priming via `context`."""
+
+    def __init__(self):
+        self.bodies = []
+
+    def __call__(self, request):
+        body = json.loads(request.content)
+        self.bodies.append(body)
+        if body["options"]["num_predict"] == 0:
+            return httpx.Response(200, json={"response": "", "context": [1, 2, 3]})
+        prompt = body["prompt"]
+        if "### DATA INPUT" in prompt:
+            answer = {"score": 0.9}
+        elif '"working_memory": []' in prompt:
+            answer = {"thought": "score", "action": "call_agent", "agent_id": "gem2", "payload": {}}
+        else:
+            answer = {"thought": "done", "action": "finalize", "status": "SUCCESS"}
+        return httpx.Response(200, json={"response": json.dumps(answer)})
+
+
+def test_gem6_prompt_splits_search_inputs_into_static_prefix():
+    context = {"search_inputs": {"jd_text": JD_MARKER}, "candidate_data": {"cv_text": "cv"}}
+    parts = build_gem6_prompt_parts("S-1", "CAND-1", context)
+    assert JD_MARKER in parts.static
+    assert "cv_text" not in parts.static
+    assert "cv_text" in parts.dynamic and JD_MARKER not in parts.dynamic
+    other = build_gem6_prompt_parts("S-1", "CAND-2", {**context, "candidate_data": {}})
+    assert other.static == parts.static
+
+
+async def test_ollama_prefix_is_sent_once_per_search(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    fake = FakeOllama()
+    real_async_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        httpx, "AsyncClient",
+        lambda *a, **kw: real_async_client(*a, transport=httpx.MockTransport(fake), **kw),
+    )
+    gemini = GeminiClient(api_key="dummy", use_cache=False)
+    gemini.provider = "ollama"
+    orch = GEM6Orchestrator(gemini=gemini, search_id="S-1", output_dir=str(tmp_path), db_client=FakeDB(), concurrency=3)
+
+    candidates = {f"CAND-{i}": {"cv_text": f"cv {i}"} for i in range(3)}
+    results = await orch.run_pipeline({"jd_text": JD_MARKER}, candidates)
+    await gemini.aclose()
+
+    assert all(r["status"] == "SUCCESS" for r in results.values())
+    # 3 candidates x (2 GEM6 steps + 1 agent call) + 2 prefix primings (GEM6, GEM2)
+    assert len(fake.bodies) == 11
+    assert gemini.prefix_uploads == 2
+    assert sum(JD_MARKER in b["prompt"] for b in fake.bodies) == 1
+    generations = [b for b in fake.bodies if b["options"]["num_predict"] != 0]
+    assert all(b["context"] == [1, 2, 3] for b in generations)
+    assert all(b["keep_alive"] for b in fake.bodies)
+
+
+async def test_gemini_prefix_uses_cached_content(monkeypatch):
+    monkeypatch.setattr("config.GEMINI_CONTEXT_CACHE_MIN_TOKENS", 0)
+    created, deleted, configs = [], [], []
+
+    async def create(model, config):
+        created.append(config)
+        return SimpleNamespace(name=f"cachedContents/{len(created)}")
+
+    async def delete(name):
+        deleted.append(name)
+
+    async def generate_content(model, contents, config):
+        configs.append(config)
+        return SimpleNamespace(text='{"ok": true}', usage_metadata=None, candidates=None)
+
+    gemini = GeminiClient(api_key="dummy", use_cache=False)
+    gemini.provider = "gemini"
+    gemini.client = SimpleNamespace(aio=SimpleNamespace(
+        caches=SimpleNamespace(create=create, delete=delete),
+        models=SimpleNamespace(generate_content=generate_content),
+    ))
+
+    for i in range(3):
+        result = await gemini.arun_gem(f"candidate {i}", gem_name="gem6", static_prefix="SYSTEM PREFIX")
+        assert result["json"] == {"ok": True}
+    await gemini.aclose()
+
+    assert len(created) == 1 and created[0]["system_instruction"] == "SYSTEM PREFIX"
+    assert all(c["cached_content"] == "cachedContents/1" for c in configs)
+    assert deleted == ["cachedContents/1"]
+
+
+def fake_gemini_sdk(created, configs, fail_with=None):
+    async def create(model, config):
+        created.append(config)
+        return SimpleNamespace(name=f"cachedContents/{len(created)}")
+
+    async def delete(name):
+        pass
+
+    async def generate_content(model, contents, config):
+        configs.append(dict(config))
+        if fail_with and fail_with(config):
+            raise RuntimeError("404 CachedContent not found")
+        return SimpleNamespace(text='{"ok": true}', usage_metadata=None, candidates=None)
+
+    return SimpleNamespace(aio=SimpleNamespace(
+        caches=SimpleNamespace(create=create, delete=delete),
+        models=SimpleNamespace(generate_content=generate_content),
+    ))
+
+
+async def test_gemini_cached_content_is_recreated_before_ttl(monkeypatch):
+    import agent.gemini_client as gemini_client
+
+    monkeypatch.setattr("config.GEMINI_CONTEXT_CACHE_MIN_TOKENS", 0)
+    monkeypatch.setattr("config.GEMINI_CONTEXT_CACHE_TTL_SECONDS", 600)
+    monkeypatch.setattr("config.GEMINI_CONTEXT_CACHE_REFRESH_SECONDS", 60)
+    clock = [1000.0]
+    monkeypatch.setattr(gemini_client, "time", SimpleNamespace(monotonic=lambda: clock[0]))
+    created, configs = [], []
+
+    gemini = GeminiClient(api_key="dummy", use_cache=False)
+    gemini.provider = "gemini"
+    gemini.client = fake_gemini_sdk(created, configs)
+
+    await gemini.arun_gem("a", gem_name="gem6", static_prefix="SYSTEM PREFIX")
+    clock[0] += 500
+    await gemini.arun_gem("b", gem_name="gem6", static_prefix="SYSTEM PREFIX")
+    # Inside the refresh margin (60s before the 600s TTL)
+    clock[0] += 50
+    await gemini.arun_gem("c", gem_name="gem6", static_prefix="SYSTEM PREFIX")
+
+    assert len(created) == 2
+    assert [c["cached_content"] for c in configs] == ["cachedContents/1", "cachedContents/1", "cachedContents/2"]
+
+
+async def test_gemini_failed_cached_content_call_reuploads_prefix(monkeypatch):
+    monkeypatch.setattr("config.GEMINI_CONTEXT_CACHE_MIN_TOKENS", 0)
+    created, configs = [], []
+
+    gemini = GeminiClient(api_key="dummy", use_cache=False)
+    gemini.provider = "gemini"
+    gemini._retry_wait = lambda *args: 0
+    # The first cached content is gone server-side
+    gemini.client = fake_gemini_sdk(created, configs,
+                                    fail_with=lambda config: config.get("cached_content") == "cachedContents/1")
+
+    result = await gemini.arun_gem("a", gem_name="gem6", static_prefix="SYSTEM PREFIX", max_retries=1)
+
+    assert result["json"] == {"ok": True}
+    assert [c["cached_content"] for c in configs] == ["cachedContents/1", "cachedContents/2"]
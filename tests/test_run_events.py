@@ -0,0 +1,71 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+
+import api
+from utils.ws_logger import broadcast_log, pipeline_state
+
+
+class FakeRequest:
+    def __init__(self, headers, polls):
+        self.headers = headers
+        self.polls = polls
+
+    async def is_disconnected(self):
+        self.polls -= 1
+        return self.polls < 0
+
+
+def test_long_poll_resumes_from_cursor():
+    with TestClient(api.app) as client:
+        for step in range(3):
+            client.portal.call(broadcast_log, {"search_id": "S1", "step": step})
+
+        first = client.get("/api/v1/runs/S1/events", params={"after": 0, "limit": 2}).json()
+        rest = client.get("/api/v1/runs/S1/events", params={"after": first["last_seq"]}).json()
+        empty = client.get("/api/v1/runs/S1/events", params={"after": rest["last_seq"], "timeout": 0.05}).json()
+
+    assert [e["step"] for e in first["events"]] == [0, 1]
+    assert [e["seq"] for e in rest["events"]] == [3]
+    assert empty == {"search_id": "S1", "events": [], "last_seq": 3}
+
+
+async def test_sse_replays_from_last_event_id_then_tails():
+    for step in range(3):
+        await broadcast_log({"search_id": "S1", "step": step})
+
+    request = FakeRequest({"accept": "text/event-stream", "last-event-id": "1"}, polls=2)
+    response = await api.run_events("S1", request, after=0)
+    chunks = response.body_iterator
+
+    replay = await chunks.__anext__()
+    assert [json.loads(line[6:])["seq"] for line in replay.splitlines() if line.startswith("data: ")] == [2, 3]
+    assert "id: 3\nevent: log\n" in replay
+
+    live = asyncio.ensure_future(chunks.__anext__())
+    await asyncio.sleep(0.01)
+    await broadcast_log({"search_id": "S1", "step": 3})
+    assert (await asyncio.wait_for(live, 1)).startswith("id: 4\n")
+    assert pipeline_state.steps("S1")[-1]["seq"] == 4
+    await chunks.aclose()
+
+
+async def test_unknown_searches_are_answered_without_growing_the_store():
+    events = await pipeline_state.wait_events("NOPE", after=0, timeout=0.01)
+
+    assert events == []
+    assert "NOPE" not in pipeline_state._steps and "NOPE" not in pipeline_state._seq
+    assert "NOPE" not in pipeline_state._waiters and "NOPE" not in pipeline_state._waiting
+
+
+async def test_events_of_evicted_search_are_read_from_disk(monkeypatch):
+    for step in range(3):
+        await broadcast_log({"search_id": "S1", "step": step})
+    await pipeline_state.flush()
+    monkeypatch.setattr(pipeline_state, "idle_seconds", 0)
+    pipeline_state._evict()
+    assert "S1" not in pipeline_state._steps
+
+    assert [e["seq"] for e in await pipeline_state.events("S1", after=1)] == [2, 3]
+    assert "S1" not in pipeline_state._steps
@@ -0,0 +1,65 @@
+import json
+
+from utils.run_monitor import EventTail, RunMonitor, RunStats
+
+
+def event(seq, gem, status, second, entity_id="E1", step=1, **extra):
+    return {"seq": seq, "search_id": "S1", "gem": gem, "status": status, "entity_id": entity_id,
+            "step": step, "timestamp": f"2026-01-01T00:00:{second:02d}", **extra}
+
+
+def append(path, *events, raw=""):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(e) + "\n" for e in events) + raw)
+
+
+def test_tail_reads_only_appended_lines(tmp_path):
+    path = tmp_path / "events.ndjson"
+    tail = EventTail(str(path))
+    assert tail.poll() == []
+
+    append(path, event(1, "GEM1", "OK", 1), raw='{"seq": 2, "gem"')
+    assert [e["seq"] for e in tail.poll()] == [1]
+    offset = tail.offset
+    assert tail.poll() == []
+    assert tail.offset == offset
+
+    append(path, raw=': "GEM2"}\n')
+    assert tail.poll() == [{"seq": 2, "gem": "GEM2"}]
+
+    path.write_text(json.dumps(event(1, "GEM1", "OK", 1)) + "\n")
+    assert [e["seq"] for e in tail.poll()] == [1]
+    assert tail.resets == 1
+
+
+def test_stats_are_incremental():
+    stats = RunStats()
+    for e in (
+        event(1, "GEM6", "STREAMING", 0),
+        event(2, "GEM2", "STREAMING", 2),
+        event(3, "GEM2", "STREAMING", 3),
+        event(4, "GEM2", "OK", 6),
+        event(5, "GEM3", "BLOCKED", 10, step=2),
+        event(6, "GEM2", "OK", 4, entity_id="E2"),
+        event(7, "GEM6_FINAL", "SUCCESS", 12),
+    ):
+        stats.apply(e)
+
+    assert stats.gem_rows() == [
+        {"gem": "GEM2", "ok": 2, "blocked": 0, "avg_latency_s": 4.0},
+        {"gem": "GEM3", "ok": 0, "blocked": 1, "avg_latency_s": 4.0},
+    ]
+    assert stats.totals() == {"ok": 2, "blocked": 1, "in_flight": 1, "finished": 1}
+    assert stats.last_seq == 7
+
+
+def test_monitor_returns_new_events_and_resets_with_the_file(tmp_path):
+    path = tmp_path / "events.ndjson"
+    monitor = RunMonitor(str(path))
+    append(path, event(1, "GEM1", "OK", 1), event(2, "GEM2", "BLOCKED", 2))
+    assert len(monitor.refresh()) == 2
+    assert monitor.refresh() == []
+
+    path.write_text(json.dumps(event(1, "GEM1", "OK", 1)) + "\n")
+    monitor.refresh()
+    assert monitor.stats.totals()["blocked"] == 0
@@ -0,0 +1,138 @@
+import importlib.util
+import os
+import re
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from infra.db.storage import (
+    DELETE_ENTITY_SQL, INSERT_DISCARD_SQL, UPSERT_ENTITY_SQL, SQLiteStorage,
+    discard_params, entity_params, load_schema,
+)
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(__file__)), "scripts", "sheets_dump.py")
+spec = importlib.util.spec_from_file_location("sheets_dump", SCRIPT)
+sheets_dump = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(sheets_dump)
+
+
+class FakeSheets:
+    """In-memory stand-in for the Sheets v4 `spreadsheets().values()` resource."""
+
+    def __init__(self):
+        self.cells = {}
+        self.calls = []
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def _request(self, method, result_fn):
+        self.calls.append(method)
+        return type("Request", (), {"execute": lambda _: result_fn()})()
+
+    def _write(self, a1, values):
+        row = int(re.match(r".+!A(\d+)$", a1).group(1))
+        for r, line in enumerate(values):
+            for c, value in enumerate(line):
+                self.cells[(row + r, c)] = value
+        return sum(len(line) for line in values)
+
+    def clear(self, spreadsheetId, range):
+        return self._request("clear", lambda: self.cells.clear() or {})
+
+    def update(self, spreadsheetId, range, valueInputOption, body):
+        return self._request("update", lambda: {"updatedCells": self._write(range, body["values"])})
+
+    def batchUpdate(self, spreadsheetId, body):
+        return self._request("batchUpdate", lambda: {
+            "totalUpdatedCells": sum(self._write(d["range"], d["values"]) for d in body["data"])
+        })
+
+    def rows(self):
+        last = max((r for r, _ in self.cells), default=0)
+        return [[self.cells.get((r, c)) for c in range(len(sheets_dump.COLUMNS))] for r in range(1, last + 1)]
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "gem_v3.sqlite"))
+    conn.executescript(load_schema("sqlite"))
+    yield conn
+    conn.close()
+
+
+def upsert(conn, entity_id, now, **overrides):
+    row = {"entity_id": entity_id, "current_stage": "GEM2", "state": "PROCESSING",
+           "agent_responsible": "GEM6", "trace_id": "T1", **overrides}
+    conn.execute(UPSERT_ENTITY_SQL, SQLiteStorage._params(entity_params(row, now)))
+    conn.commit()
+
+
+def discard(conn, entity_id):
+    conn.execute(INSERT_DISCARD_SQL, discard_params({
+        "entity_id": entity_id, "stage_at_discard": "GEM2", "reason": "LOW_SCORE",
+        "agent_responsible": "GEM6", "trace_id": "T1",
+    }))
+    conn.execute(DELETE_ENTITY_SQL, (entity_id,))
+    conn.commit()
+
+
+def test_incremental_sync_sends_only_changed_rows(conn, tmp_path):
+    state_path = str(tmp_path / "sheets_state.json")
+    sheets, t0 = FakeSheets(), datetime(2026, 1, 1)
+    for i in range(3):
+        upsert(conn, f"E{i}", t0)
+
+    sheets_dump.sync(sheets, conn, "SHEET", state_path=state_path)
+    assert sheets.calls == ["clear", "update"]
+    assert [row[0] for row in sheets.rows()] == ["entity_id", "E0", "E1", "E2"]
+
+    upsert(conn, "E1", t0 + timedelta(minutes=1), current_stage="GEM3")
+    upsert(conn, "E3", t0 + timedelta(minutes=1))
+    discard(conn, "E2")
+    sheets.calls.clear()
+    cells_before = dict(sheets.cells)
+
+    sheets_dump.sync(sheets, conn, "SHEET", state_path=state_path)
+
+    assert sheets.calls == ["batchUpdate"]
+    rows = sheets.rows()
+    assert rows[2][:3] == ["E1", "GEM3", "PROCESSING"]
+    assert rows[3][:3] == ["E2", "GEM2", "DISCARDED"]
+    assert rows[4][0] == "E3"
+    # Unchanged rows are never rewritten
+    assert rows[1] == [cells_before[(2, c)] for c in range(len(sheets_dump.COLUMNS))]
+
+    sheets.calls.clear()
+    sheets_dump.sync(sheets, conn, "SHEET", state_path=state_path)
+    assert sheets.rows() == rows
+
+
+def test_layout_change_falls_back_to_full_rewrite(conn, tmp_path, monkeypatch):
+    state_path = str(tmp_path / "sheets_state.json")
+    sheets = FakeSheets()
+    upsert(conn, "E1", datetime(2026, 1, 1))
+    sheets_dump.sync(sheets, conn, "SHEET", state_path=state_path)
+
+    monkeypatch.setattr(sheets_dump, "COLUMNS", sheets_dump.COLUMNS + ["extra"])
+    sheets.calls.clear()
+    sheets_dump.sync(sheets, conn, "SHEET", state_path=state_path)
+    assert sheets.calls == ["clear", "update"]
+
+    sheets.calls.clear()
+    sheets_dump.sync(sheets, conn, "SHEET", sheet="Other", state_path=state_path)
+    assert sheets.calls == ["clear", "update"]
+
+
+def test_row_ranges_merges_consecutive_rows():
+    data = sheets_dump.row_ranges("Dashboard", {5: ["b"], 2: ["a"], 4: ["c"], 9: ["d"]})
+
+    assert data == [
+        {"range": "Dashboard!A2", "values": [["a"]]},
+        {"range": "Dashboard!A4", "values": [["c"], ["b"]]},
+        {"range": "Dashboard!A9", "values": [["d"]]},
+    ]
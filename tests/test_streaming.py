@@ -0,0 +1,117 @@
+import asyncio
+import json
+
+import httpx
+
+from agent.gem6.orchestrator import GEM6Orchestrator
+from agent.gemini_client import GeminiClient
+from agent.json_extract import JsonStreamDetector
+from tests.test_fingerprint import FakeDB
+from utils.ws_logger import broadcaster, pipeline_state
+
+
+def test_detector_finds_first_object_across_chunks():
+    detector = JsonStreamDetector()
+    pieces = ['Intro {no es json} ```json\n{"a": "}{", ', '"b": [1, {"c": 2}]', '}\n```\n## Markdown {x}']
+    results = [detector.feed(p) for p in pieces]
+
+    assert results == [False, False, True]
+    assert detector.value == {"a": "}{", "b": [1, {"c": 2}]}
+    assert detector.text()[:detector.end].endswith('{"c": 2}]}')
+
+
+def test_detector_handles_escaped_quotes():
+    detector = JsonStreamDetector()
+    assert detector.feed('{"q": "dice \\"}\\" ok"}')
+    assert detector.value == {"q": 'dice "}" ok'}
+
+
+def ndjson(tokens, done=True):
+    lines = [json.dumps({"response": t, "done": False}) for t in tokens]
+    if done:
+        lines.append(json.dumps({"response": "", "done": True, "prompt_eval_count": 7, "eval_count": len(tokens)}))
+    return ("\n".join(lines) + "\n").encode()
+
+
+def streaming_client(monkeypatch, body):
+    requests = []
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        return httpx.Response(200, content=body)
+
+    real_async_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        httpx, "AsyncClient",
+        lambda *a, **kw: real_async_client(*a, transport=httpx.MockTransport(handler), **kw),
+    )
+    client = GeminiClient(api_key="dummy", use_cache=False, stream=True)
+    client.provider = "ollama"
+    return client, requests
+
+
+async def test_ollama_stream_stops_after_json(monkeypatch):
+    tokens = ['{"action": ', '"finalize"', '}', "\n\n## Resumen", " largo", " que no usamos"]
+    client, requests = streaming_client(monkeypatch, ndjson(tokens))
+
+    result = await client.arun_gem("prompt", gem_name="gem6", stop_after_json=True)
+
+    assert requests[0]["stream"] is True
+    assert result["json"] == {"action": "finalize"}
+    assert result["raw"] == '{"action": "finalize"}'
+    assert result["usage"]["finish_reason"] == "EARLY_STOP"
+    assert result["usage"]["candidates_tokens"] == 3
+    await client.aclose()
+
+
+async def test_ollama_stream_without_early_stop_keeps_markdown(monkeypatch):
+    tokens = ['{"ok": true}', "\n## Markdown"]
+    client, _ = streaming_client(monkeypatch, ndjson(tokens))
+    progress = []
+
+    async def on_progress(update):
+        progress.append(update)
+
+    monkeypatch.setattr("config.LLM_STREAM_PROGRESS_INTERVAL", 0)
+    result = await client.arun_gem("prompt", on_progress=on_progress)
+
+    assert result["json"] == {"ok": True}
+    assert "## Markdown" in result["markdown"]
+    assert result["usage"]["finish_reason"] == "STOP"
+    assert result["usage"]["prompt_tokens"] == 7
+    assert progress and progress[-1]["json_complete"] is True
+    await client.aclose()
+
+
+class StreamingGemini:
+    provider = "ollama"
+    model = "fake"
+
+    async def arun_gem(self, prompt, gem_name=None, on_progress=None, **kwargs):
+        for chars in (10, 20):
+            await on_progress({"chars": chars, "json_complete": False})
+        return {"json": {"action": "finalize", "status": "SUCCESS", "final_output": {}}}
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+async def test_streaming_progress_reaches_live_clients_but_not_the_event_log(tmp_path):
+    socket = RecordingSocket()
+    subscriber = broadcaster.subscribe(socket, search_id="S-STREAM")
+    orch = GEM6Orchestrator(gemini=StreamingGemini(), search_id="S-STREAM", output_dir=str(tmp_path),
+                            db_client=FakeDB(), force=True)
+
+    await orch.run_pipeline({"jd_text": "jd"}, {"CAND-1": {"cv_text": "cv"}})
+    await asyncio.sleep(0.01)
+    await broadcaster.unsubscribe(subscriber)
+
+    assert [m["status"] for m in socket.sent] == ["STREAMING", "STREAMING", "SUCCESS"]
+    assert "seq" not in socket.sent[0]
+    events = await pipeline_state.events("S-STREAM")
+    assert [(e["gem"], e["status"], e["seq"]) for e in events] == [("GEM6_FINAL", "SUCCESS", 1)]
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import os
+
+from utils import ws_logger
+from utils.ws_logger import LogBroadcaster, PipelineStateStore, broadcast_log
+
+
+async def test_concurrent_broadcasts_keep_every_step_and_flush_once(pipeline_state_dir, monkeypatch):
+    monkeypatch.setattr(ws_logger.pipeline_state, "flush_interval", 0.05)
+    flushes = ws_logger.pipeline_state.flushes
+
+    await asyncio.gather(*(broadcast_log({"search_id": "S1", "gem": "GEM2", "step": i}) for i in range(30)))
+    assert ws_logger.pipeline_state.flushes == flushes
+    await asyncio.sleep(0.2)
+
+    path = pipeline_state_dir / "S1" / "pipeline_state.json"
+    content = path.read_text(encoding="utf-8")
+    assert sorted(step["step"] for step in json.loads(content)["steps"]) == list(range(30))
+    assert "\n" not in content and ", " not in content
+    assert ws_logger.pipeline_state.flushes == flushes + 1
+    assert not os.path.exists(f"{path}.tmp")
+
+
+async def test_ring_buffer_is_per_search_and_bounded(tmp_path):
+    store = PipelineStateStore(state_dir=str(tmp_path), max_steps=3, flush_interval=60)
+    for i in range(5):
+        await store.record({"search_id": "S1", "step": i})
+    await store.record({"search_id": "S2", "step": 0})
+
+    await store.flush()
+
+    s1 = json.loads((tmp_path / "S1" / "pipeline_state.json").read_text())
+    assert [s["step"] for s in s1["steps"]] == [2, 3, 4]
+    assert store.steps("S2") == [{"search_id": "S2", "step": 0, "seq": 1}]
+
+    # A new process picks up where the file left off
+    reloaded = PipelineStateStore(state_dir=str(tmp_path), max_steps=3, flush_interval=60)
+    await reloaded.record({"search_id": "S1", "step": 5})
+    assert [s["step"] for s in reloaded.steps("S1")] == [3, 4, 5]
+
+
+def test_search_ids_cannot_escape_the_state_dir(tmp_path):
+    store = PipelineStateStore(state_dir=str(tmp_path))
+
+    assert store.path_for("../../etc") == os.path.join(str(tmp_path), ".._.._etc", "pipeline_state.json")
+
+
+class FakeSocket:
+    def __init__(self, blocked=False):
+        self.sent = []
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    async def send_text(self, text):
+        await self.unblocked.wait()
+        self.sent.append(text)
+
+
+async def test_slow_client_never_blocks_the_broadcast():
+    broadcaster = LogBroadcaster(max_queue=3)
+    slow, fast = FakeSocket(blocked=True), FakeSocket()
+    slow_sub = broadcaster.subscribe(slow)
+    broadcaster.subscribe(fast)
+
+    for i in range(6):
+        broadcaster.publish({"step": i})
+        await asyncio.sleep(0)
+
+    assert [json.loads(t)["step"] for t in fast.sent] == list(range(6))
+    # The slow client is stuck sending step 0; its queue kept only the newest three
+    slow.unblocked.set()
+    await asyncio.sleep(0.01)
+    assert [json.loads(t)["step"] for t in slow.sent] == [0, 3, 4, 5]
+    assert slow_sub.dropped == 2
+    # Encoded once per broadcast, shared by every subscriber
+    assert slow.sent[-1] is fast.sent[-1]
+
+
+async def test_subscribers_filter_by_search_and_entity():
+    broadcaster = LogBroadcaster()
+    by_search, by_entity = FakeSocket(), FakeSocket()
+    broadcaster.subscribe(by_search, search_id="S1")
+    broadcaster.subscribe(by_entity, search_id="S1", entity_id="E2")
+
+    assert broadcaster.publish({"search_id": "S1", "entity_id": "E1"}) == 1
+    assert broadcaster.publish({"search_id": "S1", "entity_id": "E2"}) == 2
+    assert broadcaster.publish({"search_id": "S2", "entity_id": "E2"}) == 0
+    await asyncio.sleep(0)
+
+    assert len(by_search.sent) == 2
+    assert [json.loads(t)["entity_id"] for t in by_entity.sent] == ["E2"]
+
+
+async def test_failed_sends_and_unsubscribe_remove_the_subscriber():
+    class BrokenSocket:
+        async def send_text(self, text):
+            raise RuntimeError("closed")
+
+    broadcaster = LogBroadcaster()
+    broadcaster.subscribe(BrokenSocket())
+    kept = broadcaster.subscribe(FakeSocket())
+    broadcaster.publish({"step": 1})
+    await asyncio.sleep(0)
+
+    assert broadcaster.subscribers == [kept]
+    await broadcaster.unsubscribe(kept)
+    assert broadcaster.subscribers == []
+    assert kept._task.cancelled()
+
+
+async def test_event_log_replays_old_cursors_from_disk(tmp_path):
+    store = PipelineStateStore(state_dir=str(tmp_path), max_steps=2, max_events=3, flush_interval=60)
+    for i in range(1, 8):
+        assert (await store.record({"search_id": "S1", "step": i}))["seq"] == i
+
+    assert [e["seq"] for e in await store.events("S1", after=5)] == [6, 7]
+    # seq 2..4 already left memory: read from events.ndjson
+    assert [e["seq"] for e in await store.events("S1", after=1, limit=4)] == [2, 3, 4, 5]
+    assert await store.events("S1", after=7) == []
+
+    # The sequence continues in a new process
+    reloaded = PipelineStateStore(state_dir=str(tmp_path), max_steps=2, max_events=3, flush_interval=60)
+    assert (await reloaded.record({"search_id": "S1", "step": 8}))["seq"] == 8
+
+
+async def test_wait_events_wakes_on_new_event(tmp_path):
+    store = PipelineStateStore(state_dir=str(tmp_path), flush_interval=60)
+    await store.record({"search_id": "S1", "step": 1})
+
+    waiting = asyncio.create_task(store.wait_events("S1", after=1, timeout=5))
+    await asyncio.sleep(0.01)
+    await store.record({"search_id": "S1", "step": 2})
+
+    assert [e["step"] for e in await asyncio.wait_for(waiting, 1)] == [2]
+    assert await store.wait_events("S1", after=2, timeout=0.01) == []
+
+
+async def test_idle_and_excess_searches_are_evicted_and_reloaded(tmp_path):
+    store = PipelineStateStore(state_dir=str(tmp_path), max_searches=2, flush_interval=60)
+    for search_id in ("S1", "S2", "S3"):
+        await store.record({"search_id": search_id, "step": 1})
+    # S1 still has unwritten events
+    assert set(store._steps) == {"S1", "S2", "S3"}
+
+    await store.flush()
+    assert set(store._steps) == {"S2", "S3"}
+
+    # Its next event continues the sequence from events.ndjson
+    assert (await store.record({"search_id": "S1", "step": 2}))["seq"] == 2
+    assert set(store._steps) == {"S3", "S1"}
+
+    store.idle_seconds = 0
+    await store.flush()
+    assert store._steps == {} and store._seq == {}
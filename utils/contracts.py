@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+CONTRACTS_DIR = os.path.join(os.path.dirname(__file__), "..", "contracts")
+OUTPUT_SUFFIX = "_output.schema.json"
+
+# A compiled check receives (value, path, violations) and appends every problem it finds
+Check = Callable[[Any, str, List[str]], None]
+
+TYPE_CHECKS: Dict[str, Callable[[Any], bool]] = {
+    "string": lambda v: isinstance(v, str),
+    # bool is an int subclass; a flag is never a valid score
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "array": lambda v: isinstance(v, list),
+    "object": lambda v: isinstance(v, dict),
+    "null": lambda v: v is None,
+    "any": lambda v: True,
+}
+
+
+def _type_name(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, list):
+        return "array"
+    if isinstance(value, dict):
+        return "object"
+    return type(value).__name__
+
+
+def compile_spec(spec: Any) -> Check:
+    """
+    Compiles a contract spec into a check function.
+
+    Specs follow the flat format used in contracts/: a type name ("string", "number",
+    "array", ...), a dict of key -> spec for nested objects (`{}` = any object) or a
+    one-element list `[spec]` for arrays whose items must match `spec`.
+    """
+    if isinstance(spec, str):
+        if spec not in TYPE_CHECKS:
+            raise ValueError(f"Unknown contract type: {spec!r}")
+        type_check = TYPE_CHECKS[spec]
+
+        def check_type(value, path, violations):
+            if not type_check(value):
+                violations.append(f"{path}: expected {spec}, got {_type_name(value)}")
+        return check_type
+
+    if isinstance(spec, dict):
+        fields: List[Tuple[str, Check]] = [(key, compile_spec(sub)) for key, sub in spec.items()]
+
+        def check_object(value, path, violations):
+            if not isinstance(value, dict):
+                violations.append(f"{path}: expected object, got {_type_name(value)}")
+                return
+            for key, check in fields:
+                child = f"{path}.{key}" if path else key
+                if key not in value:
+                    violations.append(f"{child}: missing")
+                else:
+                    check(value[key], child, violations)
+        return check_object
+
+    if isinstance(spec, list) and len(spec) == 1:
+        item_check = compile_spec(spec[0])
+
+        def check_array(value, path, violations):
+            if not isinstance(value, list):
+                violations.append(f"{path}: expected array, got {_type_name(value)}")
+                return
+            for i, item in enumerate(value):
+                item_check(item, f"{path}[{i}]", violations)
+        return check_array
+
+    raise ValueError(f"Invalid contract spec: {spec!r}")
+
+
+class Contract:
+    """A contract file compiled once into a validator."""
+
+    def __init__(self, name: str, spec: Dict[str, Any], path: Optional[str] = None):
+        if not isinstance(spec, dict):
+            raise ValueError(f"Contract {name} must be a JSON object")
+        self.name = name
+        self.path = path
+        self.spec = spec
+        self._check = compile_spec(spec)
+
+    @classmethod
+    def from_file(cls, path: str, name: Optional[str] = None) -> "Contract":
+        with open(path, "r") as f:
+            spec = json.load(f)
+        return cls(name or os.path.basename(path), spec, path)
+
+    def validate(self, data: Any) -> List[str]:
+        """Returns every violation found (empty list when the data is valid)."""
+        violations: List[str] = []
+        self._check(data, "", violations)
+        return violations
+
+    def is_valid(self, data: Any) -> bool:
+        return not self.validate(data)
+
+
+class ContractRegistry:
+    """Loads and compiles every `<agent>_output.schema.json` once, on first use."""
+
+    def __init__(self, contracts_dir: str = CONTRACTS_DIR):
+        self.contracts_dir = contracts_dir
+        self._contracts: Optional[Dict[str, Contract]] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Contract]:
+        if self._contracts is None:
+            with self._lock:
+                if self._contracts is None:
+                    contracts = {}
+                    for filename in sorted(os.listdir(self.contracts_dir)):
+                        if filename.endswith(OUTPUT_SUFFIX):
+                            agent_id = filename[:-len(OUTPUT_SUFFIX)]
+                            contracts[agent_id] = Contract.from_file(
+                                os.path.join(self.contracts_dir, filename), agent_id
+                            )
+                    self._contracts = contracts
+        return self._contracts
+
+    def reload(self) -> Dict[str, Contract]:
+        with self._lock:
+            self._contracts = None
+        return self.load()
+
+    def get(self, agent_id: str) -> Optional[Contract]:
+        return self.load().get(agent_id)
+
+    def validate(self, agent_id: str, data: Any) -> Optional[List[str]]:
+        """Violations for an agent's output, or None if the agent has no contract."""
+        contract = self.get(agent_id)
+        return None if contract is None else contract.validate(data)
+
+
+registry = ContractRegistry()
+
+# Contracts loaded by path (validate_contract), recompiled only if the file changes
+_by_path: Dict[str, Tuple[Tuple[int, int], Contract]] = {}
+_by_path_lock = threading.Lock()
+
+
+def contract_from_path(contract_path: str) -> Contract:
+    st = os.stat(contract_path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    key = os.path.abspath(contract_path)
+    cached = _by_path.get(key)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    contract = Contract.from_file(contract_path)
+    with _by_path_lock:
+        _by_path[key] = (stamp, contract)
+    return contract
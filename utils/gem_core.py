@@ -1,7 +1,12 @@
+import asyncio
 import httpx
 import json
 import logging
-from typing import Dict, Any, Optional
+import os
+from typing import Dict, Any, List, Optional
+
+import config
+from utils.contracts import contract_from_path
 
 class JsonFormatter(logging.Formatter):
     def format(self, record):
@@ -22,61 +27,293 @@ logger.addHandler(handler)
 logger.setLevel(logging.INFO)
 logger.propagate = False
 
+def is_retryable(error: Exception) -> bool:
+    """Network errors and 5xx responses are worth retrying; other errors (4xx) are not."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
 class GEMClient:
-    def __init__(self, db_url: str = "http://db-api:8000"):
+    """
+    Async client for the DB API. Holds one pooled keep-alive httpx.AsyncClient
+    for its lifetime; call `aclose()` (or use `async with`) when done.
+
+    With `write_behind=True`, upserts and execution logs are queued in memory and
+    written by a background task through the batch endpoints, either when
+    `batch_size` rows are pending or every `flush_interval` seconds. Successive
+    upserts of the same entity_id are coalesced (last write wins), producers wait
+    for a flush when `max_queue` rows are pending, and `aclose()` flushes everything.
+
+    Rows whose batch fails with a network error or a 5xx are retried `retries` times
+    with exponential backoff and then queued again (a newer upsert of the same
+    entity_id queued meanwhile wins), so an unreachable DB API makes producers wait
+    instead of losing writes. Rows the API rejects are logged and counted in `failed`.
+    """
+
+    def __init__(
+        self,
+        db_url: str = "http://db-api:8000",
+        limits: Optional[httpx.Limits] = None,
+        timeout: Optional[httpx.Timeout] = None,
+        write_behind: Optional[bool] = None,
+        max_queue: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        retries: Optional[int] = None,
+        retry_backoff: Optional[float] = None,
+    ):
         self.db_url = db_url
+        self.limits = limits or httpx.Limits(
+            max_connections=config.DB_API_MAX_CONNECTIONS,
+            max_keepalive_connections=config.DB_API_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=config.DB_API_KEEPALIVE_EXPIRY,
+        )
+        self.timeout = timeout or httpx.Timeout(config.DB_API_TIMEOUT, connect=config.DB_API_CONNECT_TIMEOUT)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
 
-    async def upsert_entity(self, data: Dict[str, Any]):
+        self.write_behind = config.DB_WRITE_BEHIND if write_behind is None else write_behind
+        self.max_queue = max_queue or config.DB_WRITE_BEHIND_MAX_QUEUE
+        self.batch_size = batch_size or config.DB_WRITE_BEHIND_BATCH_SIZE
+        self.flush_interval = config.DB_WRITE_BEHIND_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.retries = config.DB_WRITE_BEHIND_RETRIES if retries is None else retries
+        self.retry_backoff = config.DB_WRITE_BEHIND_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+        self._pending_upserts: Dict[str, Dict[str, Any]] = {}
+        self._pending_logs: List[Dict[str, Any]] = []
+        self._flusher: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._closing = False
+        self._batch_endpoints = True
+        self.queued = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.failed = 0
+        self.requeued = 0
+
+    def _http(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        # An AsyncClient's pooled connections belong to the loop that opened them
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.db_url,
+                limits=self.limits,
+                timeout=self.timeout,
+                http1=True,
+                http2=False,
+                headers={"Connection": "keep-alive"},
+            )
+            self._loop = loop
+        return self._client
+
+    async def aclose(self):
+        if self._flusher is not None:
+            if self._flusher.get_loop() is asyncio.get_running_loop():
+                # Let the flusher finish its current batch and exit, then drain the rest
+                self._closing = True
+                self._wakeup.set()
+                await self._flusher
+                if not await self.flush():
+                    logger.error(f"Write-behind: {self._pending_count()} rows could not be written before closing")
+                self._closing = False
+            self._flusher = None
+        if self._client is not None:
+            if self._loop is asyncio.get_running_loop():
+                await self._client.aclose()
+            self._client = None
+            self._loop = None
+
+    async def __aenter__(self) -> "GEMClient":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def _post(self, path: str, data: Dict[str, Any], action: str):
         try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.post(f"{self.db_url}/entity/upsert", json=data)
-                resp.raise_for_status()
-                return resp.json()
+            resp = await self._http().post(path, json=data)
+            resp.raise_for_status()
+            return resp.json()
         except Exception as e:
-            logger.error(f"Failed to upsert entity: {e}")
+            logger.error(f"Failed to {action}: {e}")
             return None
 
-    async def discard_entity(self, data: Dict[str, Any]):
-        try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.post(f"{self.db_url}/entity/discard", json=data)
+    def _pending_count(self) -> int:
+        return len(self._pending_upserts) + len(self._pending_logs)
+
+    def _ensure_flusher(self):
+        loop = asyncio.get_running_loop()
+        if self._flusher is None or self._flusher.done() or self._flusher.get_loop() is not loop:
+            self._flush_lock = asyncio.Lock()
+            self._wakeup = asyncio.Event()
+            self._flusher = loop.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush failed: {e}")
+
+    async def _reserve(self):
+        """Backpressure: when the queue is full the producer waits for a flush."""
+        self._ensure_flusher()
+        while self._pending_count() >= self.max_queue:
+            if not await self.flush():
+                await asyncio.sleep(self.retry_backoff)
+
+    def _queued(self):
+        self.queued += 1
+        if self._pending_count() >= self.batch_size:
+            self._wakeup.set()
+        return {"status": "queued"}
+
+    async def flush(self) -> bool:
+        """
+        Writes every queued upsert and log now. Returns False if some rows could not be
+        written (network/5xx after the retries); those stay queued for the next flush.
+        """
+        if self._flush_lock is None:
+            return True
+        async with self._flush_lock:
+            upserts = list(self._pending_upserts.values())
+            logs = self._pending_logs
+            self._pending_upserts = {}
+            self._pending_logs = []
+            failed_upserts: List[Dict[str, Any]] = []
+            failed_logs: List[Dict[str, Any]] = []
+            for i in range(0, len(upserts), self.batch_size):
+                failed_upserts += await self._write_with_retry("/entity/upsert_batch", "/entity/upsert",
+                                                               upserts[i:i + self.batch_size], "upsert entities")
+            for i in range(0, len(logs), self.batch_size):
+                failed_logs += await self._write_with_retry("/log/discovery/batch", "/log/discovery",
+                                                            logs[i:i + self.batch_size], "log executions")
+            if not failed_upserts and not failed_logs:
+                return True
+            # Queue them again, keeping any newer upsert of the same entity queued meanwhile
+            for row in failed_upserts:
+                self._pending_upserts.setdefault(row["entity_id"], row)
+            self._pending_logs[:0] = failed_logs
+            self.requeued += len(failed_upserts) + len(failed_logs)
+            logger.error(f"Write-behind: {len(failed_upserts) + len(failed_logs)} rows not written; queued again")
+            return False
+
+    async def _write_with_retry(self, batch_path: str, single_path: str, rows: List[Dict[str, Any]],
+                                action: str) -> List[Dict[str, Any]]:
+        """Writes `rows`, retrying retryable failures. Returns the rows still not written."""
+        for attempt in range(self.retries + 1):
+            rows = await self._write_batch(batch_path, single_path, rows, action)
+            if not rows:
+                return rows
+            if attempt < self.retries:
+                await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+        return rows
+
+    async def _write_batch(self, batch_path: str, single_path: str, rows: List[Dict[str, Any]],
+                           action: str) -> List[Dict[str, Any]]:
+        """One write attempt. Returns the rows that failed with a retryable error."""
+        if self._batch_endpoints:
+            try:
+                resp = await self._http().post(batch_path, json=rows)
+                if resp.status_code in (404, 405):
+                    # Older DB API without batch endpoints: fall back to one request per row
+                    logger.warning(f"DB API has no {batch_path}; writing rows one by one")
+                    self._batch_endpoints = False
+                else:
+                    resp.raise_for_status()
+                    result = resp.json()
+                    errors = result.get("errors", [])
+                    for error in errors:
+                        logger.error(f"Failed to {action} (row {error.get('index')}): {error.get('error')}")
+                    self.failed += len(errors)
+                    self.flushed += result.get("written", 0)
+                    return []
+            except Exception as e:
+                logger.error(f"Failed to {action}: {e}")
+                if is_retryable(e):
+                    return rows
+                self.failed += len(rows)
+                return []
+        retry = []
+        for row in rows:
+            try:
+                resp = await self._http().post(single_path, json=row)
                 resp.raise_for_status()
-                return resp.json()
-        except Exception as e:
-            logger.error(f"Failed to discard entity: {e}")
-            return None
+                self.flushed += 1
+            except Exception as e:
+                logger.error(f"Failed to {action}: {e}")
+                if is_retryable(e):
+                    retry.append(row)
+                else:
+                    self.failed += 1
+        return retry
 
-    async def log_execution(self, log_data: Dict[str, Any]):
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "write_behind": self.write_behind,
+            "queued": self.queued,
+            "coalesced": self.coalesced,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "requeued": self.requeued,
+            "pending": self._pending_count(),
+        }
+
+    async def get_entity(self, entity_id: str) -> Optional[Dict[str, Any]]:
+        # Read-your-writes: a queued upsert for this entity goes out first
+        if entity_id in self._pending_upserts:
+            if not await self.flush() and entity_id in self._pending_upserts:
+                logger.warning(f"Upsert of {entity_id} is still queued; reading the last stored version")
         try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.post(f"{self.db_url}/log/discovery", json=log_data)
-                resp.raise_for_status()
-                return resp.json()
+            resp = await self._http().get(f"/entity/{entity_id}")
+            if resp.status_code == 404:
+                return None
+            resp.raise_for_status()
+            return resp.json()
         except Exception as e:
-            logger.error(f"Failed to log execution: {e}")
+            logger.error(f"Failed to fetch entity: {e}")
             return None
 
+    async def upsert_entity(self, data: Dict[str, Any]):
+        entity_id = data.get("entity_id")
+        if not self.write_behind or not entity_id:
+            return await self._post("/entity/upsert", data, "upsert entity")
+        await self._reserve()
+        if entity_id in self._pending_upserts:
+            self.coalesced += 1
+        self._pending_upserts[entity_id] = data
+        return self._queued()
+
+    async def discard_entity(self, data: Dict[str, Any]):
+        # Discards delete the entity row, so queued upserts must land before them
+        if self._pending_count() and not await self.flush():
+            # A requeued upsert would land after the discard and bring the entity back
+            self._pending_upserts.pop(data.get("entity_id"), None)
+        return await self._post("/entity/discard", data, "discard entity")
+
+    async def log_execution(self, log_data: Dict[str, Any]):
+        if not self.write_behind:
+            return await self._post("/log/discovery", log_data, "log execution")
+        await self._reserve()
+        self._pending_logs.append(log_data)
+        return self._queued()
+
 def validate_contract(data: Dict[str, Any], contract_path: str) -> bool:
+    """
+    Validates `data` against a contract file. The contract is compiled once per file
+    version (see utils.contracts) and every violation is logged, not just the first.
+    """
     try:
-        with open(contract_path, "r") as f:
-            contract = json.load(f)
-        
-        for key in contract:
-            if not isinstance(key, str):
-                continue
-            expected_type = contract[key]
-            if key not in data:
-                logger.warning(f"Contract Violation: Missing key '{key}'")
-                return False
-            # Basic type checking
-            val = data.get(key)
-            if expected_type == "array" and not isinstance(val, list): return False
-            if expected_type == "number" and not isinstance(val, (int, float)): return False
-            if expected_type == "string" and not isinstance(val, str): return False
-            if expected_type == "object" and not isinstance(val, dict): return False
-            if expected_type == "boolean" and not isinstance(val, bool): return False
-            
-        return True
+        violations = contract_from_path(contract_path).validate(data)
     except Exception as e:
         logger.error(f"Contract validation error: {e}")
         return False
+    if violations:
+        logger.warning(f"Contract Violation ({os.path.basename(contract_path)}): {'; '.join(violations)}")
+        return False
+    return True
@@ -1,3 +1,5 @@
+import hashlib
+import json
 import os
 from rich.console import Console
 
@@ -93,3 +95,19 @@ def load_local_inputs(local_dir: str) -> tuple[dict, dict]:
                 candidates[candidate_id] = candidate_inputs
 
     return search_inputs, candidates
+
+
+def fingerprint_candidate(search_inputs: dict, candidate_inputs: dict, versions: dict) -> str:
+    """
+    Calcula la huella (SHA-256) de todo lo que determina el resultado de un candidato:
+    inputs de la búsqueda, inputs del candidato y versiones de prompts/modelo.
+
+    Funciona igual con inputs de load_local_inputs o de DriveClient.discover_search_structure.
+    """
+    material = json.dumps(
+        {"search_inputs": search_inputs, "candidate_inputs": candidate_inputs, "versions": versions},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
@@ -0,0 +1,134 @@
+import json
+import os
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+FINAL_GEM = "GEM6_FINAL"
+
+
+class EventTail:
+    """
+    Incremental reader for a search's events.ndjson (written by utils.ws_logger).
+
+    poll() only stats the file while it is unchanged (same mtime and size) and
+    otherwise reads just the bytes appended since the previous poll. A line still
+    being written is kept until it is complete. If the file shrank (replaced), it
+    starts over from the beginning and `resets` increments.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+        self.resets = 0
+        self._signature: Optional[Tuple[int, int]] = None
+        self._partial = b""
+
+    def poll(self) -> List[Dict[str, Any]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return []
+        self._signature = signature
+        if stat.st_size < self.offset:
+            self.offset, self._partial = 0, b""
+            self.resets += 1
+
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        self.offset += len(data)
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        return [json.loads(line) for line in lines if line.strip()]
+
+
+class RunStats:
+    """
+    Dashboard aggregates, updated one event at a time (never by rescanning):
+    per-gem step latency and OK/BLOCKED counts, plus candidates in flight.
+
+    A step's latency runs from the first event of the same (entity, gem, step), or
+    else from the entity's previous event, to the gem's "OK"/"BLOCKED" result.
+    """
+
+    def __init__(self, recent: int = 200):
+        self.gems: Dict[str, Dict[str, float]] = {}
+        self.in_flight: set = set()
+        self.finished: Dict[str, str] = {}
+        self.last_seq = 0
+        self.recent: Deque[Dict[str, Any]] = deque(maxlen=recent)
+        self._started: Dict[tuple, datetime] = {}
+        self._last_seen: Dict[str, datetime] = {}
+
+    def apply(self, event: Dict[str, Any]):
+        self.last_seq = max(self.last_seq, event.get("seq", 0))
+        self.recent.append(event)
+        entity_id, gem, status = event.get("entity_id"), event.get("gem", "GEM"), event.get("status")
+        try:
+            at = datetime.fromisoformat(event["timestamp"])
+        except (KeyError, TypeError, ValueError):
+            at = None
+
+        if gem == FINAL_GEM:
+            self.in_flight.discard(entity_id)
+            self.finished[entity_id] = status
+            self._last_seen.pop(entity_id, None)
+            # GEM6's own streaming steps never get an OK/BLOCKED result
+            for key in [k for k in self._started if k[0] == entity_id]:
+                del self._started[key]
+            return
+        if entity_id is not None:
+            self.in_flight.add(entity_id)
+
+        key = (entity_id, gem, event.get("step"))
+        if status in ("OK", "BLOCKED"):
+            stats = self.gems.setdefault(gem, {"ok": 0, "blocked": 0, "timed": 0, "latency_s": 0.0})
+            stats["ok" if status == "OK" else "blocked"] += 1
+            started = self._started.pop(key, None) or self._last_seen.get(entity_id)
+            if at is not None and started is not None:
+                stats["timed"] += 1
+                stats["latency_s"] += (at - started).total_seconds()
+        elif at is not None:
+            self._started.setdefault(key, at)
+        if at is not None and entity_id is not None:
+            self._last_seen[entity_id] = at
+
+    def gem_rows(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "gem": gem,
+                "ok": stats["ok"],
+                "blocked": stats["blocked"],
+                "avg_latency_s": round(stats["latency_s"] / stats["timed"], 2) if stats["timed"] else None,
+            }
+            for gem, stats in sorted(self.gems.items())
+        ]
+
+    def totals(self) -> Dict[str, int]:
+        return {
+            "ok": sum(int(s["ok"]) for s in self.gems.values()),
+            "blocked": sum(int(s["blocked"]) for s in self.gems.values()),
+            "in_flight": len(self.in_flight),
+            "finished": len(self.finished),
+        }
+
+
+class RunMonitor:
+    """EventTail + RunStats for one search: refresh() returns only the new events."""
+
+    def __init__(self, path: str, recent: int = 200):
+        self.tail = EventTail(path)
+        self.stats = RunStats(recent)
+
+    def refresh(self) -> List[Dict[str, Any]]:
+        resets = self.tail.resets
+        events = self.tail.poll()
+        if self.tail.resets != resets:
+            self.stats = RunStats(self.stats.recent.maxlen)
+        for event in events:
+            self.stats.apply(event)
+        return events
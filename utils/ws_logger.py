@@ -1,48 +1,365 @@
 import asyncio
 import json
+import os
+import re
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List
+from typing import Any, Deque, Dict, List, Optional
 from fastapi import WebSocket
 
-active_connections: List[WebSocket] = []
+import config
 
-async def broadcast_log(data: dict):
+# Messages without a search_id keep using the legacy file in the working directory
+DEFAULT_STATE_FILE = "pipeline_state.json"
+
+
+class PipelineStateStore:
     """
-    Broadcasts a log message to all connected WebSocket clients.
-    Also saves the latest state to pipeline_state.json for Streamlit.
+    Per-search event log of broadcast messages. Each message gets the next sequence
+    number of its search (`seq`, starting at 1) and the last `max_events` stay in
+    memory, the source of truth for live readers.
+
+    Recording never touches the disk: it marks the search dirty and a background task
+    flushes dirty searches at most once per `flush_interval`, on a single writer
+    thread (so writes land in order). Per search it appends the new events to
+    runs/<search_id>/events.ndjson (full history, used to replay old cursors) and
+    rewrites runs/<search_id>/pipeline_state.json with the last `max_steps` for
+    Streamlit, compactly, through a temp file renamed into place.
+
+    Only recently used searches stay in memory: beyond `max_searches`, or after
+    `idle_seconds` without events, a search with nothing left to write is dropped.
+    Its next event reloads the history (and the sequence) from events.ndjson on the
+    writer thread, which also orders the read after any pending write.
     """
-    message = {
-        "timestamp": datetime.now().isoformat(),
-        **data
-    }
 
-    # Send to WebSockets
-    disconnected = []
-    for connection in active_connections:
+    def __init__(
+        self,
+        state_dir: Optional[str] = None,
+        max_steps: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        max_events: Optional[int] = None,
+        max_searches: Optional[int] = None,
+        idle_seconds: Optional[float] = None,
+    ):
+        self.state_dir = state_dir or config.PIPELINE_STATE_DIR
+        self.max_steps = max_steps or config.PIPELINE_STATE_MAX_STEPS
+        self.flush_interval = config.PIPELINE_STATE_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.max_events = max(max_events or config.PIPELINE_EVENTS_MAX, self.max_steps)
+        self.max_searches = max_searches or config.PIPELINE_STATE_MAX_SEARCHES
+        self.idle_seconds = config.PIPELINE_STATE_IDLE_SECONDS if idle_seconds is None else idle_seconds
+        self._steps: Dict[Optional[str], Deque[Dict[str, Any]]] = {}
+        self._seq: Dict[Optional[str], int] = {}
+        self._unsaved: Dict[Optional[str], List[str]] = {}
+        self._waiters: Dict[Optional[str], asyncio.Event] = {}
+        # Long-polls currently waiting per search (their Event is dropped when the last one leaves)
+        self._waiting: Dict[Optional[str], int] = {}
+        # Search -> time.monotonic() of its last use, least recently used first
+        self._last_used: "OrderedDict[Optional[str], float]" = OrderedDict()
+        self._loading: Dict[Optional[str], asyncio.Future] = {}
+        self._dirty: set = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.flushes = 0
+
+    def path_for(self, search_id: Optional[str], name: str = "pipeline_state.json") -> str:
+        if not search_id:
+            return DEFAULT_STATE_FILE
+        safe_id = re.sub(r"[^\w.-]", "_", str(search_id))
+        return os.path.join(self.state_dir, safe_id, name)
+
+    async def _buffer(self, search_id: Optional[str]) -> Deque[Dict[str, Any]]:
+        while search_id not in self._steps:
+            loading = self._loading.get(search_id)
+            if loading is not None:
+                # Another caller is already loading this search
+                await asyncio.wait([loading])
+                continue
+            loading = self._loading[search_id] = asyncio.get_running_loop().create_future()
+            try:
+                # Continue the history (and the sequence) left on disk by an earlier process or eviction
+                history = []
+                if search_id:
+                    history = await self._run(_read_tail, self.path_for(search_id, "events.ndjson"), self.max_events)
+                steps = deque(history, maxlen=self.max_events)
+                self._steps[search_id] = steps
+                self._seq[search_id] = steps[-1].get("seq", 0) if steps else 0
+            finally:
+                del self._loading[search_id]
+                loading.set_result(None)
+        self._last_used[search_id] = time.monotonic()
+        self._last_used.move_to_end(search_id)
+        self._evict(keep=search_id)
+        return self._steps[search_id]
+
+    def _evict(self, keep: Optional[str] = None):
+        """Drops searches over `max_searches` (least recently used first) or idle for `idle_seconds`."""
+        now = time.monotonic()
+        for search_id, used in list(self._last_used.items()):
+            if len(self._last_used) <= self.max_searches and now - used < self.idle_seconds:
+                break
+            # Unwritten events or open long-polls keep a search in memory
+            if search_id in (None, keep) or search_id in self._dirty or search_id in self._waiting:
+                continue
+            del self._last_used[search_id]
+            self._steps.pop(search_id, None)
+            self._seq.pop(search_id, None)
+
+    async def record(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Appends `message` to its search's log. Returns it with its `seq`."""
+        search_id = message.get("search_id")
+        steps = await self._buffer(search_id)
+        self._seq[search_id] += 1
+        message = {**message, "seq": self._seq[search_id]}
+        steps.append(message)
+        if search_id:
+            self._unsaved.setdefault(search_id, []).append(json.dumps(message, ensure_ascii=False) + "\n")
+        self._dirty.add(search_id)
+
+        waiter = self._waiters.pop(search_id, None)
+        if waiter is not None:
+            waiter.set()
+        loop = asyncio.get_running_loop()
+        # A task left behind by a closed event loop will never run: start a new one
+        if self._flush_task is None or self._flush_task.get_loop() is not loop:
+            self._flush_task = loop.create_task(self._flush_later())
+        return message
+
+    def steps(self, search_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """The last `max_steps` messages of a search (what pipeline_state.json holds)."""
+        steps = self._steps.get(search_id, ())
+        return list(steps)[-self.max_steps:]
+
+    async def events(self, search_id: str, after: int = 0, limit: int = 500) -> List[Dict[str, Any]]:
+        """Up to `limit` events with seq > `after`, oldest first."""
+        path = self.path_for(search_id, "events.ndjson")
+        steps = self._steps.get(search_id)
+        if steps is None:
+            # Not in memory (unknown, finished or evicted): answer from disk without loading
+            # it, so reads for arbitrary search ids never grow the store
+            return await self._run(_read_events, path, after, limit) if search_id else []
+        if not steps or steps[0]["seq"] <= after + 1:
+            return [m for m in steps if m["seq"] > after][:limit]
+        # The cursor is older than the in-memory window: replay from events.ndjson
+        await self.flush()
+        return await self._run(_read_events, path, after, limit)
+
+    async def wait_events(self, search_id: str, after: int = 0, timeout: float = 0,
+                          limit: int = 500) -> List[Dict[str, Any]]:
+        """Like events(), but waits up to `timeout` seconds for one when there are none yet."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            found = await self.events(search_id, after, limit)
+            remaining = deadline - loop.time()
+            if found or remaining <= 0:
+                return found
+            waiter = self._waiters.setdefault(search_id, asyncio.Event())
+            self._waiting[search_id] = self._waiting.get(search_id, 0) + 1
+            try:
+                await asyncio.wait_for(waiter.wait(), remaining)
+            except asyncio.TimeoutError:
+                return []
+            finally:
+                self._waiting[search_id] -= 1
+                if not self._waiting[search_id]:
+                    del self._waiting[search_id]
+                    self._waiters.pop(search_id, None)
+
+    async def _flush_later(self):
         try:
-            await connection.send_json(message)
-        except Exception:
-            disconnected.append(connection)
+            while self._dirty:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+        except Exception as e:
+            print(f"Error updating pipeline state: {e}")
+        finally:
+            if self._flush_task is asyncio.current_task():
+                self._flush_task = None
+
+    async def _run(self, fn, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-state")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def flush(self):
+        """Writes every dirty search's files now."""
+        dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return
+        writes = [
+            (
+                self.path_for(search_id),
+                json.dumps({"search_id": search_id, "steps": self.steps(search_id)},
+                           ensure_ascii=False, separators=(",", ":")),
+                self.path_for(search_id, "events.ndjson") if search_id else None,
+                "".join(self._unsaved.pop(search_id, [])),
+            )
+            for search_id in dirty
+        ]
+        await self._run(_write_files, writes)
+        self.flushes += 1
+        # Searches that were only kept for their unwritten events can go now
+        self._evict()
+
+
+def _write_files(writes: List[tuple]):
+    for state_path, state, events_path, events in writes:
+        _write_atomic(state_path, state)
+        if events_path and events:
+            with open(events_path, "a", encoding="utf-8") as f:
+                f.write(events)
 
-    for d in disconnected:
-        if d in active_connections:
-            active_connections.remove(d)
 
-    # Update pipeline_state.json for Streamlit compatibility
+def _write_atomic(path: str, content: str):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def _read_tail(path: str, count: int) -> List[Dict[str, Any]]:
     try:
-        state_file = "pipeline_state.json"
-        state = {"steps": []}
+        with open(path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in deque(f, maxlen=count)]
+    except (OSError, ValueError):
+        return []
+
+
+def _read_events(path: str, after: int, limit: int) -> List[Dict[str, Any]]:
+    found = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                event = json.loads(line)
+                if event["seq"] > after:
+                    found.append(event)
+                    if len(found) >= limit:
+                        break
+    except FileNotFoundError:
+        pass
+    return found
+
+
+class Subscriber:
+    """
+    One websocket client. Messages wait in a bounded queue drained by the client's own
+    task; when the client falls behind, the oldest queued messages are dropped.
+    `search_id`/`entity_id` (when set) restrict which messages it receives.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        search_id: Optional[str] = None,
+        entity_id: Optional[str] = None,
+        max_queue: Optional[int] = None,
+    ):
+        self.websocket = websocket
+        self.search_id = search_id
+        self.entity_id = entity_id
+        self.queue: Deque[str] = deque(maxlen=max_queue or config.WS_SEND_QUEUE_SIZE)
+        self.dropped = 0
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def matches(self, message: Dict[str, Any]) -> bool:
+        return (
+            (self.search_id is None or message.get("search_id") == self.search_id)
+            and (self.entity_id is None or message.get("entity_id") == self.entity_id)
+        )
+
+    def offer(self, text: str):
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(text)
+        self._ready.set()
+
+    async def drain(self):
+        """Sends queued messages until the websocket fails or the task is cancelled."""
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while self.queue:
+                await self.websocket.send_text(self.queue.popleft())
+
+
+class LogBroadcaster:
+    """
+    Fan-out of log messages to websocket subscribers. publish() never awaits a
+    client: it encodes the message once and appends the same text to each matching
+    subscriber's queue.
+    """
+
+    def __init__(self, max_queue: Optional[int] = None):
+        self.max_queue = max_queue
+        self.subscribers: List[Subscriber] = []
+
+    def subscribe(self, websocket: WebSocket, search_id: Optional[str] = None,
+                  entity_id: Optional[str] = None) -> Subscriber:
+        subscriber = Subscriber(websocket, search_id, entity_id, self.max_queue)
+        self.subscribers.append(subscriber)
+        subscriber._task = asyncio.get_running_loop().create_task(self._run(subscriber))
+        return subscriber
+
+    async def _run(self, subscriber: Subscriber):
         try:
-            with open(state_file, "r", encoding="utf-8") as f:
-                state = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
+            await subscriber.drain()
+        except Exception:
+            # Send failed: the client is gone
             pass
+        finally:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    async def unsubscribe(self, subscriber: Subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+        task = subscriber._task
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
 
-        state["steps"].append(message)
-        # Keep only last 50 steps to avoid file bloat
-        state["steps"] = state["steps"][-50:]
+    def publish(self, message: Dict[str, Any]) -> int:
+        """Queues `message` for every matching subscriber. Returns how many got it."""
+        text = None
+        delivered = 0
+        for subscriber in self.subscribers:
+            if subscriber.matches(message):
+                if text is None:
+                    # Same encoding as WebSocket.send_json, done once per broadcast
+                    text = json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+                subscriber.offer(text)
+                delivered += 1
+        return delivered
 
-        with open(state_file, "w", encoding="utf-8") as f:
-            json.dump(state, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        print(f"Error updating pipeline_state.json: {e}")
+
+pipeline_state = PipelineStateStore()
+broadcaster = LogBroadcaster()
+
+
+async def broadcast_log(data: dict):
+    """
+    Records a log message in its search's event log (`pipeline_state`, which assigns
+    its `seq`) and broadcasts it to the connected WebSocket clients (queued, never awaited).
+    """
+    message = {
+        "timestamp": datetime.now().isoformat(),
+        **data
+    }
+
+    message = await pipeline_state.record(message)
+    broadcaster.publish(message)
+
+
+def broadcast_progress(data: dict):
+    """
+    Sends a transient update (e.g. streaming progress) to the connected WebSocket clients
+    only: it is not recorded, so it gets no `seq` and never reaches events.ndjson,
+    pipeline_state.json or event replay.
+    """
+    broadcaster.publish({"timestamp": datetime.now().isoformat(), **data})